@@ -0,0 +1,217 @@
+"""
+Per-course cache of answers to repeated student questions.
+Questions are normalized so trivially different phrasings ("When is the midterm?" vs
+"when is the midterm") share an answer. Cached answers are course answers, made from the
+course's prompt and materials alone, without any student's conversation, so they can be
+reused for every student in the course. Recently used answers are kept in memory, and all
+answers are stored in SQLite so the cache survives restarts.
+"""
+
+import re
+import datetime
+import logging
+from collections import OrderedDict
+from models.cached_answer import CachedAnswer
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text):
+    """
+    Normalize a question so trivially different phrasings share a cache key.
+
+    Args:
+        text (str): The question, possibly including Discord mentions.
+    Returns:
+        str: The lowercased question, without mentions, punctuation, or extra whitespace.
+    """
+    text = re.sub(r"<[@#][!&]?\d+>", " ", text)  # user, role, and channel mentions
+    text = re.sub(r"@bloombot\b", " ", text, flags=re.IGNORECASE)
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def course_fingerprint(oa_config, materials=None):
+    """
+    Get the fingerprint of a course's OpenAI settings and local materials that determine its answers.
+
+    Args:
+        oa_config (dict): The course's openai_assistant settings.
+        materials (str): The fingerprint of the course's local materials, from CourseIndex.fingerprint(), if any.
+    Returns:
+        str: The fingerprint.
+    """
+    fingerprint = f"{oa_config.get('prompt_id')}|{oa_config.get('vector_store_id')}"
+    if materials:
+        settings = oa_config.get("local_materials", {})
+        fingerprint += (
+            f"|{materials}|{settings.get('top_k')}|{settings.get('min_score')}"
+        )
+    return fingerprint
+
+
+class AnswerCache:
+    """
+    A size-bounded, expiring cache of one course's answers, with an in-memory LRU in front of SQLite.
+    """
+
+    def __init__(self, course, fingerprint, ttl_seconds=7 * 24 * 3600, max_entries=500):
+        """
+        Set up the cache, dropping any stale stored answers.
+
+        Args:
+            course (str): The title of the course.
+            fingerprint (str): The course's current fingerprint, from course_fingerprint().
+            ttl_seconds (int): How long an answer may be reused after it was first given.
+            max_entries (int): The maximum number of answers to keep for the course.
+        """
+        self.course = course
+        self.fingerprint = fingerprint
+        self.ttl = datetime.timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        # question key -> (answer, created_at, ids of users given it), least recent first
+        self.memory = OrderedDict()
+        CachedAnswer.create_table(safe=True)
+        self.invalidate_stale()
+
+    def invalidate_stale(self):
+        """
+        Delete stored answers that were given under a different prompt, vector store, or local materials,
+        or that came from a student's own conversation, keyed by their user id and question.
+
+        Returns:
+            int: The number of answers deleted.
+        """
+        deleted = (
+            CachedAnswer.delete()
+            .where(
+                (CachedAnswer.course == self.course)
+                & (
+                    (CachedAnswer.fingerprint != self.fingerprint)
+                    | CachedAnswer.question_key.contains(":")
+                )
+            )
+            .execute()
+        )
+        if deleted:
+            logger.info(
+                "Dropped %s stale cached answers for '%s'.", deleted, self.course
+            )
+        return deleted
+
+    def get(self, question, user_id):
+        """
+        Get the cached answer to a question, if any.
+        A user who asks a question again after being given its cached answer gets no answer from the cache,
+        since they likely wanted a better one.
+
+        Args:
+            question (str): The question.
+            user_id (int): The Discord id of the user asking it.
+        Returns:
+            str or None: The answer, or None if there is no fresh answer for the user.
+        """
+        key = normalize_question(question)
+        if not key:
+            return None
+        now = datetime.datetime.now()
+
+        # recently used answers are in memory...
+        if key in self.memory:
+            answer, created_at, user_ids = self.memory[key]
+            if now - created_at > self.ttl:
+                self._forget(key)
+                return None
+            self.memory.move_to_end(key)
+            if user_id in user_ids:
+                return None
+            user_ids.add(user_id)
+            self._record_hit(key, now)
+            return answer
+
+        # ...the rest are in the database
+        record = CachedAnswer.get_or_none(
+            (CachedAnswer.course == self.course)
+            & (CachedAnswer.fingerprint == self.fingerprint)
+            & (CachedAnswer.question_key == key)
+        )
+        if not record:
+            return None
+        if now - record.created_at > self.ttl:
+            self._forget(key)
+            return None
+        self._remember(key, record.answer, record.created_at, user_id)
+        self._record_hit(key, now)
+        return record.answer
+
+    def put(self, question, answer, user_id):
+        """
+        Cache the course answer to a question, replacing any earlier one.
+
+        Args:
+            question (str): The question.
+            answer (str): The answer, made without any student's conversation.
+            user_id (int): The Discord id of the user who asked it, and was given the answer.
+        """
+        key = normalize_question(question)
+        if not key or not answer:
+            return
+        now = datetime.datetime.now()
+        CachedAnswer.insert(
+            course=self.course,
+            fingerprint=self.fingerprint,
+            question_key=key,
+            question=question,
+            answer=answer,
+            created_at=now,
+            updated_at=now,
+            last_hit_at=now,
+        ).on_conflict_replace().execute()
+        self._remember(key, answer, now, user_id)
+        self._evict()
+
+    def _remember(self, key, answer, created_at, user_id):
+        """
+        Keep an answer in memory, with the user given it, dropping the least recently used ones beyond the size limit.
+        """
+        self.memory[key] = (answer, created_at, {user_id})
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _forget(self, key):
+        """
+        Drop an expired answer from memory and the database.
+        """
+        self.memory.pop(key, None)
+        CachedAnswer.delete().where(
+            (CachedAnswer.course == self.course)
+            & (CachedAnswer.fingerprint == self.fingerprint)
+            & (CachedAnswer.question_key == key)
+        ).execute()
+
+    def _record_hit(self, key, now):
+        """
+        Count a reuse of an answer, so the least recently used answers are evicted first.
+        """
+        CachedAnswer.update(
+            hits=CachedAnswer.hits + 1, last_hit_at=now, updated_at=now
+        ).where(
+            (CachedAnswer.course == self.course)
+            & (CachedAnswer.fingerprint == self.fingerprint)
+            & (CachedAnswer.question_key == key)
+        ).execute()
+
+    def _evict(self):
+        """
+        Delete the least recently used stored answers beyond the size limit.
+        """
+        keep = (
+            CachedAnswer.select(CachedAnswer.id)
+            .where(CachedAnswer.course == self.course)
+            .order_by(CachedAnswer.last_hit_at.desc())
+            .limit(self.max_entries)
+        )
+        CachedAnswer.delete().where(
+            (CachedAnswer.course == self.course) & (CachedAnswer.id.not_in(keep))
+        ).execute()
@@ -0,0 +1,59 @@
+"""
+Load the settings in bot_config.yml.
+The file may describe a single Discord server under 'server', or several under 'servers',
+so one process can manage many course servers over a single gateway connection.
+"""
+
+from pathlib import Path
+import yaml
+
+CONFIG_FILE = Path("bot_config.yml").resolve()  # path to the configuration file
+
+
+def load_config(config_file=CONFIG_FILE):
+    """
+    Load the raw config data from file.
+
+    Args:
+        config_file (str or Path): The path to the YAML config file.
+    Returns:
+        dict: The config data.
+    """
+    with open(config_file, encoding="utf-8", mode="r") as f:
+        return yaml.safe_load(f) or {}
+
+
+def get_servers(config):
+    """
+    Get the list of servers in the config data, whether it describes one server or several.
+
+    Args:
+        config (dict): The config data.
+    Returns:
+        list: The settings of each server, each with a 'name' and a list of 'courses'.
+    """
+    servers = list(config.get("servers") or [])
+    if config.get("server"):
+        servers.insert(0, config["server"])
+    if not servers:
+        raise RuntimeError("No servers found in config.")
+    for server in servers:
+        server.setdefault("courses", [])
+    return servers
+
+
+def find_course(servers, course_title):
+    """
+    Find a course by its title in any server.
+
+    Args:
+        servers (list): The settings of each server.
+        course_title (str): The title of the course to find.
+    Returns:
+        tuple: (server settings, course settings), or (None, None) if the course was not found.
+    """
+    for server in servers:
+        for course in server["courses"]:
+            if course["title"] == course_title:
+                return server, course
+    return None, None
@@ -0,0 +1,272 @@
+"""
+Metrics for the response bot, served over HTTP in the Prometheus text format.
+Counters, gauges, and histograms are kept in memory in a registry, and rendered when
+the /metrics endpoint is scraped. The server runs on the bot's own event loop, using
+the aiohttp package discord.py already depends on.
+"""
+
+import time
+import bisect
+import logging
+from contextlib import contextmanager
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# seconds... from a fast database write to a slow model response
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels):
+    """
+    Format label names and values as a Prometheus label set, e.g. {course="SE",stage="openai"}.
+    """
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    """
+    A named metric, with a value per combination of label values.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        """
+        Set up the metric.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): What the metric measures.
+            labelnames (tuple): The names of the metric's labels.
+            function (callable): A function returning the metric's value when scraped, for unlabelled metrics whose value lives elsewhere.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values = {}  # tuple of label values -> value
+
+    def _key(self, labels):
+        """
+        Get the tuple of label values for keyword arguments, checking they match the label names.
+        """
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric '{self.name}' takes labels {self.labelnames}, not {tuple(labels)}."
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Get the metric's samples.
+
+        Returns:
+            list: (sample name, label pairs, value) tuples.
+        """
+        if self.function:
+            return [(self.name, (), self.function())]
+        return [
+            (self.name, tuple(zip(self.labelnames, key)), value)
+            for key, value in self.values.items()
+        ]
+
+    def render(self):
+        """
+        Render the metric in the Prometheus text format.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A count that only goes up, e.g. of messages handled.
+    """
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Add to the count.
+
+        Args:
+            amount (float): How much to add.
+            **labels: The value of each label.
+        """
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, e.g. the depth of a queue.
+    """
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        """
+        Set the value.
+
+        Args:
+            value (float): The value.
+            **labels: The value of each label.
+        """
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, e.g. of latencies, counted in cumulative buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Record an observed value.
+
+        Args:
+            value (float): The value.
+            **labels: The value of each label.
+        """
+        key = self._key(labels)
+        if key not in self.values:
+            # a count per bucket, plus one for values above the largest, then the sum
+            self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts = self.values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe how long the body of a with statement takes, even if it raises.
+
+        Args:
+            **labels: The value of each label.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        for key, counts in self.values.items():
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append(
+                    (f"{self.name}_bucket", labels + (("le", bound),), cumulative)
+                )
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """
+    A collection of metrics, rendered together.
+    """
+
+    def __init__(self):
+        self.metrics = {}  # name -> metric
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        """
+        Create and register a counter.
+        """
+        return self._register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        """
+        Create and register a gauge.
+        """
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Create and register a histogram.
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text format.
+        """
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+def http_status_trace(counter):
+    """
+    Create an aiohttp trace config that counts rate-limited (429) responses, e.g. for discord.py's http_trace option.
+
+    Args:
+        counter (Counter): A counter with a 'scope' label, set from Discord's X-RateLimit-Scope header.
+    Returns:
+        aiohttp.TraceConfig: The trace config.
+    """
+
+    async def on_request_end(session, context, params):
+        if params.response.status == 429:
+            scope = params.response.headers.get("X-RateLimit-Scope", "unknown")
+            counter.inc(scope=scope)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+async def start_server(registry, host="127.0.0.1", port=9108, handlers=None):
+    """
+    Serve the registry's metrics at /metrics.
+
+    Args:
+        registry (Registry): The metrics to serve.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        handlers (dict): Other aiohttp GET handlers to serve, keyed by path, e.g. for debugging. If None, only metrics are served.
+    Returns:
+        aiohttp.web.AppRunner: The running server, to clean up with its cleanup() method.
+    """
+
+    async def metrics(request):
+        return web.Response(
+            text=registry.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    for path, handler in (handlers or {}).items():
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Serving metrics at http://%s:%s/metrics", host, port)
+    return runner
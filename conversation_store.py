@@ -0,0 +1,215 @@
+"""
+Persistent, bounded OpenAI conversations with each user in each course.
+Every response carries the conversation's history, so a conversation that grows all
+semester makes each reply slower and costlier than the last. Once a conversation passes
+a turn or token limit, it is retired and replaced by a new one seeded with a summary of it,
+so the history sent with each request stays roughly the same size all semester long.
+"""
+
+import asyncio
+import datetime
+import logging
+from models.base import db
+from models.user import User
+from models.conversation import Conversation
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize our conversation so far in one short paragraph, for your own future reference. "
+    "Include the questions I asked, what you told me, and anything about me or my work "
+    "that would help you answer my future questions. Do not include greetings."
+)
+
+
+class ConversationStore:
+    """
+    Get, track, and compact the OpenAI conversations of users in courses.
+    """
+
+    def __init__(self, openai_client):
+        """
+        Set up the store.
+
+        Args:
+            openai_client (openai.AsyncOpenAI): The OpenAI client to create conversations with.
+        """
+        self.openai_client = openai_client
+        self.compacting = set()  # ids of conversations being compacted
+        # (user id, course) -> lock, so a conversation is only created once
+        self.locks = {}
+        db.create_tables([Conversation], safe=True)
+
+    async def get(self, author, course_name):
+        """
+        Get a user's active conversation in a course, creating one if they have none.
+        Also used to create conversations ahead of a user's first question, so it skips that round trip.
+
+        Args:
+            author (discord.User): The Discord user.
+            course_name (str): The title of the course.
+        Returns:
+            Conversation: The active conversation.
+        """
+        lock = self.locks.setdefault((author.id, course_name), asyncio.Lock())
+        async with lock:
+            user, created = User.get_or_create(
+                discord_id=author.id, discord_username=author.name
+            )
+            conversation = Conversation.get_or_none(
+                (Conversation.user == user)
+                & (Conversation.course == course_name)
+                & (Conversation.active == True)
+            )
+            if conversation:
+                return conversation
+            return await self._create(user, author, course_name)
+
+    async def _create(self, user, author, course_name, summary=None, previous=None):
+        """
+        Create a new OpenAI conversation for a user in a course, seeded with a summary of the previous one, if any.
+        """
+        items = [
+            {
+                "role": "user",
+                "content": f"My name is {author.name} (user id <@{author.id}>) and I am a student in the {course_name} course.",
+            }
+        ]
+        if summary:
+            items.append(
+                {
+                    "role": "assistant",
+                    "content": f"Summary of our conversation so far: {summary}",
+                }
+            )
+        openai_conversation = await self.openai_client.conversations.create(
+            items=items, metadata={"user_id": f"<@{author.id}>"}
+        )
+        conversation = Conversation.create(
+            user=user,
+            course=course_name,
+            openai_conversation_id=openai_conversation.id,
+            summary=summary,
+            previous=previous,
+        )
+        logger.debug(
+            "Created OpenAI Conversation ID %s for user @%s (%s) in '%s'",
+            conversation.openai_conversation_id,
+            author.name,
+            author.id,
+            course_name,
+        )
+        return conversation
+
+    async def history(self, conversation):
+        """
+        Get the messages of a conversation so far, to make a request with outside of it.
+
+        Args:
+            conversation (Conversation): The conversation.
+        Returns:
+            list: The conversation's messages, oldest first, as input items of the responses API.
+        """
+        items = []
+        async for item in self.openai_client.conversations.items.list(
+            conversation.openai_conversation_id, order="asc", limit=100
+        ):
+            if item.type != "message":
+                continue  # e.g. file searches... what they found is in the answers after them
+            text = "".join(getattr(part, "text", None) or "" for part in item.content)
+            if text:
+                items.append({"role": item.role, "content": text})
+        return items
+
+    async def add_turn(self, conversation, question, answer):
+        """
+        Add a question and its answer, made outside of a conversation, to the conversation.
+
+        Args:
+            conversation (Conversation): The conversation.
+            question (str): The user's question.
+            answer (str): The answer they were given.
+        """
+        await self.openai_client.conversations.items.create(
+            conversation.openai_conversation_id,
+            items=[
+                {"type": "message", "role": "user", "content": question},
+                {"type": "message", "role": "assistant", "content": answer},
+            ],
+        )
+
+    def record_turn(self, conversation, usage):
+        """
+        Count a response in a conversation.
+
+        Args:
+            conversation (Conversation): The conversation.
+            usage (openai.types.responses.ResponseUsage): The response's token usage, if known.
+        """
+        conversation.turns += 1
+        if usage is not None:
+            # the input of the latest response is the whole history so far
+            conversation.tokens = usage.input_tokens + usage.output_tokens
+        conversation.updated_at = datetime.datetime.now()
+        conversation.save()
+
+    def needs_compaction(self, conversation, max_turns, max_tokens):
+        """
+        Check whether a conversation has grown past its limits.
+
+        Args:
+            conversation (Conversation): The conversation.
+            max_turns (int): The maximum number of responses.
+            max_tokens (int): The maximum number of tokens used by a response.
+        Returns:
+            bool: Whether the conversation should be compacted.
+        """
+        return conversation.active and (
+            conversation.turns >= max_turns or conversation.tokens >= max_tokens
+        )
+
+    async def compact(self, conversation, author, model):
+        """
+        Replace a conversation with a new one seeded with a summary of it.
+
+        Args:
+            conversation (Conversation): The conversation to compact.
+            author (discord.User): The Discord user the conversation is with.
+            model (str): The model to summarize the conversation with.
+        Returns:
+            Conversation or None: The new conversation, or None if it is already being compacted.
+        """
+        if conversation.id in self.compacting:
+            return None
+        self.compacting.add(conversation.id)
+        try:
+            response = await self.openai_client.responses.create(
+                model=model,
+                conversation=conversation.openai_conversation_id,
+                input=[{"role": "user", "content": SUMMARY_INSTRUCTIONS}],
+                max_output_tokens=512,
+                store=True,
+            )
+            summary = response.output_text.strip()
+            new_conversation = await self._create(
+                conversation.user,
+                author,
+                conversation.course,
+                summary=summary,
+                previous=conversation,
+            )
+            conversation.active = False
+            conversation.updated_at = datetime.datetime.now()
+            conversation.save()
+            logger.info(
+                "Compacted OpenAI Conversation ID %s (%s turns, %s tokens) into %s for user @%s (%s)",
+                conversation.openai_conversation_id,
+                conversation.turns,
+                conversation.tokens,
+                new_conversation.openai_conversation_id,
+                author.name,
+                author.id,
+            )
+            return new_conversation
+        finally:
+            self.compacting.discard(conversation.id)
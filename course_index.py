@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""
+Local retrieval index over each course's materials.
+Splits text files in a course's materials directory into passages, keeps a BM25 inverted
+index of them in the database, and re-indexes only the files that changed since last time.
+The bot attaches the best passages to its OpenAI requests, so remote file_search can be skipped.
+Run from the command line to update the indexes and try queries offline, e.g.
+    python course_index.py --update
+    python course_index.py --course "Software Engineering" --query "when is the midterm?"
+"""
+
+import re
+import math
+import hashlib
+import argparse
+from collections import Counter
+from pathlib import Path
+from peewee import fn
+from models.base import db
+from models.indexed_file import IndexedFile
+from models.passage import Passage
+from models.posting import Posting
+
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".markdown", ".rst", ".csv", ".html", ".htm")
+PASSAGE_WORDS = 200  # approximate number of words per passage
+STOPWORDS = set(
+    "a an and are as at be but by for from has have how i if in is it its of on or "
+    "so that the their there this to was we what when where which who why will with "
+    "you your".split()
+)
+
+
+def tokenize(text):
+    """
+    Split text into normalized terms for indexing and searching.
+
+    Args:
+        text (str): The text.
+    Returns:
+        list: The lowercased terms, without stopwords.
+    """
+    return [
+        term for term in re.findall(r"[a-z0-9]+", text.lower()) if term not in STOPWORDS
+    ]
+
+
+def split_passages(text, max_words=PASSAGE_WORDS):
+    """
+    Split text into passages of roughly max_words words, keeping paragraphs together where possible.
+
+    Args:
+        text (str): The text.
+        max_words (int): The approximate maximum number of words per passage.
+    Returns:
+        list: The passages.
+    """
+    text = re.sub(r"<[^>]+>", " ", text)  # drop any HTML tags
+    passages, current, count = [], [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        while words:
+            room = max_words - count
+            if len(words) > room and current:
+                # this paragraph doesn't fit... start a new passage
+                passages.append(" ".join(current))
+                current, count = [], 0
+                continue
+            current.extend(words[:max_words])
+            count += len(words[:max_words])
+            words = words[max_words:]
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+class CourseIndex:
+    """
+    A BM25 inverted index over the passages of one course's materials.
+    """
+
+    def __init__(self, course, materials_dir, k1=1.5, b=0.75):
+        """
+        Set up the index. Call update() to index new or changed files.
+
+        Args:
+            course (str): The title of the course.
+            materials_dir (str or Path): The directory holding the course's materials.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 passage length normalization.
+        """
+        self.course = course
+        self.materials_dir = Path(materials_dir).expanduser().resolve()
+        self.k1 = k1
+        self.b = b
+        db.create_tables([IndexedFile, Passage, Posting], safe=True)
+
+    def update(self):
+        """
+        Index new and changed files, and drop files that were removed.
+
+        Returns:
+            tuple: (number of files indexed, number of files removed)
+        """
+        on_disk = {}
+        if self.materials_dir.is_dir():
+            for path in self.materials_dir.rglob("*"):
+                if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS:
+                    on_disk[str(path.relative_to(self.materials_dir))] = path.stat()
+        indexed = {
+            record.path: record
+            for record in IndexedFile.select().where(IndexedFile.course == self.course)
+        }
+
+        num_indexed = num_removed = 0
+        with db.atomic():
+            for path, record in indexed.items():
+                if path not in on_disk:
+                    self._remove(record)
+                    num_removed += 1
+            for path, stat in on_disk.items():
+                record = indexed.get(path)
+                if (
+                    record
+                    and record.mtime == stat.st_mtime
+                    and record.size == stat.st_size
+                ):
+                    continue  # unchanged since last indexed
+                if record:
+                    self._remove(record)
+                self._add(path, stat)
+                num_indexed += 1
+        return num_indexed, num_removed
+
+    def fingerprint(self):
+        """
+        Get a fingerprint of the indexed files, which changes whenever one is added, changed, or removed.
+
+        Returns:
+            str: The fingerprint.
+        """
+        files = (
+            IndexedFile.select(IndexedFile.path, IndexedFile.mtime, IndexedFile.size)
+            .where(IndexedFile.course == self.course)
+            .order_by(IndexedFile.path)
+            .tuples()
+        )
+        return hashlib.sha256(repr(list(files)).encode("utf-8")).hexdigest()[:16]
+
+    def _remove(self, record):
+        """
+        Remove a file and its passages and postings from the index.
+        """
+        passage_ids = Passage.select(Passage.id).where(Passage.file == record)
+        Posting.delete().where(Posting.passage.in_(passage_ids)).execute()
+        Passage.delete().where(Passage.file == record).execute()
+        record.delete_instance()
+
+    def _add(self, path, stat):
+        """
+        Split a file into passages and add them and their postings to the index.
+        """
+        text = (self.materials_dir / path).read_text(encoding="utf-8", errors="ignore")
+        record = IndexedFile.create(
+            course=self.course, path=path, mtime=stat.st_mtime, size=stat.st_size
+        )
+        for ordinal, content in enumerate(split_passages(text)):
+            terms = Counter(tokenize(content))
+            passage = Passage.create(
+                file=record,
+                course=self.course,
+                ordinal=ordinal,
+                content=content,
+                length=sum(terms.values()),
+            )
+            Posting.insert_many(
+                [
+                    {
+                        "course": self.course,
+                        "term": term,
+                        "passage": passage,
+                        "frequency": frequency,
+                    }
+                    for term, frequency in terms.items()
+                ]
+            ).execute()
+
+    def search(self, query, top_k=4):
+        """
+        Find the passages that best match a query.
+
+        Args:
+            query (str): The query, e.g. a student's question.
+            top_k (int): The maximum number of passages to return.
+        Returns:
+            list: (score, path, passage text) tuples, best match first.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        stats = (
+            Passage.select(
+                fn.COUNT(Passage.id).alias("num_passages"),
+                fn.AVG(Passage.length).alias("avg_length"),
+            )
+            .where(Passage.course == self.course)
+            .dicts()
+            .get()
+        )
+        num_passages, avg_length = stats["num_passages"], stats["avg_length"] or 1
+        if not num_passages:
+            return []
+
+        # accumulate BM25 scores from the postings of each query term
+        postings = (
+            Posting.select(Posting.term, Posting.frequency, Passage.id, Passage.length)
+            .join(Passage)
+            .where((Posting.course == self.course) & (Posting.term.in_(list(terms))))
+            .tuples()
+        )
+        by_term = {}
+        for term, frequency, passage_id, length in postings:
+            by_term.setdefault(term, []).append((passage_id, frequency, length))
+        scores = Counter()
+        for term, matches in by_term.items():
+            df = len(matches)
+            idf = math.log(1 + (num_passages - df + 0.5) / (df + 0.5))
+            for passage_id, frequency, length in matches:
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[passage_id] += (
+                    idf * frequency * (self.k1 + 1) / (frequency + norm)
+                )
+
+        best = scores.most_common(top_k)
+        passages = {
+            passage.id: passage
+            for passage in Passage.select(Passage, IndexedFile)
+            .join(IndexedFile)
+            .where(Passage.id.in_([passage_id for passage_id, score in best]))
+        }
+        return [
+            (
+                round(score, 3),
+                passages[passage_id].file.path,
+                passages[passage_id].content,
+            )
+            for passage_id, score in best
+        ]
+
+
+def get_course_indexes(servers):
+    """
+    Get the local retrieval index of each course that has a local materials directory configured.
+
+    Args:
+        servers (list): The settings of each server, from bot_config.get_servers().
+    Returns:
+        dict: Course title -> (CourseIndex, local_materials settings).
+    """
+    indexes = {}
+    for server in servers:
+        for course in server["courses"]:
+            settings = course.get("openai_assistant", {}).get("local_materials")
+            if settings and settings.get("directory"):
+                indexes[course["title"]] = (
+                    CourseIndex(course["title"], settings["directory"]),
+                    settings,
+                )
+    return indexes
+
+
+# Run from the command line to update indexes or try queries
+if __name__ == "__main__":
+    from bot_config import load_config, get_servers
+
+    parser = argparse.ArgumentParser(description="Local course material index.")
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Index new and changed files of every configured course.",
+    )
+    parser.add_argument("--course", help="Title of the course to search.")
+    parser.add_argument("--query", help="Query to search the course's materials for.")
+    parser.add_argument(
+        "--top-k", type=int, default=4, help="Number of passages to show."
+    )
+    args = parser.parse_args()
+
+    indexes = get_course_indexes(get_servers(load_config()))
+    if args.update:
+        for title, (index, settings) in indexes.items():
+            num_indexed, num_removed = index.update()
+            print(
+                f"- '{title}': {num_indexed} files indexed, {num_removed} removed from {index.materials_dir}"
+            )
+    if args.query:
+        if args.course not in indexes:
+            parser.error(f"No local materials configured for course '{args.course}'.")
+        index, settings = indexes[args.course]
+        for score, path, content in index.search(args.query, args.top_k):
+            print(f"[{score}] {path}: {content[:300]}\n")
@@ -1,10 +1,18 @@
 import os
+import sys
+import time
 import discord
 from discord import app_commands
 from dotenv import load_dotenv
+from member_matcher import MemberMatcher
+from permission_audit import PermissionAudit
+from member_snapshot import MemberSnapshot
+from listing_writer import ListingWriter
 
 load_dotenv()  # load environment variables from .env file
 
+MEMBER_MATCHER_MAX_AGE = 300  # seconds before a fuzzy member name index is rebuilt
+
 
 class DiscordManager(discord.Client):
     """
@@ -39,6 +47,7 @@ class DiscordManager(discord.Client):
         show_channels=False,
         show_users=False,
         guild_id=None,
+        guild_ids=None,
         category_id=None,
         channel_id=None,
         user_id=None,
@@ -47,6 +56,18 @@ class DiscordManager(discord.Client):
         delete_channel=None,
         create_category=None,
         create_channel=None,
+        audit_permissions=False,
+        export_permissions=None,
+        without_private_channel=False,
+        output_format="text",
+        output_fields=None,
+        shard_count=None,
+        shard_ids=None,
+        lean=False,
+        member_events=False,
+        message_filter=None,
+        http_trace=None,
+        rate_limit_priority=None,
         **kwargs,
     ):
         """
@@ -60,6 +81,7 @@ class DiscordManager(discord.Client):
             show_channels (bool): Whether to show the available channels in the specified guild and optional category.
             show_users (bool): Whether to show the available users in the specified guild and optional category or channel.
             guild_id (int or str): The ID or name of the guild to operate on.
+            guild_ids (list): The IDs or names of several guilds to manage in this one process. Defaults to just guild_id, if any.
             category_id (int or str): The ID or name of the category to operate on. If None, no specific category is targeted.
             channel_id (int or str): The ID or name of the channel to operate on. If None, no specific channel is targeted.
             user_id (int or str): The ID or name of the user to operate on. If None, no specific user is targeted.
@@ -68,18 +90,74 @@ class DiscordManager(discord.Client):
             delete_channel (int or str): The ID or name of the channel to delete. If None, no channel is deleted.
             create_category (str): The name of the category to create. If None, no category is created.
             create_channel (str): The name of the channel to create. If None, no channel is created.
+            audit_permissions (bool): Whether to audit who can see the channels in the specified guild and optional category.
+            export_permissions (str): The file path to export the effective-permission matrix to. If None, nothing is exported.
+            without_private_channel (bool): Whether to only show users who have no channel opened specifically to them.
+            output_format (str): How to show servers, categories, channels, and users: 'text', 'jsonl', or 'csv'.
+            output_fields (list): The fields to include in 'jsonl' or 'csv' output. If None, all fields are included.
+            shard_count (int): The total number of gateway shards across all processes. If None, Discord's recommendation is used when sharded.
+            shard_ids (list): The shard IDs this process connects to. Only used by AutoShardedDiscordManager.
+            lean (bool): Whether to only receive guild and message events, without caching members or messages. For bots that only answer messages.
+            member_events (bool): Whether to receive member events in lean mode. Requires SERVER MEMBERS INTENT permission in Discord Developer Portal.
+            message_filter (callable): A function taking the raw data of each incoming message and returning whether to process it. If None, all messages are processed.
+            http_trace (aiohttp.TraceConfig): Hooks into Discord's HTTP requests, e.g. to count rate-limited responses. If None, requests are not traced.
+            rate_limit_priority (str): Share Discord rate limits with other processes using the same token, as 'interactive' or 'bulk' traffic. If None, rate limits are not shared.
 
 
         """
 
-        # Set intents to allow managing channels
-        intents = discord.Intents.default()
-        intents.guilds = True
-        # intents.guild_messages = True
-        # intents.guild_reactions = True
-        intents.members = True  # requires SERVER MEMBERS INTENT permission in Discord Developer Portalf
-        intents.message_content = True  # requires MESSAGE CONTENT INTENT permission in Discord Developer Portalf
-        super().__init__(intents=intents)
+        # sharding options, if any... plain clients ignore shard_ids
+        options = {}
+        if shard_count is not None:
+            options["shard_count"] = int(shard_count)
+        if shard_ids is not None:
+            options["shard_ids"] = list(shard_ids)
+        # pace requests by the rate limits every process using this token has seen
+        self.rate_limit_governor = None
+        if rate_limit_priority:
+            # imported here, since only clients that share rate limits need the database
+            from rate_limit_governor import RateLimitGovernor
+
+            self.rate_limit_governor = RateLimitGovernor(priority=rate_limit_priority)
+            http_trace = self.rate_limit_governor.trace_config(http_trace)
+        if http_trace is not None:
+            options["http_trace"] = http_trace
+
+        if lean:
+            # only the events needed to answer messages, and no member, presence, or message caches
+            intents = discord.Intents.none()
+            intents.guilds = True
+            intents.guild_messages = True
+            intents.message_content = True  # requires MESSAGE CONTENT INTENT permission in Discord Developer Portalf
+            intents.members = member_events
+            options["member_cache_flags"] = discord.MemberCacheFlags.none()
+            options["chunk_guilds_at_startup"] = False
+            options["max_messages"] = None
+        else:
+            # Set intents to allow managing channels
+            intents = discord.Intents.default()
+            intents.guilds = True
+            # intents.guild_messages = True
+            # intents.guild_reactions = True
+            intents.members = True  # requires SERVER MEMBERS INTENT permission in Discord Developer Portalf
+            intents.message_content = True  # requires MESSAGE CONTENT INTENT permission in Discord Developer Portalf
+        super().__init__(intents=intents, **options)
+
+        # drop unwanted messages from their raw gateway data, before any Message objects are built
+        self.message_filter = message_filter
+        self.messages_accepted = 0
+        self.messages_dropped = 0
+        if message_filter:
+            parse_message_create = self._connection.parsers["MESSAGE_CREATE"]
+
+            def filtered_message_create(data):
+                if self.message_filter(data):
+                    self.messages_accepted += 1
+                    parse_message_create(data)
+                else:
+                    self.messages_dropped += 1
+
+            self._connection.parsers["MESSAGE_CREATE"] = filtered_message_create
 
         # store instance properties from arguments
         self.token = token
@@ -89,6 +167,9 @@ class DiscordManager(discord.Client):
         self.show_channels = show_channels
         self.show_users = show_users
         self.guild_id = guild_id
+        self.guild_ids = list(guild_ids) if guild_ids else []
+        if guild_id and guild_id not in self.guild_ids:
+            self.guild_ids.insert(0, guild_id)
         self.category_id = category_id
         self.channel_id = channel_id
         self.user_id = user_id
@@ -97,6 +178,32 @@ class DiscordManager(discord.Client):
         self.delete_channel = delete_channel
         self.create_category = create_category
         self.create_channel = create_channel
+        self.audit_permissions = audit_permissions
+        self.export_permissions = export_permissions
+        self.without_private_channel = without_private_channel
+        self.output_format = output_format
+        self.output_fields = output_fields
+        self.member_matchers = {}  # fuzzy member name indexes, keyed by guild id
+
+    def add_raw_hook(self, event, hook):
+        """
+        Call a function with the raw data of every gateway event of a type, before discord.py handles it.
+        Unlike event handlers, hooks are called even when the objects involved are not cached, e.g. in lean mode.
+
+        Args:
+            event (str): The gateway event type, e.g. 'GUILD_MEMBER_UPDATE'.
+            hook (callable): A function taking the event's raw data. It must not block.
+        """
+        parse = self._connection.parsers[event]
+
+        def hooked(data):
+            try:
+                hook(data)
+            finally:
+                # a failing hook must not stop discord.py from handling the event
+                parse(data)
+
+        self._connection.parsers[event] = hooked
 
     def fix_ids(self):
         """
@@ -108,6 +215,11 @@ class DiscordManager(discord.Client):
             if isinstance(self.guild_id, int) or not self.guild_id
             else self.get_server_id(self.guild_id)
         )
+        guild_ids = (
+            guild_id if isinstance(guild_id, int) else self.get_server_id(guild_id)
+            for guild_id in self.guild_ids
+        )
+        self.guild_ids = [guild_id for guild_id in guild_ids if guild_id]
         self.category_id = (
             self.category_id
             if isinstance(self.category_id, int) or not self.category_id
@@ -299,6 +411,66 @@ class DiscordManager(discord.Client):
                 return member.id
         return None
 
+    def get_member_matcher(self, guild_id, rebuild=False):
+        """
+        Get the fuzzy name index over the members of a guild, building it if necessary.
+        The index is rebuilt automatically whenever the guild's member count changes,
+        and once it is older than MEMBER_MATCHER_MAX_AGE seconds, so renamed members are found.
+
+        Args:
+            guild_id (int): The ID of the guild to index.
+            rebuild (bool): Whether to force the index to be rebuilt.
+        Returns:
+            MemberMatcher or None: The index, or None if the guild was not found.
+        """
+        guild = self.get_guild(int(guild_id))
+        if not guild:
+            print(f"Guild ID {guild_id} not found.")
+            return None
+        matcher = self.member_matchers.get(guild.id)
+        if (
+            rebuild
+            or not matcher
+            or len(matcher) != len(guild.members)
+            or time.monotonic() - matcher.built_at > MEMBER_MATCHER_MAX_AGE
+        ):
+            matcher = MemberMatcher(guild.members)
+            self.member_matchers[guild.id] = matcher
+        return matcher
+
+    def suggest_users(self, guild_id, user_name, limit=3, min_score=0.3):
+        """
+        Suggest the guild members whose names best match a user name that has no exact match.
+
+        Args:
+            guild_id (int): The ID of the guild to search in.
+            user_name (str): The (possibly mistyped) name of the user to find.
+            limit (int): The maximum number of suggestions to return.
+            min_score (float): The minimum score, between 0 and 1, for a suggestion to be returned.
+        Returns:
+            list: (member_id, member_name, score) tuples, best match first.
+        """
+        matcher = self.get_member_matcher(guild_id)
+        if not matcher:
+            return []
+        return matcher.suggest(user_name, limit=limit, min_score=min_score)
+
+    def snapshot_members(self, guild_id, private_category_ids=None):
+        """
+        Take a compact, array-backed snapshot of the members of a guild, for fast set queries.
+
+        Args:
+            guild_id (int): The ID of the guild to snapshot.
+            private_category_ids (iterable): IDs of the categories that hold private channels. If None, all channels are considered.
+        Returns:
+            MemberSnapshot or None: The snapshot, or None if the guild was not found.
+        """
+        guild = self.get_guild(int(guild_id))
+        if not guild:
+            print(f"Guild ID {guild_id} not found.")
+            return None
+        return MemberSnapshot.from_guild(guild, private_category_ids)
+
     def get_role_id(self, guild_id, role_name):
         """
         Get the role ID by name or ID.
@@ -476,17 +648,122 @@ class DiscordManager(discord.Client):
         await user.add_roles(role)
         print(f"User '{user.name}' added to role '{role.name}'.")
 
+    def write_listing(self, rows):
+        """
+        Stream listing rows to standard output in the structured output format, if one was selected.
+
+        Args:
+            rows (iterable): The rows to write, each a dictionary of fields.
+        Returns:
+            bool: True if the rows were written, False if the output format is plain text.
+        """
+        if self.output_format == "text":
+            return False
+        ListingWriter(self.output_format, self.output_fields).write_all(rows)
+        return True
+
+    def iter_guilds(self):
+        """
+        Generate a listing row for each of the available servers (a.k.a. guilds).
+        """
+        for guild in self.guilds:
+            yield {
+                "id": guild.id,
+                "name": guild.name,
+                "member_count": guild.member_count,
+            }
+
+    def iter_categories(self, guild):
+        """
+        Generate a listing row for each category in the specified guild.
+        """
+        for category in guild.categories:
+            yield {
+                "id": category.id,
+                "name": category.name,
+                "position": category.position,
+                "guild_id": guild.id,
+            }
+
+    def iter_channels(self, guild, category=None):
+        """
+        Generate a listing row for each channel in the specified guild, or in the specified category.
+        Without a category, only text and voice channels are included.
+        """
+        if category:
+            channels = category.channels
+        else:
+            channels = (
+                channel
+                for channel in guild.channels
+                if isinstance(channel, (discord.TextChannel, discord.VoiceChannel))
+            )
+        for channel in channels:
+            yield {
+                "id": channel.id,
+                "name": channel.name,
+                "type": str(channel.type),
+                "category_id": channel.category_id,
+                "category": channel.category.name if channel.category else None,
+                "guild_id": guild.id,
+            }
+
+    def iter_users(
+        self,
+        guild,
+        category=None,
+        channel=None,
+        role_id=None,
+        without_private_channel=False,
+    ):
+        """
+        Generate a listing row for each user in the specified guild, optionally filtered by category or channel,
+        or by role and whether they have a channel opened specifically to them.
+        """
+        if channel:
+            # users in channel
+            members = channel.members
+        elif category:
+            # users who can see the category, computed in one pass rather than member by member
+            audit = PermissionAudit(guild, channels=[category])
+            members = audit.members_who_can(category.id)
+        elif role_id or without_private_channel:
+            # query a snapshot of the guild's members, rather than scanning member objects
+            snapshot = self.snapshot_members(guild.id)
+            member_bits = snapshot.role(role_id) if role_id else snapshot.everyone()
+            if without_private_channel:
+                member_bits = member_bits & ~snapshot.group("private_channel")
+            members = (
+                guild.get_member(member_id) for member_id in snapshot.ids(member_bits)
+            )
+        else:
+            # all members in the guild
+            members = guild.members
+        for member in members:
+            yield {
+                "id": member.id,
+                "name": member.name,
+                "display_name": member.display_name,
+                "roles": [
+                    role.name for role in member.roles if role.name != "@everyone"
+                ],
+                "bot": member.bot,
+            }
+
     def print_guilds(self):
         """
         Print a list of the available servers (a.k.a. guilds).
         """
+        if self.write_listing(self.iter_guilds()):
+            return
+
         # show the available servers (a.k.a. guilds)
         print(f"{'SERVERS/GUILDS':^67}")
         print(f"{'':-^67}")
         print(f"| {'Server Name':<30} | {'ID':<30} |")
         print(f"| {'':-^30} | {'':-^30} |")
-        for i, guild in enumerate(self.guilds, start=1):
-            print(f"| {guild.name:<30} | {guild.id:<30} |")
+        for row in self.iter_guilds():
+            print(f"| {row['name']:<30} | {row['id']:<30} |")
         print(f"{'':-^67}")
         print()
 
@@ -500,13 +777,16 @@ class DiscordManager(discord.Client):
             print(f"Guild ID {guild_id} not found.")
             return
 
+        if self.write_listing(self.iter_categories(guild)):
+            return
+
         print(f"{guild.name.upper():^67}")
         print(f"{'':-^67}")
         # print(f"| {'':-^30} | {'':-^30} |")
         print(f"| {'Category Name':<30} | {'ID':<30} |")
         print(f"| {'':-^30} | {'':-^30} |")
-        for category in guild.categories:
-            print(f"| {category.name:<30} | {category.id:<30} |")
+        for row in self.iter_categories(guild):
+            print(f"| {row['name']:<30} | {row['id']:<30} |")
         print(f"{'':-^67}")
         print()
 
@@ -522,43 +802,45 @@ class DiscordManager(discord.Client):
             print(f"Guild ID {guild_id} not found.")
             return
 
+        category = None
         if category_id:
             category_id = self.get_category_id(guild_id, category_id)  # ensure int
             # specific category specified
             category = guild.get_channel(category_id)  # get category details, if any
+            if not category or not isinstance(category, discord.CategoryChannel):
+                print("Category not found or invalid.")
+                return
 
-            subheading = f"{guild.name.upper()} / '{category.name.upper()}'"
-            print(f"{subheading:^67}")
-            print(f"{'':-^67}")
-            print(f"| {'Channel Name':<30} | {'ID':<30} |")
-            print(f"| {'':-^30} | {'':-^30} |")
+        if self.write_listing(self.iter_channels(guild, category)):
+            return
 
-            # iterate through all channels in the specified category
-            if category and isinstance(category, discord.CategoryChannel):
-                for channel in category.channels:
-                    print(f"| {channel.name:<30} | {channel.id:<30} |")
-            else:
-                print("Category not found or invalid.")
+        if category:
+            subheading = f"{guild.name.upper()} / '{category.name.upper()}'"
         else:
-            # no category specified
-            print(f"{guild.name.upper():^67}")
-            print(f"{'':-^67}")
-            print(f"| {'Channel Name':<30} | {'ID':<30} |")
-            print(f"| {'':-^30} | {'':-^30} |")
+            subheading = f"{guild.name.upper()}"
+        print(f"{subheading:^67}")
+        print(f"{'':-^67}")
+        print(f"| {'Channel Name':<30} | {'ID':<30} |")
+        print(f"| {'':-^30} | {'':-^30} |")
 
-            # iterate through all channels in the server/guild
-            for channel in guild.channels:
-                if isinstance(channel, discord.TextChannel) or isinstance(
-                    channel, discord.VoiceChannel
-                ):
-                    print(f"| {channel.name:<30} | {channel.id:<30} |")
+        # iterate through all channels in the server/guild or specified category
+        for row in self.iter_channels(guild, category):
+            print(f"| {row['name']:<30} | {row['id']:<30} |")
 
         print(f"{'':-^67}")
         print()
 
-    def print_users(self, guild_id, category_id=None, channel_id=None):
+    def print_users(
+        self,
+        guild_id,
+        category_id=None,
+        channel_id=None,
+        role_id=None,
+        without_private_channel=False,
+    ):
         """
-        Print a list of users in the specified guild, optionally filtered by category or channel.
+        Print a list of users in the specified guild, optionally filtered by category or channel,
+        or by role and whether they have a channel opened specifically to them.
         """
         guild = self.get_guild(int(guild_id))
         if not guild:
@@ -566,62 +848,89 @@ class DiscordManager(discord.Client):
             return
 
         subheading = f"{guild.name.upper()}"
+        category = None
         if category_id:
             category_id = self.get_category_id(guild_id, category_id)  # ensure int
             category = guild.get_channel(category_id)
             if category and isinstance(category, discord.CategoryChannel):
                 subheading += f" / '{category.name.upper()}'"
+            else:
+                category = None
+        channel = None
         if channel_id:
             channel = guild.get_channel(int(channel_id))
             if channel:
                 subheading += f" / '{channel.name.upper()}'"
 
+        rows = self.iter_users(
+            guild, category, channel, role_id, without_private_channel
+        )
+        if self.write_listing(rows):
+            return
+
         print(f"{subheading:^100}")
         print(f"{'':-^100}")
         print(f"| {'User Name':<30} | {'ID':<30} | {'Roles':<30} |")
         print(f"| {'':-^30} | {'':-^30} | {'':-^30} |")
+        for row in rows:
+            # determine this user's roles
+            roles = ", ".join(row["roles"])
+            print(f"| {row['name']:<30} | {row['id']:<30} | {roles:<30} |")
+        print(f"{'':-^100}")
+        print()
 
-        if channel_id:
-            # users in channel
-            channel = guild.get_channel(int(channel_id))
-            if channel:
-                for member in channel.members:
-                    # determine this user's roles
-                    roles = ", ".join(
-                        role.name for role in member.roles if role.name != "@everyone"
-                    )
-                    print(f"| {member.name:<30} | {member.id:<30} | {roles:<30} |")
-                print(f"{'':-^100}")
-                print()
-                return
+    def print_permission_audit(self, guild_id, category_id=None, export_path=None):
+        """
+        Print the members who can see channels that were not explicitly opened to them, optionally filtered by category.
+        A channel is considered private unless an overwrite grants view access to a member, or to one of their roles.
+
+        Args:
+            guild_id (int): The ID of the guild to audit.
+            category_id (int or str): The ID or name of the category whose channels to audit. If None, all channels are audited.
+            export_path (str): The file path to export the effective-permission matrix to ('.npz' or '.csv'). If None, nothing is exported.
+        """
+        guild = self.get_guild(int(guild_id))
+        if not guild:
+            print(f"Guild ID {guild_id} not found.")
+            return
+
+        subheading = f"{guild.name.upper()}"
+        channels = None  # all channels
         if category_id:
-            # users in category
+            category_id = self.get_category_id(guild_id, category_id)  # ensure int
             category = guild.get_channel(category_id)
-            if category and isinstance(category, discord.CategoryChannel):
-                user_ids = set()
-                for member in guild.members:
-                    # determine this user's roles
-                    roles = ", ".join(
-                        role.name for role in member.roles if role.name != "@everyone"
-                    )
-                    perms = category.permissions_for(member)
-                    if perms.view_channel and member.id not in user_ids:
-                        print(f"| {member.name:<30} | {member.id:<30} | {roles:<30} |")
-                        user_ids.add(member.id)
-                print(f"{'':-^100}")
-                print()
+            if not category or not isinstance(category, discord.CategoryChannel):
+                print(f"Category ID {category_id} not found.")
                 return
-        else:
-            # iterate through all members in the guild
-            for member in guild.members:
-                roles = ", ".join(
-                    role.name for role in member.roles if role.name != "@everyone"
-                )
-                print(f"| {member.name:<30} | {member.id:<30} | {roles:<30} |")
+            subheading += f" / '{category.name.upper()}'"
+            channels = [category] + list(category.channels)
 
+        audit = PermissionAudit(guild, channels=channels)
+        unexpected = audit.audit_private()
+
+        print(f"{subheading:^100}")
+        print(f"{'':-^100}")
+        print(
+            f"| {'Channel Name':<30} | {'Visible To':<30} | {'Unexpected Viewers':<30} |"
+        )
+        print(f"| {'':-^30} | {'':-^30} | {'':-^30} |")
+        visible_counts = audit.allowed("view_channel").sum(axis=0)
+        for channel, visible_count in zip(audit.channels, visible_counts):
+            viewers = ", ".join(
+                member.name for member in unexpected.get(channel.id, [])
+            )
+            viewers = viewers if len(viewers) <= 30 else f"{viewers[:27]}..."
+            print(f"| {channel.name:<30} | {int(visible_count):<30} | {viewers:<30} |")
         print(f"{'':-^100}")
+        print(
+            f"{len(unexpected)} of {len(audit.channels)} channels are visible to members they were not explicitly opened to."
+        )
         print()
 
+        if export_path:
+            audit.export(export_path)
+            print(f"Effective-permission matrix exported to '{export_path}'.")
+
     async def remove_category(self, guild_id, category_id, delete_channels=True):
         """
         Delete a category in the specified guild, optionally deleting its channels.
@@ -691,8 +1000,11 @@ class DiscordManager(discord.Client):
         # fix any server, category, or channel IDS that were specified as strings
         self.fix_ids()
 
-        # print welcome message
-        print(f"\nLogged into Discord as '@{self.user.name}' (ID: {self.user.id})\n")
+        # print welcome message... keep it out of the way of structured output
+        print(
+            f"\nLogged into Discord as '@{self.user.name}' (ID: {self.user.id})\n",
+            file=sys.stdout if self.output_format == "text" else sys.stderr,
+        )
 
         # determine which actions to take
         if self.show_guilds:
@@ -706,7 +1018,18 @@ class DiscordManager(discord.Client):
             self.print_channels(self.guild_id, self.category_id)
         if self.show_users and self.guild_id:
             # print the available users in the specified guild and optional category or channel
-            self.print_users(self.guild_id, self.category_id, self.channel_id)
+            self.print_users(
+                self.guild_id,
+                self.category_id,
+                self.channel_id,
+                self.role_id,
+                self.without_private_channel,
+            )
+        if (self.audit_permissions or self.export_permissions) and self.guild_id:
+            # audit who can see the channels in the specified guild and optional category
+            self.print_permission_audit(
+                self.guild_id, self.category_id, self.export_permissions
+            )
         if self.delete_category and self.guild_id:
             # delete the specified category in the specified guild, including all channels
             await self.remove_category(self.guild_id, self.delete_category)
@@ -724,3 +1047,51 @@ class DiscordManager(discord.Client):
             # if not listening for events, stop the bot after initial actions
             # print("Stopping bot after initial actions...")
             await self.stop()
+
+
+class AutoShardedDiscordManager(DiscordManager, discord.AutoShardedClient):
+    """
+    A DiscordManager that splits its gateway connection into several shards.
+    Each process can connect to its own range of shards, so several bot processes
+    can split event dispatch for large servers across cores and machines.
+    """
+
+
+def parse_shard_ids(shard_ids):
+    """
+    Parse a list of shard IDs and ranges, e.g. '0-3,8'.
+
+    Args:
+        shard_ids (str): Comma-separated shard IDs and inclusive ranges.
+    Returns:
+        list: The shard IDs, in order.
+    """
+    ids = []
+    for part in str(shard_ids).split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-", 1)
+            ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            ids.append(int(part))
+    return ids
+
+
+def shard_ids_for_process(process_index, process_count, shard_count):
+    """
+    Determine the contiguous range of shard IDs one of several processes should connect to.
+
+    Args:
+        process_index (int): The index of this process, starting at 0.
+        process_count (int): The number of processes sharing the shards.
+        shard_count (int): The total number of shards.
+    Returns:
+        list: The shard IDs for this process.
+    """
+    if not 0 <= process_index < process_count:
+        raise ValueError(
+            f"Process index {process_index} is out of range for {process_count} processes."
+        )
+    start = process_index * shard_count // process_count
+    end = (process_index + 1) * shard_count // process_count
+    return list(range(start, end))
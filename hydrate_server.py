@@ -9,28 +9,26 @@ import os
 import csv
 import asyncio
 from pathlib import Path
-import yaml
 from dotenv import load_dotenv
 import discord
 from discord_manager import DiscordManager
+from bot_config import load_config, get_servers
 
 load_dotenv()  # load environment variables from .env file
 
 # SETTINGS
-CONFIG_FILE = Path("bot_config.yml").resolve()  # path to the configuration file
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # from .env file
 
-# load the data in bot_config.yml into a Dictionary
-SERVER_NAME = ""
-config = {}
-with open(CONFIG_FILE, encoding="utf-8", mode="r") as f:
-    # get config from YAML file
-    config = yaml.safe_load(f)
-    # get server name
-    SERVER_NAME = config["server"]["name"]
+# load the data in bot_config.yml... it may describe one server or several
+config = load_config()
+servers = get_servers(config)
 
-# start up bot set to create a category, if not yet exists
-client = DiscordManager(guild_id=SERVER_NAME, event_loop=True)
+# start up one bot for all servers, rather than one gateway connection per server
+client = DiscordManager(
+    guild_ids=[server["name"] for server in servers],
+    event_loop=True,
+    rate_limit_priority="bulk",  # make way for the response bot, if it is running
+)
 
 
 # set up bot actions... this will override its default on_ready() routine.
@@ -41,10 +39,28 @@ async def on_ready():
     """
     print(f"Logged into Discord as: @{client.user.name} (ID: {client.user.id})")
 
+    # hydrate all servers concurrently
+    results = await asyncio.gather(
+        *(hydrate_server(server) for server in servers), return_exceptions=True
+    )
+    for server, result in zip(servers, results):
+        if isinstance(result, Exception):
+            print(f"Failed to hydrate server '{server['name']}': {result}")
+
+    # done!
+    await client.stop()
+
+
+async def hydrate_server(server):
+    """
+    Create and set permissions on the categories of every course in a server.
+    """
+    server_name = server["name"]
+
     # get array of courses from config data
-    courses = config["server"]["courses"]
+    courses = server["courses"]
     if len(courses) == 0:
-        raise RuntimeError(f"No courses found in config for server '{SERVER_NAME}'.")
+        raise RuntimeError(f"No courses found in config for server '{server_name}'.")
 
     for course in courses:
         course_title = course["title"]
@@ -65,6 +81,7 @@ async def on_ready():
         print(
             f"""
         Config:
+            SERVER: {server_name}
             ROSTER_FILE: {roster_file}
             ADMINS_ROLE: {admins_role}
             STUDENTS_ROLE: {students_role}
@@ -79,17 +96,14 @@ async def on_ready():
 
             # create the category
             await create_category(
-                SERVER_NAME, category_name, admins_role, students_role
+                server_name, category_name, admins_role, students_role
             )
 
             # set its permissions
             await set_category_permissions(
-                SERVER_NAME, category_name, admins_role, students_role
+                server_name, category_name, admins_role, students_role
             )
 
-    # done!
-    await client.stop()
-
 
 async def create_category(server_name, category_name, admins_role, students_role):
     """
@@ -99,8 +113,7 @@ async def create_category(server_name, category_name, admins_role, students_role
     # await client.wait_until_ready()  # Ensure the client is ready before proceeding
     guild_id = client.get_server_id(server_name=server_name)
     if not guild_id:
-        print("Server not found.")
-        await client.stop()
+        print(f"Server '{server_name}' not found.")
         return
     print(f"Got the server ID {guild_id} for {server_name}")
     # Create the category
@@ -167,8 +180,7 @@ async def set_category_permissions(
     )
     guild_id = client.get_server_id(server_name=server_name)
     if not guild_id:
-        print("Server not found.")
-        await client.stop()
+        print(f"Server '{server_name}' not found.")
         return
     guild = client.get_guild(guild_id)
 
@@ -0,0 +1,71 @@
+"""
+Streaming structured output for listings of servers, categories, channels, and users.
+Rows are written as soon as they are produced, so listing every member of a large server
+uses constant memory and can be piped straight into other tools.
+"""
+
+import csv
+import json
+import sys
+
+FORMATS = ["text", "jsonl", "csv"]
+
+
+class ListingWriter:
+    """
+    Write listing rows, one at a time, as JSON Lines or CSV.
+    """
+
+    def __init__(self, output_format="jsonl", fields=None, stream=None):
+        """
+        Set up the writer.
+
+        Args:
+            output_format (str): Either 'jsonl' or 'csv'.
+            fields (list): The names of the fields to include, in order. If None, all fields of the first row are included.
+            stream (file): The file-like object to write to. Defaults to standard output.
+        """
+        if output_format not in ("jsonl", "csv"):
+            raise ValueError(f"Unsupported output format '{output_format}'.")
+        self.output_format = output_format
+        self.fields = list(fields) if fields else None
+        self.stream = stream or sys.stdout
+        self.csv_writer = None  # created once the fields are known
+
+    def write(self, row):
+        """
+        Write a single row.
+
+        Args:
+            row (dict): The row's fields and values.
+        """
+        if self.fields is None:
+            self.fields = list(row.keys())
+        values = {field: row.get(field) for field in self.fields}
+        if self.output_format == "jsonl":
+            self.stream.write(json.dumps(values, ensure_ascii=False) + "\n")
+        else:
+            if not self.csv_writer:
+                self.csv_writer = csv.writer(self.stream)
+                self.csv_writer.writerow(self.fields)
+            self.csv_writer.writerow(
+                [
+                    ";".join(map(str, value)) if isinstance(value, list) else value
+                    for value in values.values()
+                ]
+            )
+
+    def write_all(self, rows):
+        """
+        Write rows from an iterable as they are produced.
+
+        Args:
+            rows (iterable): The rows to write.
+        Returns:
+            int: The number of rows written.
+        """
+        count = 0
+        for count, row in enumerate(rows, start=1):
+            self.write(row)
+        self.stream.flush()
+        return count
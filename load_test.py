@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+
+"""
+Load-test response_bot.py offline, by replaying student messages through its message handler.
+Messages are replayed from the messages table, or made up, at a chosen rate. Replies go to stub
+Discord channels, and the bot's model calls to a stub OpenAI client, each answering after delays
+drawn from configurable latency distributions. The bot's own message traces then show its
+throughput, queue wait, and reply latency percentiles, so its capacity can be known before a busy week.
+Examples:
+    python load_test.py --synthetic 200 --rate 5
+    python load_test.py --synthetic 500 --rate 20 --max-concurrent 8 --openai-latency lognormal:6,0.6
+    python load_test.py --replay --days 7 --speedup 60
+Latency distributions, in seconds: fixed:S, uniform:MIN,MAX, normal:MEAN,STDDEV,
+lognormal:MEDIAN,SIGMA, or exponential:MEAN.
+"""
+
+import os
+import math
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import itertools
+from pathlib import Path
+from types import SimpleNamespace
+from dotenv import load_dotenv
+
+load_dotenv()  # load environment variables from .env file... before the live database is known
+
+# the test's messages, traces, and logs are kept apart from the live bot's
+LOAD_TEST_DB_PATH = "./data/load_test.db"
+LOAD_TEST_LOGS_DIR = "./logs/load_test"
+LIVE_DB_PATH = os.getenv("SQL_LITE_DB_PATH", "./data/data.db")
+
+# questions for synthetic messages... some repeat, as real questions do
+QUESTIONS = [
+    "When is the midterm?",
+    "Is there class next week?",
+    "How do I submit the homework?",
+    "What will the exam cover?",
+    "Can you explain what a merge conflict is?",
+    "Why does my code say list index out of range?",
+    "What's the difference between a list and a tuple?",
+    "How do I set up my development environment?",
+]
+
+
+def parse_distribution(spec):
+    """
+    Parse a latency distribution, e.g. 'lognormal:2,0.5'.
+
+    Args:
+        spec (str): The distribution's name and parameters, in seconds.
+    Returns:
+        callable: A function returning a random latency in seconds from the distribution.
+    """
+    samplers = {
+        "fixed": lambda seconds: seconds,
+        "uniform": random.uniform,
+        "normal": lambda mean, stddev: max(random.gauss(mean, stddev), 0),
+        "lognormal": lambda median, sigma: random.lognormvariate(
+            math.log(median), sigma
+        ),
+        "exponential": lambda mean: random.expovariate(1 / mean),
+    }
+    name, _, params = spec.partition(":")
+    if name not in samplers:
+        raise argparse.ArgumentTypeError(
+            f"Unknown distribution '{name}', not one of {', '.join(samplers)}."
+        )
+    try:
+        values = [float(value) for value in params.split(",") if value]
+        samplers[name](*values)
+    except (TypeError, ValueError, ZeroDivisionError):
+        raise argparse.ArgumentTypeError(f"Bad parameters for distribution '{spec}'.")
+    return lambda: samplers[name](*values)
+
+
+class StubOpenAI:
+    """
+    A stand-in for AsyncOpenAI, with the calls the bot makes, answering after random delays.
+    """
+
+    def __init__(self, first_byte, latency, conversation_latency, chunks=8):
+        """
+        Set up the stub.
+
+        Args:
+            first_byte (callable): Returns the seconds until a response's first text.
+            latency (callable): Returns the seconds until a response is complete.
+            conversation_latency (callable): Returns the seconds it takes to create a conversation.
+            chunks (int): How many pieces streamed responses arrive in.
+        """
+        self.first_byte = first_byte
+        self.latency = latency
+        self.conversation_latency = conversation_latency
+        self.chunks = chunks
+        self.ids = itertools.count(1)
+        self.requests = 0
+        self.conversations = SimpleNamespace(
+            create=self._create_conversation,
+            items=SimpleNamespace(list=self._list_items, create=self._create_items),
+        )
+        self.responses = SimpleNamespace(create=self._create_response)
+
+    def with_options(self, **options):
+        return self
+
+    async def _create_conversation(self, **kwargs):
+        await asyncio.sleep(self.conversation_latency())
+        return SimpleNamespace(id=f"conv_load_test_{next(self.ids)}")
+
+    async def _list_items(self, conversation_id, **kwargs):
+        await asyncio.sleep(self.conversation_latency())
+        yield SimpleNamespace(
+            type="message",
+            role="user",
+            content=[SimpleNamespace(type="input_text", text="My name is a student.")],
+        )
+
+    async def _create_items(self, conversation_id, items):
+        await asyncio.sleep(self.conversation_latency())
+
+    async def _create_response(self, stream=False, **request):
+        self.requests += 1
+        first_byte = self.first_byte()
+        latency = max(self.latency(), first_byte)
+        pieces = [f"Stub answer part {i + 1}. " for i in range(self.chunks)]
+        response = SimpleNamespace(
+            output_text="".join(pieces),
+            model=request.get("model"),
+            usage=SimpleNamespace(input_tokens=500, output_tokens=20 * self.chunks),
+        )
+        if not stream:
+            await asyncio.sleep(latency)
+            return response
+
+        async def events():
+            await asyncio.sleep(first_byte)
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep((latency - first_byte) / (len(pieces) - 1))
+                yield SimpleNamespace(type="response.output_text.delta", delta=piece)
+            yield SimpleNamespace(type="response.completed", response=response)
+
+        return events()
+
+
+class StubMessage:
+    """
+    A message the bot sent to a stub channel, which it may edit or delete.
+    """
+
+    def __init__(self, channel, content):
+        self.id = next(channel.ids)
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content):
+        await asyncio.sleep(self.channel.latency())
+        self.channel.edits += 1
+        self.content = content
+
+    async def delete(self):
+        await asyncio.sleep(self.channel.latency())
+
+
+class StubChannel:
+    """
+    A stand-in for a Discord text channel, sending messages after random delays.
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, name, category_name, latency):
+        """
+        Set up the channel.
+
+        Args:
+            name (str): The channel's name.
+            category_name (str): The name of the category the channel is in.
+            latency (callable): Returns the seconds it takes to send or edit a message.
+        """
+        self.id = next(self.ids)
+        self.name = name
+        self.category = SimpleNamespace(name=category_name)
+        self.latency = latency
+        self.sent = 0
+        self.edits = 0
+
+    async def send(self, content):
+        await asyncio.sleep(self.latency())
+        self.sent += 1
+        return StubMessage(self, content)
+
+
+class StubMember:
+    """
+    A stand-in for a Discord member, hashable like the real thing, since the bot counts requests per member.
+    """
+
+    def __init__(self, id, name, roles=()):
+        self.id = id
+        self.name = name
+        self.roles = [SimpleNamespace(name=role) for role in roles]
+        self.bot = False
+
+
+def synthetic_messages(servers, count, users, repeat_ratio):
+    """
+    Make up student messages, spread over the configured courses.
+
+    Args:
+        servers (list): The configured servers, from bot_config.get_servers().
+        count (int): How many messages to make.
+        users (int): How many students send them.
+        repeat_ratio (float): The share of messages that ask one of a few common questions, from 0 to 1.
+    Returns:
+        list: (seconds after the start, user id, user name, category name, channel name, content) tuples, without timing.
+    """
+    courses = [
+        course
+        for server in servers
+        for course in server["courses"]
+        if course.get("categories")
+    ]
+    if not courses:
+        raise RuntimeError("No courses with categories found in config.")
+    messages = []
+    for i in range(count):
+        user_id = random.randrange(users) + 1
+        course = courses[user_id % len(courses)]
+        question = random.choice(QUESTIONS)
+        if random.random() >= repeat_ratio:
+            question = f"{question} (question {i + 1})"  # not answered from the cache
+        messages.append(
+            (
+                None,
+                user_id,
+                f"student{user_id}",
+                course["categories"][0],
+                f"student{user_id}",
+                question,
+            )
+        )
+    return messages
+
+
+def recorded_messages(source_db_path, days, course_categories):
+    """
+    Reconstruct student messages from the messages table of a database.
+
+    Args:
+        source_db_path (str): The database to read messages from.
+        days (float): How many days back to read.
+        course_categories (set): The names of the configured course categories. Messages posted elsewhere are skipped.
+    Returns:
+        list: (seconds after the first message, user id, user name, category name, channel name, content) tuples.
+    """
+    from peewee import SqliteDatabase
+    from models.message import Message
+    from models.user import User
+
+    source_db = SqliteDatabase(Path(source_db_path).resolve())
+    since = datetime.datetime.now() - datetime.timedelta(days=days)
+    with source_db.bind_ctx([Message, User]):
+        rows = list(
+            Message.select(Message, User)
+            .join(User)
+            .where(
+                (Message.direction == "from")
+                & (Message.created_at >= since)
+                & Message.category.in_(list(course_categories))
+            )
+            .order_by(Message.created_at)
+        )
+    if not rows:
+        return []
+    start = rows[0].created_at
+    return [
+        (
+            (row.created_at - start).total_seconds(),
+            row.user.discord_id or row.user.id,
+            row.user.discord_username or f"user{row.user.id}",
+            row.category,
+            row.channel,
+            row.content,
+        )
+        for row in rows
+    ]
+
+
+async def replay(bot, messages, rate=None, speedup=None, discord_latency=None):
+    """
+    Send messages to the bot's message handler, and wait until they have all been answered.
+
+    Args:
+        bot (module): The imported response_bot module, with stubs in place.
+        messages (list): (offset, user id, user name, category name, channel name, content) tuples.
+        rate (float): Messages per second, arriving at random (Poisson) intervals. Used if speedup is not given.
+        speedup (float): How many times faster than recorded to replay messages, by their offsets.
+        discord_latency (callable): Returns the seconds stub channels take to send or edit messages.
+    Returns:
+        tuple: (when the replay started, seconds over which messages arrived, seconds until all were answered, stub channels)
+    """
+    bot_user = bot.client.user
+    guild_ids = {}  # category name -> id of the guild whose courses include it
+    for guild_id, courses in bot.courses_by_guild.items():
+        for course in courses:
+            for category_name in course.get("categories", []):
+                guild_ids.setdefault(category_name, guild_id)
+    members, channels = {}, {}
+    message_ids = itertools.count(int(time.time() * 1000) << 22)  # snowflake-like
+    tasks = []
+
+    started_at = datetime.datetime.now()
+    started = time.perf_counter()
+    due = 0.0  # seconds after the start the next message is due
+    for offset, user_id, user_name, category_name, channel_name, content in messages:
+        if speedup:
+            due = offset / speedup
+        else:
+            due += random.expovariate(rate)
+        await asyncio.sleep(max(due - (time.perf_counter() - started), 0))
+
+        member = members.setdefault(user_id, StubMember(user_id, user_name))
+        channel = channels.setdefault(
+            (category_name, channel_name),
+            StubChannel(channel_name, category_name, discord_latency),
+        )
+        message = SimpleNamespace(
+            id=next(message_ids),
+            content=f"<@{bot_user.id}> {content}",
+            mentions=[bot_user],
+            author=member,
+            channel=channel,
+            guild=SimpleNamespace(id=guild_ids.get(category_name)),
+        )
+        tasks.append(asyncio.create_task(bot.on_message(message)))
+    arrival_seconds = time.perf_counter() - started
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # on_message returns once a reply is queued... wait for the scheduler to finish them all
+    while bot.scheduler.queue or bot.scheduler.running:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    return started_at, arrival_seconds, elapsed, list(channels.values())
+
+
+def report(bot, started_at, arrival_seconds, elapsed, offered, stub_openai, channels):
+    """
+    Print the bot's throughput, what became of the messages, and latency percentiles by stage.
+    """
+    from trace_report import STAGES, percentile
+    from models.message_trace import MessageTrace
+
+    traces = list(MessageTrace.select().where(MessageTrace.received_at >= started_at))
+    replied = [trace for trace in traces if trace.sent_at]
+    outcomes = {}
+    for (course, outcome), count in bot.messages_total.values.items():
+        outcomes[outcome] = outcomes.get(outcome, 0) + count
+
+    print(
+        f"Replayed {offered} messages over {arrival_seconds:.1f}s ({offered / max(arrival_seconds, 0.001):.2f}/s offered)."
+    )
+    print(
+        f"Sent {len(replied)} replies in {elapsed:.1f}s ({len(replied) / elapsed:.2f}/s throughput)."
+    )
+    # follow-ups to a message still waiting for more are merged into its request, uncounted
+    merged = offered - sum(outcomes.values())
+    if merged:
+        outcomes["merged"] = merged
+    print(
+        "Outcomes: "
+        + ", ".join(
+            f"{outcome} {count:g}" for outcome, count in sorted(outcomes.items())
+        )
+    )
+    print(
+        f"Stub OpenAI requests: {stub_openai.requests}. Stub Discord messages: {sum(channel.sent for channel in channels)}, edits: {sum(channel.edits for channel in channels)}."
+    )
+    print(f"\n{'stage':<12} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for stage, (start_field, end_field) in STAGES.items():
+        durations = sorted(
+            (getattr(trace, end_field) - getattr(trace, start_field)).total_seconds()
+            for trace in traces
+            if getattr(trace, start_field) and getattr(trace, end_field)
+        )
+        if durations:
+            print(
+                f"{stage:<12} {len(durations):>7} {percentile(durations, 50):>8.2f} {percentile(durations, 95):>8.2f} {percentile(durations, 99):>8.2f} {durations[-1]:>8.2f}"
+            )
+
+
+def main():
+    """
+    Parse command line arguments, set up the bot with stubs, replay messages, and report.
+    """
+    parser = argparse.ArgumentParser(
+        description="Replay student messages through response_bot.py against stub Discord and OpenAI services."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--synthetic", type=int, metavar="COUNT", help="Make up this many messages."
+    )
+    source.add_argument(
+        "--replay",
+        action="store_true",
+        help="Replay students' messages from the messages table of --source-db.",
+    )
+    parser.add_argument(
+        "--source-db",
+        default=LIVE_DB_PATH,
+        help=f"Database to replay messages from. Defaults to {LIVE_DB_PATH}.",
+    )
+    parser.add_argument(
+        "--days", type=float, default=7, help="How many days of messages to replay."
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=2,
+        help="Messages per second, at random intervals. Defaults to 2.",
+    )
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        help="Replay recorded messages at their recorded intervals, this many times faster, instead of at --rate.",
+    )
+    parser.add_argument(
+        "--users", type=int, default=50, help="Students sending synthetic messages."
+    )
+    parser.add_argument(
+        "--repeat-ratio",
+        type=float,
+        default=0.3,
+        help="Share of synthetic messages asking a common question, e.g. to exercise the answer cache.",
+    )
+    parser.add_argument(
+        "--openai-first-byte",
+        type=parse_distribution,
+        default="lognormal:1.5,0.5",
+        help="Seconds until the stub OpenAI's first streamed text.",
+    )
+    parser.add_argument(
+        "--openai-latency",
+        type=parse_distribution,
+        default="lognormal:4,0.5",
+        help="Seconds until the stub OpenAI's response is complete.",
+    )
+    parser.add_argument(
+        "--conversation-latency",
+        type=parse_distribution,
+        default="lognormal:0.3,0.3",
+        help="Seconds the stub OpenAI takes to create a conversation.",
+    )
+    parser.add_argument(
+        "--discord-latency",
+        type=parse_distribution,
+        default="lognormal:0.15,0.4",
+        help="Seconds stub Discord channels take to send or edit a message.",
+    )
+    parser.add_argument(
+        "--max-concurrent",
+        type=int,
+        help="Replies worked on at once, instead of scheduling.max_concurrent_requests in bot_config.yml.",
+    )
+    parser.add_argument(
+        "--no-daily-limit",
+        action="store_true",
+        help="Ignore courses' daily request limits, so no student runs out.",
+    )
+    parser.add_argument(
+        "--db",
+        default=LOAD_TEST_DB_PATH,
+        help=f"Scratch database for the bot's records during the test, emptied first. Defaults to {LOAD_TEST_DB_PATH}.",
+    )
+    parser.add_argument("--seed", type=int, help="Random seed, to repeat a test.")
+    args = parser.parse_args()
+
+    if Path(args.db).resolve() == Path(LIVE_DB_PATH).resolve():
+        parser.error("--db must not be the live bot's database.")
+    random.seed(args.seed)
+
+    # point the bot at the scratch database and logs before importing it... it connects on import
+    Path(args.db).resolve().parent.mkdir(parents=True, exist_ok=True)
+    os.environ["SQL_LITE_DB_PATH"] = args.db
+    os.environ.setdefault("LOGS_DIR", LOAD_TEST_LOGS_DIR)
+    os.environ.setdefault("OPENAI_API_KEY", "load-test")  # never used by the stub
+    import response_bot as bot
+    from migrate import table_list
+    from models.base import db
+
+    db.drop_tables(table_list, safe=True)
+    db.create_tables(table_list, safe=True)
+
+    # swap in the stubs
+    stub_openai = StubOpenAI(
+        args.openai_first_byte, args.openai_latency, args.conversation_latency
+    )
+    bot.openai_client = stub_openai
+    bot.conversation_store.openai_client = stub_openai
+    bot.client._connection.user = SimpleNamespace(id=1, name="load-test-bot")
+    for i, server in enumerate(bot.servers, start=1):
+        bot.courses_by_guild[i] = server["courses"]
+    if args.max_concurrent:
+        bot.scheduler.max_concurrent = args.max_concurrent
+    if args.no_daily_limit:
+        for server in bot.servers:
+            for course in server["courses"]:
+                course.setdefault("openai_assistant", {}).setdefault("limits", {})[
+                    "max_requests_per_day"
+                ] = math.inf
+
+    if args.replay:
+        categories = {
+            category_name
+            for server in bot.servers
+            for course in server["courses"]
+            for category_name in course.get("categories", [])
+        }
+        messages = recorded_messages(args.source_db, args.days, categories)
+        if not messages:
+            parser.error(f"No course messages found in {args.source_db}.")
+    else:
+        messages = synthetic_messages(
+            bot.servers, args.synthetic, args.users, args.repeat_ratio
+        )
+    speedup = args.speedup if args.replay else None
+
+    started_at, arrival_seconds, elapsed, channels = asyncio.run(
+        replay(bot, messages, args.rate, speedup, args.discord_latency)
+    )
+    report(
+        bot, started_at, arrival_seconds, elapsed, len(messages), stub_openai, channels
+    )
+
+
+# Run from the command line
+if __name__ == "__main__":
+    main()
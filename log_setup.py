@@ -0,0 +1,142 @@
+"""
+Asynchronous, structured, rotating logging.
+Log calls only put records on a queue. A background thread formats them and writes
+them to a log file that rotates by size (or time), so logging never blocks the event loop
+on file writes and log files stay bounded. Records can be written as JSON lines, including
+the course, user, and message being handled, so they can be filtered and aggregated.
+"""
+
+import copy
+import json
+import queue
+import atexit
+import logging
+import contextvars
+from pathlib import Path
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+
+LOG_FORMATS = ["json", "text"]
+TEXT_FORMAT = "%(asctime)s %(levelname)s:%(message)s"
+
+# fields describing what is being handled, e.g. course, user_id, message_id... set with log_context()
+_context = contextvars.ContextVar("log_context", default={})
+
+
+def log_context(**fields):
+    """
+    Set the fields added to every record logged from the current task, e.g. the message being handled.
+    Tasks started afterwards inherit them.
+
+    Args:
+        **fields: The fields and their values. Fields set to None are removed.
+    """
+    context = {**_context.get(), **fields}
+    _context.set({key: value for key, value in context.items() if value is not None})
+
+
+class ContextFilter(logging.Filter):
+    """
+    Add the current log context's fields to each record, in the thread that logged it.
+    """
+
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    A queue handler that leaves formatting records to the listener's thread.
+    Only the message's arguments are interpolated before queueing, so later changes to them
+    can't alter the record, and the exception's traceback is kept apart for the JSON formatter.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # the traceback holds live frames... keep its text only
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as JSON lines, with their log context's fields.
+    """
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "context", {}),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(
+    name,
+    logs_dir="./logs",
+    level="INFO",
+    log_format="json",
+    max_bytes=10 * 1024 * 1024,
+    backup_count=10,
+    rotate_when=None,
+):
+    """
+    Send all logging through a queue to a background thread that writes a rotating log file.
+
+    Args:
+        name (str): The name of the log file, without extension.
+        logs_dir (str or Path): The directory to write log files to. Created if it does not exist.
+        level (str): The minimum level of records to log.
+        log_format (str): 'json' for JSON lines, or 'text' for plain lines.
+        max_bytes (int): The size at which the log file is rotated. Ignored if rotate_when is set.
+        backup_count (int): The number of rotated log files to keep.
+        rotate_when (str): When to rotate the log file instead of by size, e.g. 'midnight', as in TimedRotatingFileHandler.
+    Returns:
+        logging.handlers.QueueListener: The running listener, stopped automatically at exit.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unsupported log format '{log_format}'.")
+    logs_path = Path(logs_dir).expanduser()
+    logs_path.mkdir(parents=True, exist_ok=True)
+    extension = "jsonl" if log_format == "json" else "log"
+    filename = logs_path / f"{name}.{extension}"
+
+    if rotate_when:
+        file_handler = TimedRotatingFileHandler(
+            filename, when=rotate_when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        file_handler = RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    file_handler.setFormatter(
+        JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    )
+
+    records = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    listener = QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # write out queued records before exiting
+    return listener
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import asyncio
 import argparse
 from discord_manager import DiscordManager
+from listing_writer import FORMATS
+from profiling import profile_run
 
 
 def main():
@@ -49,6 +52,42 @@ def main():
         help="Show users in the specified server and optional category or channel.",
     )
 
+    # output format for listings
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="text",
+        help="Output format for listings of servers, categories, channels, and users; 'jsonl' and 'csv' rows are streamed as they are produced.",
+    )
+
+    # fields to include in structured listings
+    parser.add_argument(
+        "--fields",
+        type=lambda x: [field.strip() for field in x.split(",") if field.strip()],
+        help="Comma-separated fields to include in 'jsonl' or 'csv' listings, e.g. 'id,name,roles'.",
+    )
+
+    # only list users without their own channel
+    parser.add_argument(
+        "--without-private-channel",
+        action="store_true",
+        help="With --show-users, only show users who have no channel opened specifically to them.",
+    )
+
+    # audit channel visibility
+    parser.add_argument(
+        "--audit-permissions",
+        action="store_true",
+        help="Show members who can see channels in the specified server and optional category that were not explicitly opened to them.",
+    )
+
+    # export effective permissions
+    parser.add_argument(
+        "--export-permissions",
+        type=str,
+        help="Export the effective permissions of every member in every channel of the specified server and optional category to a .csv or .npz file.",
+    )
+
     # select specific server
     parser.add_argument(
         "--server",
@@ -81,7 +120,7 @@ def main():
     parser.add_argument(
         "--role",
         type=lambda x: int(x) if x.isdigit() else x,  # int or string
-        help="Select specific role by ID or name",
+        help="Select specific role by ID or name; with --show-users, only show users with this role.",
     )
 
     # delete specific category
@@ -111,6 +150,15 @@ def main():
         help="Name of channel to create in the specified server and optional category.",
     )
 
+    # profile the run, e.g. to find what member scans cost
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="profiles/main.pstats",
+        metavar="FILE",
+        help="Profile the run with cProfile, writing pstats data to the file (default: profiles/main.pstats), and a summary next to it.",
+    )
+
     # parse the command-line arguments
     args = parser.parse_args()
 
@@ -141,9 +189,28 @@ def main():
         delete_channel=args.delete_channel,
         create_category=args.create_category,
         create_channel=args.create_channel,
+        audit_permissions=args.audit_permissions,
+        export_permissions=args.export_permissions,
+        without_private_channel=args.without_private_channel,
+        output_format=args.format,
+        output_fields=args.fields,
+        # share rate limits with the response bot when changing servers... listings stay database-free
+        rate_limit_priority=(
+            "bulk"
+            if args.create_category
+            or args.create_channel
+            or args.delete_category
+            or args.delete_channel
+            else None
+        ),
     )
     # start the bot
-    asyncio.run(client.start(args.token))
+    if args.profile:
+        with profile_run(args.profile):
+            asyncio.run(client.start(args.token))
+        print(f"Profile written to {args.profile}", file=sys.stderr)
+    else:
+        asyncio.run(client.start(args.token))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+"""
+Fuzzy matching of self-reported Discord usernames to guild members.
+Builds a trigram index over member names once, so each lookup only scores the
+handful of members that share trigrams with the query instead of the whole guild.
+"""
+
+import re
+import time
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+
+def normalize_name(name):
+    """
+    Normalize a user name for comparison.
+    Students report their usernames in all sorts of ways, e.g. '@Mike#1234', ' mike b. '.
+
+    Args:
+        name (str): The name to normalize.
+    Returns:
+        str: The lowercased name, without any leading '@', '#discriminator' suffix, or extra whitespace.
+    """
+    name = str(name or "").split("#")[0]  # remove legacy discriminator, if any
+    name = name.strip().lstrip("@").lower()
+    return re.sub(r"\s+", " ", name)
+
+
+def trigrams(name):
+    """
+    Get the set of character trigrams in a normalized name, padded so short names still match.
+
+    Args:
+        name (str): The normalized name.
+    Returns:
+        set: The trigrams in the name.
+    """
+    padded = f"  {name} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class MemberMatcher:
+    """
+    A precomputed trigram index over the names of a guild's members.
+    Each member is indexed under its username, display name, and global name.
+    """
+
+    def __init__(self, members, max_candidates=50):
+        """
+        Build the index.
+
+        Args:
+            members (iterable): discord.Member objects (or anything with id, name, and display_name attributes).
+            max_candidates (int): The number of candidates to re-rank with a full string comparison per lookup.
+        """
+        self.max_candidates = max_candidates
+        self.names = []  # normalized name for each index entry
+        self.member_ids = []  # member id for each index entry
+        self.labels = []  # original member name for each index entry
+        self.gram_counts = []  # number of trigrams in each index entry
+        self.postings = defaultdict(list)  # trigram -> list of index entries
+        self.exact = {}  # normalized name -> index entry
+        for member in members:
+            seen = set()
+            for name in (
+                member.name,
+                getattr(member, "display_name", None),
+                getattr(member, "global_name", None),
+            ):
+                name = normalize_name(name)
+                if not name or name in seen:
+                    continue
+                seen.add(name)
+                entry = len(self.names)
+                self.names.append(name)
+                self.member_ids.append(member.id)
+                self.labels.append(member.name)
+                self.exact.setdefault(name, entry)
+                grams = trigrams(name)
+                self.gram_counts.append(len(grams))
+                for gram in grams:
+                    self.postings[gram].append(entry)
+        self.num_members = len(set(self.member_ids))
+        self.built_at = time.monotonic()  # members may have been renamed since
+
+    def __len__(self):
+        return self.num_members
+
+    def suggest(self, user_name, limit=3, min_score=0.3):
+        """
+        Suggest the members whose names best match the given user name.
+
+        Args:
+            user_name (str): The (possibly mistyped) user name to look up.
+            limit (int): The maximum number of suggestions to return.
+            min_score (float): The minimum score, between 0 and 1, for a suggestion to be returned.
+        Returns:
+            list: (member_id, member_name, score) tuples, best match first.
+        """
+        query = normalize_name(user_name)
+        if not query:
+            return []
+        if query in self.exact:
+            # exact matches need no scoring
+            entry = self.exact[query]
+            return [(self.member_ids[entry], self.labels[entry], 1.0)]
+
+        # count trigrams shared with each index entry
+        query_grams = trigrams(query)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for entry in self.postings.get(gram, ()):
+                shared[entry] += 1
+
+        # keep the entries with the best trigram (Dice) similarity...
+        dice = {
+            entry: 2 * count / (len(query_grams) + self.gram_counts[entry])
+            for entry, count in shared.items()
+        }
+        candidates = sorted(dice, key=dice.get, reverse=True)[: self.max_candidates]
+
+        # ...and re-rank those with a full string comparison to catch transpositions and typos
+        best = {}
+        for entry in candidates:
+            name = self.names[entry]
+            ratio = SequenceMatcher(None, query, name).ratio()
+            score = round((dice[entry] + ratio) / 2, 3)
+            member_id = self.member_ids[entry]
+            if score >= min_score and score > best.get(member_id, (None, 0))[1]:
+                best[member_id] = (self.labels[entry], score)
+
+        suggestions = sorted(
+            ((member_id, label, score) for member_id, (label, score) in best.items()),
+            key=lambda suggestion: suggestion[2],
+            reverse=True,
+        )
+        return suggestions[:limit]
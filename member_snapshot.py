@@ -0,0 +1,265 @@
+"""
+A compact, array-backed snapshot of a guild's membership.
+Member IDs live in one array, names in one UTF-8 buffer indexed by offsets, and each role
+(or other named group of members) is a packed bitset, so set queries across tens of thousands
+of members are a few vectorized bitwise operations instead of scans over discord.Member objects.
+"""
+
+import numpy as np
+from member_matcher import normalize_name
+
+
+class MemberSnapshot:
+    """
+    Columnar snapshot of guild members and their roles.
+    Queries return bitsets (packed numpy uint8 arrays with one bit per member), which can be
+    combined with the usual &, |, and ~ operators and then turned back into IDs or names.
+    """
+
+    def __init__(self, member_ids, names, display_names, role_members, groups=None):
+        """
+        Build the snapshot from plain data.
+
+        Args:
+            member_ids (list): The ID of each member.
+            names (list): The username of each member.
+            display_names (list): The display name of each member.
+            role_members (dict): (role ID, role name) -> list of indexes of the members with that role.
+            groups (dict): Group name -> list of indexes of the members in that group, e.g. 'private_channel'.
+        """
+        self.size = len(member_ids)
+        self.member_ids = np.array(member_ids, dtype=np.uint64)
+        self.name_blob, self.name_offsets = self._pack_strings(names)
+        self.display_name_blob, self.display_name_offsets = self._pack_strings(
+            display_names
+        )
+        self.role_ids = {}  # role id -> row in role_bits
+        self.role_names = {}  # normalized role name -> row in role_bits
+        self.role_bits = np.zeros(
+            (len(role_members), (self.size + 7) // 8), dtype=np.uint8
+        )
+        for row, ((role_id, role_name), indexes) in enumerate(role_members.items()):
+            self.role_ids[role_id] = row
+            self.role_names[normalize_name(role_name)] = row
+            self.role_bits[row] = self.bitset(indexes)
+        self.groups = {
+            name: self.bitset(indexes) for name, indexes in (groups or {}).items()
+        }
+        self._name_index = None  # built lazily on first roster lookup
+
+    @classmethod
+    def from_guild(cls, guild, private_category_ids=None):
+        """
+        Take a snapshot of a guild's cached members.
+        Members with their own permission overwrite on any channel in the given categories
+        are recorded in the 'private_channel' group.
+
+        Args:
+            guild (discord.Guild): The guild to snapshot.
+            private_category_ids (iterable): IDs of the categories that hold private channels. If None, all channels are considered.
+        Returns:
+            MemberSnapshot: The snapshot.
+        """
+        member_ids, names, display_names = [], [], []
+        role_members = {(role.id, role.name): [] for role in guild.roles}
+        index = {}
+        for i, member in enumerate(guild.members):
+            index[member.id] = i
+            member_ids.append(member.id)
+            names.append(member.name)
+            display_names.append(member.display_name)
+            for role in member.roles:
+                role_members.setdefault((role.id, role.name), []).append(i)
+
+        # members who have a channel opened specifically to them
+        private_category_ids = (
+            None
+            if private_category_ids is None
+            else {int(category_id) for category_id in private_category_ids}
+        )
+        private = set()
+        for channel in guild.channels:
+            if (
+                private_category_ids is not None
+                and channel.category_id not in private_category_ids
+            ):
+                continue
+            for target in channel.overwrites:
+                if target.id in index:
+                    private.add(index[target.id])
+
+        return cls(
+            member_ids,
+            names,
+            display_names,
+            role_members,
+            groups={"private_channel": sorted(private)},
+        )
+
+    @staticmethod
+    def _pack_strings(strings):
+        """
+        Pack strings into a single UTF-8 buffer with an array of offsets.
+        """
+        encoded = [str(string or "").encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded])
+        return b"".join(encoded), offsets
+
+    @property
+    def nbytes(self):
+        """
+        The approximate memory used by the snapshot's arrays and buffers, in bytes.
+        """
+        return (
+            self.member_ids.nbytes
+            + len(self.name_blob)
+            + self.name_offsets.nbytes
+            + len(self.display_name_blob)
+            + self.display_name_offsets.nbytes
+            + self.role_bits.nbytes
+            + sum(bits.nbytes for bits in self.groups.values())
+        )
+
+    def __len__(self):
+        return self.size
+
+    def name(self, i):
+        """
+        Get the username of the member at an index.
+        """
+        start, end = self.name_offsets[i], self.name_offsets[i + 1]
+        return self.name_blob[start:end].decode("utf-8")
+
+    def display_name(self, i):
+        """
+        Get the display name of the member at an index.
+        """
+        start, end = self.display_name_offsets[i], self.display_name_offsets[i + 1]
+        return self.display_name_blob[start:end].decode("utf-8")
+
+    def bitset(self, indexes=()):
+        """
+        Make a bitset with the bits for the given member indexes set.
+
+        Args:
+            indexes (iterable): The member indexes.
+        Returns:
+            numpy.ndarray: The packed bitset.
+        """
+        bits = np.zeros(self.size, dtype=bool)
+        bits[np.fromiter(indexes, dtype=np.int64)] = True
+        return np.packbits(bits)
+
+    def everyone(self):
+        """
+        Get the bitset of all members in the snapshot.
+        """
+        return np.packbits(np.ones(self.size, dtype=bool))
+
+    def role(self, role):
+        """
+        Get the bitset of members with a role.
+
+        Args:
+            role (int or str): The ID or name of the role.
+        Returns:
+            numpy.ndarray: The packed bitset. Empty if the role is not found.
+        """
+        row = self.role_ids.get(role)
+        if row is None and isinstance(role, str):
+            row = (
+                self.role_ids.get(int(role))
+                if role.isnumeric()
+                else self.role_names.get(normalize_name(role))
+            )
+        if row is None:
+            return self.bitset()
+        return self.role_bits[row]
+
+    def any_role(self, roles):
+        """
+        Get the bitset of members with at least one of the given roles.
+
+        Args:
+            roles (iterable): The IDs or names of the roles.
+        Returns:
+            numpy.ndarray: The packed bitset.
+        """
+        bits = self.bitset()
+        for role in roles:
+            bits = bits | self.role(role)
+        return bits
+
+    def group(self, name):
+        """
+        Get the bitset of members in a named group, e.g. 'private_channel'.
+        """
+        return self.groups.get(name, self.bitset())
+
+    def matching(self, user_names):
+        """
+        Get the bitset of members whose username or display name is in a list, e.g. the Discord column of a roster.
+
+        Args:
+            user_names (iterable): The user names to look for.
+        Returns:
+            numpy.ndarray: The packed bitset.
+        """
+        name_index = self._get_name_index()
+        return self.bitset(
+            {
+                name_index[name]
+                for name in map(normalize_name, user_names)
+                if name in name_index
+            }
+        )
+
+    def unmatched(self, user_names):
+        """
+        Get the user names in a list that match no member's username or display name.
+
+        Args:
+            user_names (iterable): The user names to look for.
+        Returns:
+            list: The user names that were not found.
+        """
+        name_index = self._get_name_index()
+        return [name for name in user_names if normalize_name(name) not in name_index]
+
+    def _get_name_index(self):
+        """
+        Build the normalized name -> member index lookup used for roster comparisons, once.
+        """
+        if self._name_index is None:
+            self._name_index = {}
+            for i in range(self.size):
+                self._name_index.setdefault(normalize_name(self.display_name(i)), i)
+            for i in range(self.size):
+                # usernames take precedence over display names
+                self._name_index[normalize_name(self.name(i))] = i
+        return self._name_index
+
+    def indexes(self, bits):
+        """
+        Get the member indexes set in a bitset.
+        """
+        return np.flatnonzero(np.unpackbits(bits, count=self.size))
+
+    def count(self, bits):
+        """
+        Count the members in a bitset.
+        """
+        return int(np.unpackbits(bits, count=self.size).sum())
+
+    def ids(self, bits):
+        """
+        Get the IDs of the members in a bitset.
+        """
+        return [int(member_id) for member_id in self.member_ids[self.indexes(bits)]]
+
+    def names(self, bits):
+        """
+        Get the usernames of the members in a bitset.
+        """
+        return [self.name(i) for i in self.indexes(bits)]
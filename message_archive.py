@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+"""
+Move old messages out of the live database into compressed monthly archives.
+Each course keeps its messages for as long as its retention settings in bot_config.yml say.
+Older messages are appended to zstd-compressed JSON lines files, one per month, deleted from
+the messages table, and the database is then compacted, so the live table and its indexes stay
+small. Archived messages can still be searched on demand. Daily usage totals, and message traces
+without their links to archived messages, are kept.
+Run it now and then, e.g. nightly from cron, when the bot is quiet.
+Examples:
+    python message_archive.py archive --dry-run
+    python message_archive.py archive
+    python message_archive.py query --contains midterm --since 2024-09-01 --until 2025-01-01
+"""
+
+import io
+import os
+import json
+import argparse
+import datetime
+from pathlib import Path
+import zstandard
+from peewee import fn
+from bot_config import load_config, get_servers
+from models.base import db
+from models.message import Message
+from models.message_index import MessageIndex
+from models.message_trace import MessageTrace
+from models.user import User
+
+RETENTION_DEFAULT_ARCHIVE_AFTER_DAYS = 365  # can be overriden in config file
+RETENTION_DEFAULT_ARCHIVE_DIR = "./data/archive"  # can be overriden in config file
+BATCH_SIZE = 1000  # messages archived per transaction
+COMPRESSION_LEVEL = 10  # zstd level... archives are written once and rarely read
+
+
+class MessageArchive:
+    """
+    Archived messages, in a zstd-compressed JSON lines file per month, e.g. messages-2025-03.jsonl.zst.
+    Each archiving run appends a compressed frame to a month's file, and readers read across frames.
+    """
+
+    def __init__(
+        self, archive_dir=RETENTION_DEFAULT_ARCHIVE_DIR, level=COMPRESSION_LEVEL
+    ):
+        """
+        Set up the archive.
+
+        Args:
+            archive_dir (str or Path): The directory of archive files. Created if it does not exist.
+            level (int): The zstd compression level.
+        """
+        self.archive_dir = Path(archive_dir).expanduser()
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.compressor = zstandard.ZstdCompressor(level=level)
+
+    def path(self, month):
+        """
+        Get the path of a month's archive file.
+
+        Args:
+            month (str): The month, e.g. '2025-03'.
+        """
+        return self.archive_dir / f"messages-{month}.jsonl.zst"
+
+    def months(self):
+        """
+        Get the months that have archive files, oldest first.
+        """
+        return sorted(
+            path.name[len("messages-") : -len(".jsonl.zst")]
+            for path in self.archive_dir.glob("messages-*.jsonl.zst")
+        )
+
+    def write(self, month, records):
+        """
+        Append records to a month's archive file, and wait until they are on disk.
+
+        Args:
+            month (str): The month, e.g. '2025-03'.
+            records (list): The records, as JSON-serializable dicts.
+        """
+        lines = "".join(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in records
+        )
+        with open(self.path(month), "ab") as file:
+            file.write(self.compressor.compress(lines.encode("utf-8")))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def read(self, month):
+        """
+        Read the records in a month's archive file.
+
+        Args:
+            month (str): The month, e.g. '2025-03'.
+        Returns:
+            generator: The records, as dicts, in the order they were archived.
+        """
+        seen = set()  # a record is archived twice if a run stopped before deleting it
+        with open(self.path(month), "rb") as file:
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                file, read_across_frames=True
+            )
+            for line in io.TextIOWrapper(reader, encoding="utf-8"):
+                record = json.loads(line)
+                if record["id"] not in seen:
+                    seen.add(record["id"])
+                    yield record
+
+    def query(
+        self,
+        since=None,
+        until=None,
+        category=None,
+        channel=None,
+        direction=None,
+        user=None,
+        contains=None,
+        limit=None,
+    ):
+        """
+        Find archived messages, oldest first.
+
+        Args:
+            since (datetime.datetime): The earliest time a message may have been logged at, if any.
+            until (datetime.datetime): The time all messages must have been logged before, if any.
+            category (str): The name of the Discord category the messages were posted in, if any.
+            channel (str): The name of the Discord channel the messages were posted in, if any.
+            direction (str): 'from' for messages users sent, 'to' for the bot's replies, if either.
+            user (str): The Discord username of the user the messages were to or from, if any.
+            contains (str): Text the messages must contain, ignoring case, if any.
+            limit (int): The most messages to return, if any.
+        Returns:
+            generator: The matching records, as dicts.
+        """
+        found = 0
+        for month in self.months():
+            # skip months outside the range without decompressing them
+            if since and month < since.strftime("%Y-%m"):
+                continue
+            if until and month > until.strftime("%Y-%m"):
+                continue
+            for record in self.read(month):
+                created_at = datetime.datetime.fromisoformat(record["created_at"])
+                if (
+                    (since and created_at < since)
+                    or (until and created_at >= until)
+                    or (category and record["category"] != category)
+                    or (channel and record["channel"] != channel)
+                    or (direction and record["direction"] != direction)
+                    or (user and record["discord_username"] != user)
+                    or (contains and contains.lower() not in record["content"].lower())
+                ):
+                    continue
+                yield record
+                found += 1
+                if limit and found >= limit:
+                    return
+
+
+def due_for_archiving(config, now=None):
+    """
+    Get the condition for messages due for archiving, by the retention settings of their course.
+
+    Args:
+        config (dict): The config data, from bot_config.load_config().
+        now (datetime.datetime): The current time. Defaults to now.
+    Returns:
+        peewee.Expression: The condition on Message rows.
+    """
+    now = now or datetime.datetime.now()
+    retention_config = config.get("retention", {})
+    default_days = retention_config.get(
+        "archive_after_days", RETENTION_DEFAULT_ARCHIVE_AFTER_DAYS
+    )
+
+    # each course's categories keep messages for that course's retention period
+    categories_by_days = {}
+    for server in get_servers(config):
+        for course in server["courses"]:
+            days = course.get("retention", {}).get("archive_after_days", default_days)
+            categories_by_days.setdefault(days, []).extend(course.get("categories", []))
+    known_categories = [
+        category
+        for categories in categories_by_days.values()
+        for category in categories
+    ]
+
+    # messages posted anywhere else keep the default period
+    condition = Message.category.not_in(known_categories) & (
+        Message.created_at < now - datetime.timedelta(days=default_days)
+    )
+    for days, categories in categories_by_days.items():
+        condition |= Message.category.in_(categories) & (
+            Message.created_at < now - datetime.timedelta(days=days)
+        )
+    return condition
+
+
+def courses_by_category(config):
+    """
+    Get the course each configured Discord category belongs to.
+    """
+    return {
+        category_name: course["title"]
+        for server in get_servers(config)
+        for course in server["courses"]
+        for category_name in course.get("categories", [])
+    }
+
+
+def archive_messages(archive, config, dry_run=False):
+    """
+    Move the messages due for archiving into the archive, a batch at a time.
+    Each batch is on disk in the archive before it is deleted from the database.
+
+    Args:
+        archive (MessageArchive): The archive to move messages to.
+        config (dict): The config data, with the retention settings.
+        dry_run (bool): Whether to only count the messages that would be archived.
+    Returns:
+        dict: The number of messages archived (or due for archiving), by month.
+    """
+    condition = due_for_archiving(config)
+    if dry_run:
+        month = fn.strftime("%Y-%m", Message.created_at)
+        due = (
+            Message.select(month.alias("month"), fn.count(Message.id).alias("count"))
+            .where(condition)
+            .group_by(month)
+            .order_by(month)
+            .tuples()
+        )
+        return dict(due)
+
+    courses = courses_by_category(config)
+    # a database the bot hasn't run against since traces were added has no traces to unlink
+    has_traces = MessageTrace.table_exists()
+    archived = {}
+    while True:
+        batch = list(
+            Message.select(Message, User)
+            .join(User)
+            .where(condition)
+            .order_by(Message.id)
+            .limit(BATCH_SIZE)
+        )
+        if not batch:
+            break
+
+        records_by_month = {}
+        for message in batch:
+            records_by_month.setdefault(
+                message.created_at.strftime("%Y-%m"), []
+            ).append(
+                {
+                    "id": message.id,
+                    "created_at": message.created_at.isoformat(),
+                    "course": courses.get(message.category),
+                    "category": message.category,
+                    "channel": message.channel,
+                    "direction": message.direction,
+                    "user_id": message.user.id,
+                    "discord_id": message.user.discord_id,
+                    "discord_username": message.user.discord_username,
+                    "content": message.content,
+                }
+            )
+        for month, records in records_by_month.items():
+            archive.write(month, records)
+            archived[month] = archived.get(month, 0) + len(records)
+
+        # keep the traces of archived messages for latency reports, without their links
+        ids = [message.id for message in batch]
+        with db.atomic():
+            if has_traces:
+                MessageTrace.update(message=None).where(
+                    MessageTrace.message.in_(ids)
+                ).execute()
+                MessageTrace.update(reply=None).where(
+                    MessageTrace.reply.in_(ids)
+                ).execute()
+            Message.delete().where(Message.id.in_(ids)).execute()
+    return archived
+
+
+def compact():
+    """
+    Merge the search index's segments, and rebuild the database file without the space freed by archived messages.
+    Needs as much free disk space as the database takes, and blocks other writers while it runs.
+    """
+    if MessageIndex.table_exists():
+        MessageIndex.optimize()
+    db.execute_sql("VACUUM")
+
+
+# Run from the command line to archive or search messages
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Archive old messages, or search the archive."
+    )
+    parser.add_argument(
+        "action",
+        choices=["archive", "query"],
+        help="'archive' to move old messages into the archive, 'query' to search it.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the messages due for archiving, by month.",
+    )
+    parser.add_argument(
+        "--no-vacuum",
+        action="store_true",
+        help="Don't compact the database after archiving.",
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.datetime.fromisoformat,
+        help="Earliest date to search, e.g. 2024-09-01.",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.datetime.fromisoformat,
+        help="Date to search up to, not including it, e.g. 2025-01-01.",
+    )
+    parser.add_argument("--category", help="Name of the category to search.")
+    parser.add_argument("--channel", help="Name of the channel to search.")
+    parser.add_argument(
+        "--direction",
+        choices=["from", "to"],
+        help="'from' for messages users sent, 'to' for the bot's replies.",
+    )
+    parser.add_argument("--user", help="Discord username to search messages of.")
+    parser.add_argument("--contains", help="Text to search for, ignoring case.")
+    parser.add_argument(
+        "--limit", type=int, default=50, help="Most messages to show. Defaults to 50."
+    )
+    args = parser.parse_args()
+
+    config = load_config()
+    archive = MessageArchive(
+        config.get("retention", {}).get("archive_dir", RETENTION_DEFAULT_ARCHIVE_DIR)
+    )
+
+    if args.action == "archive":
+        archived = archive_messages(archive, config, dry_run=args.dry_run)
+        for month, count in archived.items():
+            print(
+                f"{month}: {count} messages {'due for archiving' if args.dry_run else 'archived'}"
+            )
+        print(
+            f"{sum(archived.values())} messages {'due for archiving' if args.dry_run else f'archived to {archive.archive_dir}'}."
+        )
+        if archived and not args.dry_run and not args.no_vacuum:
+            print("Compacting the database...")
+            compact()
+            print("Done.")
+    else:
+        records = archive.query(
+            since=args.since,
+            until=args.until,
+            category=args.category,
+            channel=args.channel,
+            direction=args.direction,
+            user=args.user,
+            contains=args.contains,
+            limit=args.limit,
+        )
+        found = 0
+        for record in records:
+            found += 1
+            print(
+                f"{record['created_at'][:16].replace('T', ' ')} {record['direction']:>4} @{record['discord_username'] or record['user_id']} in '{record['category']}'#{record['channel']}: {record['content']}"
+            )
+        if not found:
+            print("No archived messages found.")
@@ -0,0 +1,92 @@
+"""
+Coalescing of rapid-fire messages from the same user in the same channel.
+Students often split a question over several quick messages. The first message opens a
+short window, each message that follows extends it, and when the window closes the
+messages are answered together, with one model call, one reply, and one request of quota.
+"""
+
+import time
+import asyncio
+
+
+class MessageBatch:
+    """
+    Messages from one user in one channel, waiting for their coalescing window to close.
+    """
+
+    def __init__(self, message):
+        self.messages = [message]
+        self.started = time.monotonic()  # when the first message arrived
+        self.last = self.started  # when the latest message arrived
+
+    @property
+    def content(self):
+        """
+        The combined content of the messages, one per line.
+        """
+        return "\n".join(message.content for message in self.messages)
+
+
+class MessageCoalescer:
+    """
+    Debounce messages per user and channel, merging those that arrive within a short window of each other.
+    """
+
+    def __init__(self, window_seconds=2, max_wait_seconds=6):
+        """
+        Set up the coalescer.
+
+        Args:
+            window_seconds (float): How long to wait after each message for another one.
+            max_wait_seconds (float): The longest the first message waits, however many messages follow it.
+        """
+        self.window = window_seconds
+        self.max_wait = max(max_wait_seconds, window_seconds)
+        self.pending = {}  # (user id, channel id) -> MessageBatch
+
+    @staticmethod
+    def _key(message):
+        return (message.author.id, message.channel.id)
+
+    def is_pending(self, message):
+        """
+        Check whether a message's user has a window open in its channel.
+
+        Args:
+            message (discord.Message): The message.
+        Returns:
+            bool: Whether the message would be merged into an earlier one.
+        """
+        return self._key(message) in self.pending
+
+    async def add(self, message):
+        """
+        Add a message, and wait for its window to close if it is the first.
+
+        Args:
+            message (discord.Message): The message.
+        Returns:
+            MessageBatch or None: The batch of messages to answer, or None if the message was merged into an earlier one's batch.
+        """
+        key = self._key(message)
+        batch = self.pending.get(key)
+        if batch:
+            batch.messages.append(message)
+            batch.last = time.monotonic()
+            return None
+
+        batch = MessageBatch(message)
+        self.pending[key] = batch
+        try:
+            while True:
+                # each message extends the window, up to the maximum wait
+                wait = (
+                    min(batch.last + self.window, batch.started + self.max_wait)
+                    - time.monotonic()
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            del self.pending[key]
+        return batch
@@ -0,0 +1,213 @@
+"""
+Ledger of the Discord messages the bot has claimed for handling.
+After a gateway resume, or a restart in the middle of a burst, Discord may deliver a
+message the bot already answered. Each message is claimed in the ledger before it is
+handled, and marked replied once the bot is done with it, so it is answered once, with no
+duplicate model calls or replies. A claim that is still unfinished after a timeout, e.g.
+because the bot was restarted while the message was queued, can be taken over and the
+message handled again, a limited number of times.
+Recent claims are kept in memory, and all claims in SQLite until they expire.
+"""
+
+import datetime
+import logging
+from collections import OrderedDict
+from peewee import BigIntegerField, CharField, IntegerField
+from playhouse.migrate import SqliteMigrator, migrate
+from models.base import db
+from models.processed_message import ProcessedMessage
+
+logger = logging.getLogger(__name__)
+
+CLAIMED = "claimed"  # being handled
+REPLIED = "replied"  # done with
+
+
+class MessageLedger:
+    """
+    A size-bounded in-memory map of claimed message ids, backed by an expiring SQLite table.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds=3 * 24 * 3600,
+        max_entries=10000,
+        claim_timeout_seconds=600,
+        max_attempts=3,
+    ):
+        """
+        Set up the ledger, deleting expired claims.
+
+        Args:
+            ttl_seconds (int): How long to remember a claimed message.
+            max_entries (int): The maximum number of message ids to keep in memory.
+            claim_timeout_seconds (int): How long a message may be handled for before its claim can be taken over.
+            max_attempts (int): How many times a message may be claimed before the bot gives up on it.
+        """
+        self.ttl = datetime.timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self.claim_timeout = datetime.timedelta(seconds=claim_timeout_seconds)
+        self.max_attempts = max_attempts
+        self.memory = OrderedDict()  # message id -> (state, claimed at), oldest first
+        self.claims = 0  # claims since expired rows were last deleted
+        self._create_table()
+        self.expire()
+
+    @staticmethod
+    def _create_table():
+        """
+        Create the table, adding the columns of claim states to a table from before they were recorded.
+        """
+        if not ProcessedMessage.table_exists():
+            ProcessedMessage.create_table()
+            return
+        columns = {column.name for column in db.get_columns("processed_messages")}
+        if "state" not in columns:
+            # claims made before states were recorded were only made once handled... treat them as replied
+            migrator = SqliteMigrator(db)
+            migrate(
+                migrator.add_column(
+                    "processed_messages", "channel_id", BigIntegerField(null=True)
+                ),
+                migrator.add_column(
+                    "processed_messages", "state", CharField(default=REPLIED)
+                ),
+                migrator.add_column(
+                    "processed_messages", "attempts", IntegerField(default=1)
+                ),
+            )
+        ProcessedMessage.create_table(safe=True)  # any missing indexes
+
+    def claim(self, message_id, course=None, channel_id=None):
+        """
+        Claim a message for handling.
+        A message claimed earlier can be claimed again if its handling never finished within the timeout.
+
+        Args:
+            message_id (int): The Discord message id.
+            course (str): The title of the course the message is about, if any.
+            channel_id (int): The Discord id of the channel the message was posted in.
+        Returns:
+            bool: True if the message should be handled, False if it was already claimed.
+        """
+        now = datetime.datetime.now()
+        if message_id in self.memory:
+            state, claimed_at = self.memory[message_id]
+            if state == REPLIED or now - claimed_at < self.claim_timeout:
+                return False
+        claimed = (
+            ProcessedMessage.insert(
+                discord_message_id=message_id,
+                channel_id=channel_id,
+                course=course,
+                state=CLAIMED,
+                created_at=now,
+                updated_at=now,
+            )
+            .on_conflict_ignore()
+            .as_rowcount()
+            .execute()
+        )
+        if not claimed:
+            # claimed before... take the claim over only if handling the message never finished
+            claimed = (
+                ProcessedMessage.update(
+                    attempts=ProcessedMessage.attempts + 1, updated_at=now
+                )
+                .where(
+                    (ProcessedMessage.discord_message_id == message_id)
+                    & (ProcessedMessage.state == CLAIMED)
+                    & (ProcessedMessage.updated_at < now - self.claim_timeout)
+                    & (ProcessedMessage.attempts < self.max_attempts)
+                )
+                .execute()
+            )
+            if claimed:
+                logger.info(
+                    "Claimed message %s again, since handling it never finished.",
+                    message_id,
+                )
+        if not claimed:
+            return False
+        self._remember(message_id, CLAIMED, now)
+
+        # clean up now and then, rather than on every claim
+        self.claims += 1
+        if self.claims >= self.max_entries:
+            self.expire()
+        return True
+
+    def is_claimed(self, message_id):
+        """
+        Check whether this process holds an unfinished claim on a message.
+
+        Args:
+            message_id (int): The Discord message id.
+        Returns:
+            bool: Whether the message is being handled here.
+        """
+        return self.memory.get(message_id, (None, None))[0] == CLAIMED
+
+    def finish(self, message_ids):
+        """
+        Mark messages as replied to, or otherwise done with, so they are never handled again.
+
+        Args:
+            message_ids (list): The Discord message ids.
+        """
+        message_ids, now = list(message_ids), datetime.datetime.now()
+        ProcessedMessage.update(state=REPLIED, updated_at=now).where(
+            ProcessedMessage.discord_message_id.in_(message_ids)
+        ).execute()
+        for message_id in message_ids:
+            self._remember(message_id, REPLIED, now)
+
+    def unfinished(self, limit=100):
+        """
+        Get the claims whose handling never finished within the timeout, and may be taken over.
+
+        Args:
+            limit (int): The maximum number of claims to get.
+        Returns:
+            list: The claims, as ProcessedMessage rows, oldest first.
+        """
+        now = datetime.datetime.now()
+        return list(
+            ProcessedMessage.select()
+            .where(
+                (ProcessedMessage.state == CLAIMED)
+                & (ProcessedMessage.updated_at < now - self.claim_timeout)
+                & (ProcessedMessage.attempts < self.max_attempts)
+                & (ProcessedMessage.created_at >= now - self.ttl)
+                & ProcessedMessage.channel_id.is_null(False)
+            )
+            .order_by(ProcessedMessage.created_at)
+            .limit(limit)
+        )
+
+    def _remember(self, message_id, state, claimed_at):
+        """
+        Keep a claim in memory, dropping the oldest ones beyond the size limit.
+        """
+        self.memory[message_id] = (state, claimed_at)
+        self.memory.move_to_end(message_id)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def expire(self):
+        """
+        Delete claims older than the time to live.
+
+        Returns:
+            int: The number of claims deleted.
+        """
+        self.claims = 0
+        cutoff = datetime.datetime.now() - self.ttl
+        deleted = (
+            ProcessedMessage.delete()
+            .where(ProcessedMessage.created_at < cutoff)
+            .execute()
+        )
+        if deleted:
+            logger.info("Expired %s processed message records.", deleted)
+        return deleted
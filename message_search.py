@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+Search the logged messages, e.g. for every question about the midterm in one course.
+Searches use the messages_fts full-text index, so they take milliseconds even over a
+semester of messages. Queries can use quoted phrases, AND, OR, and -excluded words, and
+words match their other forms, e.g. 'exam' matches 'exams'.
+Examples:
+    python message_search.py midterm --course "Agile Development" --direction from
+    python message_search.py '"merge conflict" -rebase' --since 2025-09-01 --until 2025-12-20
+    python message_search.py deadline --category "Software Engineering - GLOBAL" --channel general
+"""
+
+import argparse
+import datetime
+from peewee import fn, OperationalError
+from models.message import Message
+from models.message_index import MessageIndex
+from models.user import User
+
+
+def search(
+    query,
+    categories=None,
+    channel=None,
+    direction=None,
+    since=None,
+    until=None,
+    limit=20,
+    raw=False,
+):
+    """
+    Search the logged messages, best matches first.
+
+    Args:
+        query (str): What to search for, e.g. 'midterm -date' or '"merge conflict"'.
+        categories (list): The names of the Discord categories to search in, e.g. a course's. If None, all are searched.
+        channel (str): The name of the Discord channel to search in. If None, all are searched.
+        direction (str): 'from' for messages users sent, 'to' for the bot's replies. If None, both are searched.
+        since (datetime.datetime): The earliest time a message may have been logged at, if any.
+        until (datetime.datetime): The time all messages must have been logged before, if any.
+        limit (int): The most messages to return.
+        raw (bool): Whether the query is in FTS5's own query syntax, rather than search-box syntax.
+    Returns:
+        list: The matching Message objects, each with its user, a 'score' (lower is better), and a 'snippet' with the matches in [brackets].
+    """
+    match = query if raw else MessageIndex.web_query(query)
+    results = (
+        Message.select(
+            Message,
+            User,
+            MessageIndex.bm25().alias("score"),
+            fn.snippet(MessageIndex._meta.entity, 0, "[", "]", "...", 16).alias(
+                "snippet"
+            ),
+        )
+        .join(MessageIndex, on=(Message.id == MessageIndex.rowid))
+        .switch(Message)
+        .join(User)
+        .where(MessageIndex.match(match))
+    )
+    if categories:
+        results = results.where(Message.category.in_(list(categories)))
+    if channel:
+        results = results.where(Message.channel == channel)
+    if direction:
+        results = results.where(Message.direction == direction)
+    if since:
+        results = results.where(Message.created_at >= since)
+    if until:
+        results = results.where(Message.created_at < until)
+    return list(results.order_by(MessageIndex.bm25()).limit(limit))
+
+
+def course_categories(course_title):
+    """
+    Get the names of a course's Discord categories, from bot_config.yml.
+
+    Args:
+        course_title (str): The title of the course.
+    Returns:
+        list: The names of the course's categories, or None if the course was not found.
+    """
+    from bot_config import load_config, get_servers, find_course
+
+    server, course = find_course(get_servers(load_config()), course_title)
+    return course.get("categories", []) if course else None
+
+
+# Run from the command line to print matching messages
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the logged messages.")
+    parser.add_argument("query", help="What to search for.")
+    parser.add_argument(
+        "--course", help="Title of the course to search, by its categories."
+    )
+    parser.add_argument(
+        "--category",
+        action="append",
+        help="Name of a category to search. Can be given several times.",
+    )
+    parser.add_argument("--channel", help="Name of the channel to search.")
+    parser.add_argument(
+        "--direction",
+        choices=["from", "to"],
+        help="'from' for messages users sent, 'to' for the bot's replies.",
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.datetime.fromisoformat,
+        help="Earliest date to search, e.g. 2025-09-01.",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.datetime.fromisoformat,
+        help="Date to search up to, not including it, e.g. 2025-12-20.",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=20, help="Most messages to show. Defaults to 20."
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Pass the query to SQLite FTS5 as is, e.g. for NEAR() or prefix* queries.",
+    )
+    args = parser.parse_args()
+
+    categories = list(args.category or [])
+    if args.course:
+        course_category_names = course_categories(args.course)
+        if course_category_names is None:
+            parser.error(f"Course '{args.course}' not found in config.")
+        categories += course_category_names
+
+    MessageIndex.create_table(safe=True)  # index existing messages, the first time
+    try:
+        messages = search(
+            args.query,
+            categories=categories,
+            channel=args.channel,
+            direction=args.direction,
+            since=args.since,
+            until=args.until,
+            limit=args.limit,
+            raw=args.raw,
+        )
+    except OperationalError as e:
+        parser.error(f"Bad search query: {e}")
+    for message in messages:
+        print(
+            f"{message.created_at:%Y-%m-%d %H:%M} {message.direction:>4} @{message.user.discord_username or message.user.id} in '{message.category}'#{message.channel}: {message.snippet}"
+        )
+    if not messages:
+        print("No messages found.")
@@ -16,9 +16,32 @@ import argparse
 from peewee import SqliteDatabase
 from models.user import User
 from models.message import Message
+from models.cached_answer import CachedAnswer
+from models.indexed_file import IndexedFile
+from models.passage import Passage
+from models.posting import Posting
+from models.conversation import Conversation
+from models.processed_message import ProcessedMessage
+from models.message_trace import MessageTrace
+from models.rate_limit import RateLimit
+from models.message_index import MessageIndex
+from models.usage_rollup import UsageRollup
 
 # which tables we're interested in migrating
-table_list = [User, Message]
+table_list = [
+    User,
+    Message,
+    CachedAnswer,
+    IndexedFile,
+    Passage,
+    Posting,
+    Conversation,
+    ProcessedMessage,
+    MessageTrace,
+    RateLimit,
+    MessageIndex,
+    UsageRollup,
+]
 
 # Define the database
 db_path = Path(os.getenv("SQL_LITE_DB_PATH", "./data/data.db")).resolve()
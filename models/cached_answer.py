@@ -0,0 +1,36 @@
+"""
+Model for answers the bot has already given to course questions.
+"""
+
+import datetime
+from peewee import (
+    CharField,
+    IntegerField,
+    DateTimeField,
+)
+from models.base import Base
+
+
+# Define the CachedAnswer model
+class CachedAnswer(Base):
+    """
+    An answer to a normalized question in a course, reused when any student asks it again.
+    The fingerprint records the course's prompt, vector store, and local materials when the answer
+    was given, so answers are never reused once any of them changes.
+    """
+
+    course = CharField(null=False, unique=False)  # course title
+    fingerprint = CharField(null=False, unique=False)  # prompt, vector store, materials
+    question_key = CharField(null=False, unique=False)  # normalized question
+    question = CharField(null=False, unique=False)  # original question text
+    answer = CharField(null=False, unique=False)  # the answer given
+    hits = IntegerField(default=0)  # number of times the answer was reused
+    last_hit_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "cached_answers"
+
+        indexes = (
+            (("course", "fingerprint", "question_key"), True),
+            (("course", "last_hit_at"), False),
+        )
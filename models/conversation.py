@@ -0,0 +1,43 @@
+"""
+Model for OpenAI conversations held with users in Discord.
+"""
+
+from peewee import (
+    BooleanField,
+    CharField,
+    ForeignKeyField,
+    IntegerField,
+)
+from models.base import Base
+from models.user import User
+
+
+# Define the Conversation model
+class Conversation(Base):
+    """
+    An OpenAI conversation between the bot and a user about a course.
+    Long conversations are retired and replaced by a new one seeded with a summary of the old,
+    so each request carries a bounded amount of history.
+    """
+
+    user = ForeignKeyField(
+        User, backref="conversations", on_delete="CASCADE", null=False
+    )  # the user the conversation is with
+    course = CharField(null=False, unique=False)  # course title
+    openai_conversation_id = CharField(null=False, unique=True)  # OpenAI conversation
+    turns = IntegerField(default=0)  # number of responses in the conversation
+    tokens = IntegerField(default=0)  # tokens used by the latest response
+    summary = CharField(
+        null=True, unique=False
+    )  # summary this conversation was seeded with
+    previous = ForeignKeyField(
+        "self", backref="next", on_delete="SET NULL", null=True
+    )  # the conversation this one replaced, if any
+    active = BooleanField(
+        default=True
+    )  # whether this is the user's current conversation
+
+    class Meta:
+        table_name = "conversations"
+
+        indexes = ((("user", "course", "active"), False),)
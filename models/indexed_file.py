@@ -0,0 +1,30 @@
+"""
+Model for course material files indexed for local retrieval.
+"""
+
+from peewee import (
+    CharField,
+    FloatField,
+    IntegerField,
+)
+from models.base import Base
+
+
+# Define the IndexedFile model
+class IndexedFile(Base):
+    """
+    A course material file whose passages are in the local retrieval index.
+    The modification time and size tell whether the file changed since it was indexed.
+    """
+
+    course = CharField(null=False, unique=False)  # course title
+    path = CharField(
+        null=False, unique=False
+    )  # path relative to the materials directory
+    mtime = FloatField(null=False)  # modification time when indexed
+    size = IntegerField(null=False)  # size in bytes when indexed
+
+    class Meta:
+        table_name = "indexed_files"
+
+        indexes = ((("course", "path"), True),)
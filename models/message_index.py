@@ -0,0 +1,70 @@
+"""
+Model for the full-text search index of logged messages.
+"""
+
+from playhouse.sqlite_ext import FTS5Model, SearchField
+from models.base import db
+from models.message import Message
+
+# keep the index in step with every insert, update, and delete of messages
+SYNC_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+]
+
+
+# Define the MessageIndex model
+class MessageIndex(FTS5Model):
+    """
+    An FTS5 index of the content of messages, which it reads from the messages table rather than storing twice.
+    Triggers on the messages table keep it in sync, whichever code writes messages.
+    """
+
+    content = SearchField()  # the text of the message, tokenized for search
+
+    class Meta:
+        database = db
+        table_name = "messages_fts"
+        depends_on = [Message]  # created after messages, which the triggers are on
+        options = {
+            "content": Message._meta.table_name,
+            "content_rowid": "id",
+            "tokenize": "porter unicode61",  # match 'exams' to 'exam', and ignore case and accents
+        }
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """
+        Create the index and its triggers, indexing any messages logged before it existed.
+        """
+        existed = cls.table_exists()
+        super().create_table(safe=safe, **options)
+        for trigger in SYNC_TRIGGERS:
+            cls._meta.database.execute_sql(trigger)
+        if not existed:
+            cls.rebuild()  # FTS5's own 'rebuild' command
+
+    @classmethod
+    def drop_table(cls, safe=True, **options):
+        """
+        Drop the index and its triggers, which would otherwise fail every write to messages.
+        """
+        for name in ("insert", "delete", "update"):
+            cls._meta.database.execute_sql(
+                f"DROP TRIGGER IF EXISTS messages_fts_{name}"
+            )
+        super().drop_table(safe=safe, **options)
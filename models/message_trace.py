@@ -0,0 +1,51 @@
+"""
+Model for the timing of each message the bot handles.
+"""
+
+from peewee import (
+    BigIntegerField,
+    CharField,
+    DateTimeField,
+    ForeignKeyField,
+    IntegerField,
+)
+from models.base import Base
+from models.message import Message
+
+
+# Define the MessageTrace model
+class MessageTrace(Base):
+    """
+    When each stage of handling a message happened, and what the model call cost, linked to the logged messages.
+    Timestamps that don't apply, e.g. model timestamps for cached answers, are left empty.
+    """
+
+    message = ForeignKeyField(
+        Message, backref="traces", on_delete="CASCADE", null=True
+    )  # the incoming message
+    reply = ForeignKeyField(
+        Message, backref="reply_traces", on_delete="SET NULL", null=True
+    )  # the bot's reply
+    discord_message_id = BigIntegerField(null=True, unique=False)  # Discord message id
+    course = CharField(null=True, unique=False)  # course title
+    outcome = CharField(null=True, unique=False)  # 'answered', 'cached', or 'error'
+    received_at = DateTimeField(null=True)  # message received from Discord
+    routed_at = DateTimeField(null=True)  # course determined
+    queued_at = DateTimeField(null=True)  # reply queued in the scheduler
+    started_at = DateTimeField(null=True)  # reply's turn came
+    requested_at = DateTimeField(null=True)  # OpenAI request sent
+    first_byte_at = DateTimeField(null=True)  # first text received from OpenAI
+    completed_at = DateTimeField(null=True)  # OpenAI response completed
+    sent_at = DateTimeField(null=True)  # reply sent to Discord
+    model = CharField(null=True, unique=False)  # model that answered
+    input_tokens = IntegerField(null=True)
+    output_tokens = IntegerField(null=True)
+    error_class = CharField(null=True, unique=False)  # class of the error, if any
+
+    class Meta:
+        table_name = "message_traces"
+
+        indexes = (
+            (("course", "received_at"), False),
+            (("received_at",), False),
+        )
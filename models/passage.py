@@ -0,0 +1,34 @@
+"""
+Model for passages of course material in the local retrieval index.
+"""
+
+from peewee import (
+    CharField,
+    ForeignKeyField,
+    IntegerField,
+)
+from models.base import Base
+from models.indexed_file import IndexedFile
+
+
+# Define the Passage model
+class Passage(Base):
+    """
+    A passage of a course material file, the unit of local retrieval.
+    """
+
+    file = ForeignKeyField(
+        IndexedFile, backref="passages", on_delete="CASCADE", null=False
+    )  # the file the passage comes from
+    course = CharField(null=False, unique=False)  # course title
+    ordinal = IntegerField(null=False)  # position of the passage in its file
+    content = CharField(null=False, unique=False)  # text of the passage
+    length = IntegerField(null=False)  # number of terms in the passage
+
+    class Meta:
+        table_name = "passages"
+
+        indexes = (
+            (("course",), False),
+            (("file",), False),
+        )
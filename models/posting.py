@@ -0,0 +1,33 @@
+"""
+Model for the inverted index of course material passages.
+"""
+
+from peewee import (
+    CharField,
+    ForeignKeyField,
+    IntegerField,
+)
+from models.base import Base
+from models.passage import Passage
+
+
+# Define the Posting model
+class Posting(Base):
+    """
+    An occurrence of a term in a passage, with the number of times it occurs there.
+    """
+
+    course = CharField(null=False, unique=False)  # course title
+    term = CharField(null=False, unique=False)  # normalized term
+    passage = ForeignKeyField(
+        Passage, backref="postings", on_delete="CASCADE", null=False
+    )  # the passage the term occurs in
+    frequency = IntegerField(null=False)  # number of occurrences in the passage
+
+    class Meta:
+        table_name = "postings"
+
+        indexes = (
+            (("course", "term"), False),
+            (("passage",), False),
+        )
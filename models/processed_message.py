@@ -0,0 +1,34 @@
+"""
+Model for Discord messages the bot has claimed for handling.
+"""
+
+from peewee import (
+    BigIntegerField,
+    CharField,
+    IntegerField,
+)
+from models.base import Base
+
+
+# Define the ProcessedMessage model
+class ProcessedMessage(Base):
+    """
+    A Discord message the bot has claimed, so it is not handled twice after a gateway resume or restart.
+    A claim is 'claimed' while the message is being handled, and 'replied' once the bot is done with it.
+    The updated_at time is when the message was last claimed.
+    Rows expire once Discord can no longer redeliver the message.
+    """
+
+    discord_message_id = BigIntegerField(null=False, unique=True)  # Discord message id
+    channel_id = BigIntegerField(null=True)  # Discord channel id, to fetch it again
+    course = CharField(null=True, unique=False)  # course title, if any
+    state = CharField(null=False, default="claimed")  # 'claimed' or 'replied'
+    attempts = IntegerField(null=False, default=1)  # times the message was claimed
+
+    class Meta:
+        table_name = "processed_messages"
+
+        indexes = (
+            (("created_at",), False),
+            (("state", "updated_at"), False),
+        )
@@ -0,0 +1,42 @@
+"""
+Model for Discord rate limit state shared by every process using the bot token.
+"""
+
+from peewee import (
+    CharField,
+    FloatField,
+    IntegerField,
+    SqliteDatabase,
+)
+from models.base import Base, db_path
+
+# rate limits are shared through a database of their own, next to the main one, in WAL mode so
+# readers never wait for a writer, and with a short busy timeout so a busy writer delays a sync
+# by a moment rather than seconds
+rate_limit_db_path = db_path.with_name(f"{db_path.stem}_rate_limits{db_path.suffix}")
+rate_limit_db = SqliteDatabase(
+    rate_limit_db_path, timeout=0.25, pragmas={"journal_mode": "wal"}
+)
+
+
+# Define the RateLimit model
+class RateLimit(Base):
+    """
+    The last known state of a Discord rate limit bucket, from the headers of a response that nearly used it up.
+    The 'global' row records a global rate limit, which blocks every route until it resets.
+    The 'interactive' row is a heartbeat, updated while any process is making interactive requests.
+    """
+
+    key = CharField(null=False, unique=True)  # 'global', 'interactive', or a route
+    bucket = CharField(null=True, unique=False)  # Discord's X-RateLimit-Bucket hash
+    limit = IntegerField(null=True, unique=False)  # requests allowed per window
+    remaining = IntegerField(null=True, unique=False)  # requests left in this window
+    reset_at = FloatField(null=True, unique=False)  # unix time the window resets
+    # unix time of the latest 429 response
+    rate_limited_at = FloatField(null=True, unique=False)
+
+    class Meta:
+        database = rate_limit_db
+        table_name = "rate_limits"
+
+        indexes = ((("reset_at",), False),)
@@ -0,0 +1,133 @@
+"""
+Model for daily usage totals of the bot, kept up to date as messages are logged.
+"""
+
+import datetime
+from peewee import (
+    Case,
+    CharField,
+    DateField,
+    ForeignKeyField,
+    IntegerField,
+    fn,
+)
+from models.base import Base
+from models.user import User
+from models.message import Message
+
+
+# Define the UsageRollup model
+class UsageRollup(Base):
+    """
+    How many messages a user exchanged with the bot in a course category on a day, and how long they were.
+    Reports read these small daily totals instead of aggregating over every logged message.
+    """
+
+    day = DateField(null=False)  # the day the messages were logged
+    course = CharField(null=False, default="")  # course title, or '' if unknown
+    category = CharField(null=False)  # Discord category name
+    user = ForeignKeyField(
+        User, backref="usage_rollups", on_delete="CASCADE", null=False
+    )  # the user who sent or received the messages
+    questions = IntegerField(null=False, default=0)  # messages from the user
+    replies = IntegerField(null=False, default=0)  # messages to the user
+    question_chars = IntegerField(null=False, default=0)  # total length of questions
+    reply_chars = IntegerField(null=False, default=0)  # total length of replies
+
+    class Meta:
+        table_name = "usage_rollups"
+
+        indexes = (
+            (("day", "course", "category", "user"), True),
+            (("user",), False),
+        )
+
+    @classmethod
+    def record(cls, message, course=None):
+        """
+        Add a logged message to its day's totals.
+
+        Args:
+            message (Message): The logged message.
+            course (str): The title of the course the message is about, if known.
+        """
+        is_question = message.direction == "from"
+        length = len(message.content or "")
+        counts = {
+            cls.questions: 1 if is_question else 0,
+            cls.replies: 0 if is_question else 1,
+            cls.question_chars: length if is_question else 0,
+            cls.reply_chars: 0 if is_question else length,
+        }
+        cls.insert(
+            day=message.created_at.date(),
+            course=course or "",
+            category=message.category,
+            user=message.user_id,
+            **{field.name: value for field, value in counts.items()},
+        ).on_conflict(
+            conflict_target=[cls.day, cls.course, cls.category, cls.user],
+            update={
+                **{field: field + value for field, value in counts.items()},
+                cls.updated_at: datetime.datetime.now(),
+            },
+        ).execute()
+
+    @classmethod
+    def rebuild(cls, courses_by_category=None):
+        """
+        Recompute the totals of the logged messages, e.g. for messages logged before totals were kept.
+        Archived messages are no longer logged, so each category's totals are only recomputed from the
+        day after its earliest logged message... earlier totals are kept. The earliest day itself may have
+        been only partly archived, so its totals are kept too, and only filled in where missing.
+
+        Args:
+            courses_by_category (dict): Category name -> course title, since messages don't record their course.
+        Returns:
+            int: The number of daily totals recomputed or filled in.
+        """
+        courses_by_category = courses_by_category or {}
+        day = fn.date(Message.created_at)
+        first_days = {
+            category: first_logged_at.date()
+            for category, first_logged_at in Message.select(
+                Message.category, fn.min(Message.created_at)
+            )
+            .group_by(Message.category)
+            .tuples()
+        }
+        question = Case(None, [(Message.direction == "from", 1)], 0)
+        reply = 1 - question
+        length = fn.length(Message.content)
+        totals = (
+            Message.select(
+                day.alias("day"),
+                Message.category,
+                Message.user,
+                fn.sum(question).alias("questions"),
+                fn.sum(reply).alias("replies"),
+                fn.sum(length * question).alias("question_chars"),
+                fn.sum(length * reply).alias("reply_chars"),
+            )
+            .group_by(day, Message.category, Message.user)
+            .dicts()
+        )
+        rows, first_day_rows = [], []
+        for row in totals:
+            row["course"] = courses_by_category.get(row["category"], "")
+            if row["day"].date() == first_days[row["category"]]:
+                first_day_rows.append(row)
+            else:
+                rows.append(row)
+        with cls._meta.database.atomic():
+            for category, first_day in first_days.items():
+                cls.delete().where(
+                    (cls.category == category) & (cls.day > first_day)
+                ).execute()
+            for i in range(0, len(rows), 500):
+                cls.insert_many(rows[i : i + 500]).execute()
+            for i in range(0, len(first_day_rows), 500):
+                cls.insert_many(
+                    first_day_rows[i : i + 500]
+                ).on_conflict_ignore().execute()
+        return len(rows) + len(first_day_rows)
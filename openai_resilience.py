@@ -0,0 +1,264 @@
+"""
+Tail-latency protection for OpenAI calls.
+Each call gets a hard deadline, so a slow provider can't keep a student waiting indefinitely.
+A circuit breaker per model stops sending requests to a model that keeps failing, and
+a call that is slower than a threshold can be hedged with a second request to a faster
+fallback model, taking whichever answers first.
+"""
+
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """
+    Raised when every model a call could use has its circuit breaker open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a model after repeated failures, and lets a single trial call through after a cool-down.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=60):
+        """
+        Set up the breaker, closed.
+
+        Args:
+            name (str): The name of the model, for logging.
+            failure_threshold (int): The number of consecutive failures that open the breaker.
+            reset_seconds (float): How long the breaker stays open before a trial call is allowed.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0  # consecutive failures
+        self.opened_at = None  # when the breaker opened, or None if closed
+        self.trial = False  # whether a trial call is in flight
+
+    @property
+    def state(self):
+        """
+        The state of the breaker: 'closed', 'open', or 'half-open'.
+        """
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    @property
+    def available(self):
+        """
+        Whether a call could be made now, without reserving the trial call.
+        """
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self.trial)
+
+    def allow(self):
+        """
+        Check whether a call may be made, reserving the trial call if the breaker is half-open.
+
+        Returns:
+            bool: Whether the call may be made.
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def record_success(self):
+        """
+        Record a successful call, closing the breaker.
+        """
+        if self.opened_at is not None:
+            logger.info("Circuit breaker for '%s' closed.", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        """
+        Record a failed call, opening the breaker if there have been too many in a row.
+        """
+        self.failures += 1
+        if self.trial or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.trial:
+                logger.warning(
+                    "Circuit breaker for '%s' opened after %s failures.",
+                    self.name,
+                    self.failures,
+                )
+            self.opened_at = time.monotonic()
+        self.trial = False
+
+
+class ResilientCaller:
+    """
+    Make OpenAI calls with a deadline, circuit breakers, and optional hedging to a fallback model.
+    """
+
+    def __init__(
+        self,
+        timeout=30,
+        hedge_after=None,
+        fallback_model=None,
+        breakers=None,
+        failure_threshold=5,
+        reset_seconds=60,
+    ):
+        """
+        Set up the caller.
+
+        Args:
+            timeout (float): The maximum number of seconds a call may take, including any fallback.
+            hedge_after (float): Seconds after which a slow call is hedged with a call to the fallback model, or None to never hedge.
+            fallback_model (str): The model to fall back to when the requested one is slow, failing, or unavailable, if any.
+            breakers (dict): Model -> CircuitBreaker, to share breakers between callers. Defaults to a new dict.
+            failure_threshold (int): The number of consecutive failures that open a model's breaker.
+            reset_seconds (float): How long a model's breaker stays open before a trial call is allowed.
+        """
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.fallback_model = fallback_model
+        self.breakers = breakers if breakers is not None else {}
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+    @property
+    def may_retry(self):
+        """
+        Whether a call may make more than one attempt, i.e. whether it has a fallback model.
+        """
+        return self.fallback_model is not None
+
+    def breaker(self, model):
+        """
+        Get the circuit breaker of a model, creating it if needed.
+        """
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(
+                model, self.failure_threshold, self.reset_seconds
+            )
+        return self.breakers[model]
+
+    async def call(self, attempt, model, hedge=True):
+        """
+        Make a call, within the deadline.
+
+        Args:
+            attempt (callable): A coroutine function taking a model name and returning the response.
+            model (str): The model requested.
+            hedge (bool): Whether the call may be hedged, i.e. whether two attempts may safely run at once.
+        Returns:
+            The response of the first attempt to succeed.
+        Raises:
+            CircuitOpen: If no model is available.
+            asyncio.TimeoutError: If no attempt succeeded before the deadline.
+            Exception: The error of the last attempt, if all attempts failed.
+        """
+        models = [
+            name
+            for name in dict.fromkeys([model, self.fallback_model])
+            if name and self.breaker(name).available
+        ]
+        if not models:
+            raise CircuitOpen(f"Circuit breaker open for '{model}'.")
+        if model not in models:
+            logger.warning(
+                "'%s' is unavailable... using '%s' instead.", model, models[0]
+            )
+
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        if hedge and self.hedge_after is not None and len(models) > 1:
+            return await self._hedged(attempt, models, deadline)
+        return await self._sequential(attempt, models, deadline)
+
+    async def _run(self, attempt, model, timeout):
+        """
+        Make a single attempt, recording its outcome in the model's breaker.
+        """
+        if not self.breaker(model).allow():
+            raise CircuitOpen(f"Circuit breaker open for '{model}'.")
+        try:
+            response = await asyncio.wait_for(attempt(model), timeout)
+        except asyncio.CancelledError:
+            # cancelled because another attempt won... says nothing about this model
+            self.breaker(model).trial = False
+            raise
+        except Exception:
+            self.breaker(model).record_failure()
+            raise
+        self.breaker(model).record_success()
+        return response
+
+    async def _sequential(self, attempt, models, deadline):
+        """
+        Try each model in turn until one succeeds or the deadline passes.
+        A model with another after it gets at most the hedging threshold, so the next has time to answer.
+        """
+        loop = asyncio.get_running_loop()
+        error = None
+        for i, model in enumerate(models):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if self.hedge_after is not None and i < len(models) - 1:
+                remaining = min(remaining, self.hedge_after)
+            try:
+                return await self._run(attempt, model, remaining)
+            except Exception as e:
+                logger.warning("OpenAI call to '%s' failed: %r", model, e)
+                error = e
+        raise error or asyncio.TimeoutError()
+
+    async def _hedged(self, attempt, models, deadline):
+        """
+        Call the first model, and the fallback model too if the first is slower than the hedging threshold.
+        The first attempt to succeed wins, and the other is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        primary, fallback = models[0], models[1]
+        pending = {
+            asyncio.create_task(self._run(attempt, primary, deadline - loop.time()))
+        }
+        error = None
+        try:
+            done, pending = await asyncio.wait(
+                pending, timeout=min(self.hedge_after, deadline - loop.time())
+            )
+            for task in done:
+                if not task.exception():
+                    return task.result()
+                error = task.exception()
+            # the primary is slow or failed... race the fallback against it
+            logger.info(
+                "Hedging slow OpenAI call to '%s' with '%s' after %ss.",
+                primary,
+                fallback,
+                self.hedge_after,
+            )
+            pending.add(
+                asyncio.create_task(
+                    self._run(attempt, fallback, deadline - loop.time())
+                )
+            )
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if not task.exception():
+                        return task.result()
+                    error = task.exception()
+            raise error or asyncio.TimeoutError()
+        finally:
+            for task in pending:
+                task.cancel()
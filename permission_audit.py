@@ -0,0 +1,267 @@
+"""
+Effective permissions of every member in every channel of a guild, computed in one vectorized pass.
+Role permissions and overwrites are compiled into 64-bit permission bitmasks, so questions like
+"who can see this channel" or "are these channels really private" need no per-member API calls.
+"""
+
+import csv
+import numpy as np
+import discord
+
+ALL_PERMISSIONS = np.uint64(discord.Permissions.all().value)
+ADMINISTRATOR = np.uint64(discord.Permissions(administrator=True).value)
+VIEW_CHANNEL = np.uint64(discord.Permissions(view_channel=True).value)
+BITS = np.arange(64, dtype=np.uint64)
+
+
+def to_bits(values):
+    """
+    Expand permission bitmasks into boolean bit arrays.
+
+    Args:
+        values (array-like): Permission bitmasks.
+    Returns:
+        numpy.ndarray: Boolean array with an extra trailing axis of 64 bits, least significant first.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    return ((values[..., None] >> BITS) & np.uint64(1)).astype(bool)
+
+
+def from_bits(bits):
+    """
+    Pack boolean bit arrays back into permission bitmasks.
+
+    Args:
+        bits (numpy.ndarray): Boolean array whose trailing axis holds 64 bits, least significant first.
+    Returns:
+        numpy.ndarray: The permission bitmasks, as unsigned 64-bit integers.
+    """
+    packed = np.packbits(bits, axis=-1, bitorder="little")
+    return np.ascontiguousarray(packed).view("<u8")[..., 0]
+
+
+class PermissionAudit:
+    """
+    The effective-permission matrix of a guild's members by its channels.
+    Follows Discord's permission hierarchy: base role permissions, administrator and owner overrides,
+    then @everyone, role, and member overwrites in that order, and no permissions at all without view access.
+    """
+
+    def __init__(self, guild, channels=None):
+        """
+        Compile the guild's roles and overwrites and compute the effective-permission matrix,
+        along with a matrix of which members were explicitly granted view access to each channel.
+
+        Args:
+            guild (discord.Guild): The guild to audit.
+            channels (iterable): The channels and/or categories to audit. Defaults to all of the guild's channels.
+        """
+        self.guild = guild
+        self.members = list(guild.members)
+        self.channels = list(guild.channels if channels is None else channels)
+        self.member_ids = np.array(
+            [member.id for member in self.members], dtype=np.uint64
+        )
+        self.channel_ids = np.array(
+            [channel.id for channel in self.channels], dtype=np.uint64
+        )
+        self.member_index = {member.id: i for i, member in enumerate(self.members)}
+        self.channel_index = {channel.id: j for j, channel in enumerate(self.channels)}
+        self.matrix = self._compute()
+
+    def _compute(self):
+        """
+        Compute the (members x channels) matrix of effective permission bitmasks.
+        Members with identical sets of roles share their role-derived permissions, so the heavy
+        lifting is done once per distinct role set rather than once per member.
+        """
+        roles = self.guild.roles
+        role_index = {role.id: k for k, role in enumerate(roles)}
+        everyone_id = self.guild.default_role.id
+        num_channels = len(self.channels)
+
+        # role membership of each distinct set of roles
+        role_sets = {}
+        member_role_set = np.empty(len(self.members), dtype=np.int64)
+        for i, member in enumerate(self.members):
+            key = frozenset(role.id for role in member.roles) | {everyone_id}
+            member_role_set[i] = role_sets.setdefault(key, len(role_sets))
+        membership = np.zeros((len(role_sets), len(roles)), dtype=np.int32)
+        for key, u in role_sets.items():
+            membership[
+                u, [role_index[role_id] for role_id in key if role_id in role_index]
+            ] = 1
+
+        # base permissions: the union of the permissions of each role
+        role_bits = to_bits([role.permissions.value for role in roles]).astype(np.int32)
+        base = from_bits((membership @ role_bits) > 0)
+
+        # compile the overwrites of each channel into allow/deny bitmasks
+        everyone_allow = np.zeros(num_channels, dtype=np.uint64)
+        everyone_deny = np.zeros(num_channels, dtype=np.uint64)
+        role_allow = np.zeros((len(roles), num_channels), dtype=np.uint64)
+        role_deny = np.zeros((len(roles), num_channels), dtype=np.uint64)
+        member_overwrites = []  # (member index, channel index, allow, deny)
+        self.granted = np.zeros((len(self.members), num_channels), dtype=bool)
+        role_granted = np.zeros((len(roles), num_channels), dtype=np.int32)
+        for j, channel in enumerate(self.channels):
+            for target, overwrite in channel.overwrites.items():
+                allow, deny = (permissions.value for permissions in overwrite.pair())
+                grants_view = bool(allow & int(VIEW_CHANNEL))
+                if target.id == everyone_id:
+                    everyone_allow[j], everyone_deny[j] = allow, deny
+                elif target.id in role_index:
+                    role_allow[role_index[target.id], j] = allow
+                    role_deny[role_index[target.id], j] = deny
+                    role_granted[role_index[target.id], j] = grants_view
+                elif target.id in self.member_index:
+                    member_overwrites.append(
+                        (self.member_index[target.id], j, allow, deny)
+                    )
+                    self.granted[self.member_index[target.id], j] = grants_view
+
+        # role overwrites: the union of the allows and denies of each role a member has
+        other_roles = membership.copy()
+        if everyone_id in role_index:
+            # @everyone overwrites were applied separately
+            other_roles[:, role_index[everyone_id]] = 0
+        self.granted |= ((other_roles @ role_granted) > 0)[member_role_set]
+        shape = (len(role_sets), num_channels, 64)
+        combined_allow = from_bits(
+            (
+                other_roles
+                @ to_bits(role_allow).reshape(len(roles), -1).astype(np.int32)
+                > 0
+            ).reshape(shape)
+        )
+        combined_deny = from_bits(
+            (
+                other_roles
+                @ to_bits(role_deny).reshape(len(roles), -1).astype(np.int32)
+                > 0
+            ).reshape(shape)
+        )
+
+        # apply the overwrites in order for each distinct role set, then expand to members
+        permissions = (base[:, None] & ~everyone_deny) | everyone_allow
+        permissions = (permissions & ~combined_deny) | combined_allow
+        matrix = permissions[member_role_set]
+        if member_overwrites:
+            rows, cols, allow, deny = (
+                np.array(values) for values in zip(*member_overwrites)
+            )
+            allow, deny = allow.astype(np.uint64), deny.astype(np.uint64)
+            matrix[rows, cols] = (matrix[rows, cols] & ~deny) | allow
+
+        # administrators and the owner bypass overwrites entirely
+        self.bypass = (base[member_role_set] & ADMINISTRATOR) != 0
+        if self.guild.owner_id in self.member_index:
+            self.bypass[self.member_index[self.guild.owner_id]] = True
+        matrix[self.bypass] = ALL_PERMISSIONS
+
+        # without view access, a member has no permissions in the channel at all
+        matrix[(matrix & VIEW_CHANNEL) == 0] = 0
+        return matrix
+
+    def allowed(self, permission="view_channel"):
+        """
+        Get a boolean (members x channels) matrix of whether each member has a given permission in each channel.
+
+        Args:
+            permission (str): The name of the permission, e.g. 'view_channel' or 'send_messages'.
+        Returns:
+            numpy.ndarray: The boolean matrix.
+        """
+        flag = np.uint64(discord.Permissions.VALID_FLAGS[permission])
+        return (self.matrix & flag) != 0
+
+    def members_who_can(self, channel_id, permission="view_channel"):
+        """
+        Get the members who have a given permission in a channel.
+
+        Args:
+            channel_id (int): The ID of the channel or category.
+            permission (str): The name of the permission.
+        Returns:
+            list: The discord.Member objects.
+        """
+        j = self.channel_index[int(channel_id)]
+        rows = np.flatnonzero(self.allowed(permission)[:, j])
+        return [self.members[i] for i in rows]
+
+    def channels_member_can(self, member_id, permission="view_channel"):
+        """
+        Get the channels in which a member has a given permission.
+
+        Args:
+            member_id (int): The ID of the member.
+            permission (str): The name of the permission.
+        Returns:
+            list: The channel objects.
+        """
+        i = self.member_index[int(member_id)]
+        cols = np.flatnonzero(self.allowed(permission)[i, :])
+        return [self.channels[j] for j in cols]
+
+    def audit_private(self, ignore_administrators=True):
+        """
+        Find members who can see channels that were not explicitly opened to them.
+        A member is expected to see a private channel only if it has an overwrite granting view access
+        to the member, or to one of the member's roles other than @everyone.
+
+        Args:
+            ignore_administrators (bool): Whether to ignore administrators and the owner, who can see everything.
+        Returns:
+            dict: Channel ID -> list of discord.Member objects who can unexpectedly see the channel.
+        """
+        visible = self.allowed("view_channel")
+        expected = self.granted.copy()
+        if ignore_administrators:
+            expected[self.bypass] = True
+        unexpected = visible & ~expected
+        return {
+            channel.id: [self.members[i] for i in np.flatnonzero(unexpected[:, j])]
+            for j, channel in enumerate(self.channels)
+            if unexpected[:, j].any()
+        }
+
+    def export(self, path):
+        """
+        Export the effective-permission matrix.
+        A '.npz' path saves the raw matrix with its member and channel IDs; any other path saves a CSV
+        file with one row for every member who can view every channel.
+
+        Args:
+            path (str): The file path to write to.
+        """
+        if str(path).endswith(".npz"):
+            np.savez_compressed(
+                path,
+                member_ids=self.member_ids,
+                channel_ids=self.channel_ids,
+                permissions=self.matrix,
+            )
+            return
+        rows, cols = np.nonzero(self.allowed("view_channel"))
+        with open(path, mode="w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "member_id",
+                    "member_name",
+                    "channel_id",
+                    "channel_name",
+                    "permissions",
+                ]
+            )
+            for i, j in zip(rows, cols):
+                member, channel = self.members[i], self.channels[j]
+                writer.writerow(
+                    [
+                        member.id,
+                        member.name,
+                        channel.id,
+                        channel.name,
+                        int(self.matrix[i, j]),
+                    ]
+                )
@@ -0,0 +1,211 @@
+"""
+Find where time and memory go, in command line runs and in the live bot.
+A whole run can be profiled with cProfile, e.g. to see what a member scan costs. The live bot
+can instead be sampled on demand, without restarting it: for a number of seconds its CPU time is
+profiled, and afterwards a tracemalloc snapshot is compared to the previous one, to show which
+lines of code memory grew from. Memory tracing starts at the first sample, and stays on after it.
+"""
+
+import io
+import signal
+import asyncio
+import cProfile
+import datetime
+import logging
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SORT = "cumulative"  # see pstats.SortKey
+DEFAULT_LIMIT = 25  # functions or lines to list in summaries
+MAX_SAMPLE_SECONDS = 300  # longest sample an HTTP request may ask for
+
+
+def summarize(profile, sort=DEFAULT_SORT, limit=DEFAULT_LIMIT):
+    """
+    Summarize a CPU profile as the functions that took the most time.
+
+    Args:
+        profile (cProfile.Profile): The finished profile.
+        sort (str): What to sort functions by, e.g. 'cumulative' or 'tottime'.
+        limit (int): How many functions to list.
+    Returns:
+        str: The summary, as printed by pstats.
+    """
+    output = io.StringIO()
+    pstats.Stats(profile, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+@contextmanager
+def profile_run(path, sort=DEFAULT_SORT, limit=DEFAULT_LIMIT):
+    """
+    Profile the body of a with statement, even if it raises.
+    Writes pstats data to the path, e.g. for snakeviz or python -m pstats, and a summary next to it with a .txt extension.
+
+    Args:
+        path (str or Path): The file to write the pstats data to.
+        sort (str): What to sort functions by in the summary.
+        limit (int): How many functions to list in the summary.
+    """
+    path = Path(path).expanduser()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        path.with_suffix(".txt").write_text(summarize(profile, sort, limit))
+        logger.info("Profile written to %s", path)
+
+
+class LiveProfiler:
+    """
+    Sample a running process's CPU time and memory growth on demand, by signal or HTTP request.
+    """
+
+    def __init__(
+        self,
+        profiles_dir="./profiles",
+        sample_seconds=30,
+        limit=DEFAULT_LIMIT,
+        memory_frames=10,
+    ):
+        """
+        Set up the profiler.
+
+        Args:
+            profiles_dir (str or Path): The directory to write samples to. Created if it does not exist.
+            sample_seconds (float): How long to sample CPU time for, unless asked otherwise.
+            limit (int): How many functions or lines to list in summaries.
+            memory_frames (int): How many stack frames to record for each memory allocation.
+        """
+        self.profiles_dir = Path(profiles_dir).expanduser()
+        self.sample_seconds = sample_seconds
+        self.limit = limit
+        self.memory_frames = memory_frames
+        self.snapshot = None  # tracemalloc snapshot at the end of the last sample
+        self.sampling = False
+        self.tasks = set()  # samples started by signal, kept until done
+
+    async def sample(self, seconds=None):
+        """
+        Profile the event loop's CPU time for a while, then compare memory to the last sample.
+        The first sample compares memory to its own start, since memory is only traced from then on.
+
+        Args:
+            seconds (float): How long to profile for. Defaults to sample_seconds.
+        Returns:
+            dict: The paths of the files written: 'cpu' (pstats data), 'cpu_summary', and 'memory'.
+        """
+        if self.sampling:
+            raise RuntimeError("A profile is already being sampled.")
+        self.sampling = True
+        seconds = seconds or self.sample_seconds
+        try:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.memory_frames)
+                self.snapshot = self._take_snapshot()
+            logger.info("Sampling CPU and memory for %ss", seconds)
+
+            # everything on the event loop runs in this thread, so the profile sees all of it
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+
+            snapshot = self._take_snapshot()
+            growth = snapshot.compare_to(self.snapshot, "lineno")
+            self.snapshot = snapshot
+        finally:
+            self.sampling = False
+
+        self.profiles_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        paths = {
+            "cpu": self.profiles_dir / f"cpu-{stamp}.pstats",
+            "cpu_summary": self.profiles_dir / f"cpu-{stamp}.txt",
+            "memory": self.profiles_dir / f"memory-{stamp}.txt",
+        }
+        profile.dump_stats(paths["cpu"])
+        paths["cpu_summary"].write_text(summarize(profile, limit=self.limit))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"Traced memory: {current / 1024:.1f} KiB now, {peak / 1024:.1f} KiB at peak",
+            "Largest changes since the last sample, by line:",
+            *(str(stat) for stat in growth[: self.limit]),
+        ]
+        paths["memory"].write_text("\n".join(lines) + "\n")
+        logger.info("Profile samples written to %s", self.profiles_dir)
+        return paths
+
+    @staticmethod
+    def _take_snapshot():
+        """
+        Take a snapshot of traced memory, leaving out tracemalloc's own allocations.
+        """
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGUSR1", None)):
+        """
+        Take a sample whenever the process receives a signal, e.g. kill -USR1 <pid>.
+        Must be called from the running event loop. Does nothing where the signal is not supported, e.g. on Windows.
+
+        Args:
+            signum (int): The signal to sample on. Defaults to SIGUSR1.
+        Returns:
+            bool: Whether the handler was installed.
+        """
+        if signum is None:
+            return False
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signum, self._sample_in_background)
+        except (NotImplementedError, RuntimeError):
+            return False
+        return True
+
+    def _sample_in_background(self):
+        """
+        Start a sample without waiting for it, logging any failure.
+        """
+
+        async def sample():
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.error("Failed to sample profile: %s", e)
+
+        task = asyncio.create_task(sample())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle_request(self, request):
+        """
+        Take a sample for an aiohttp request, e.g. GET /profile?seconds=10, and respond with its summaries.
+        """
+        try:
+            seconds = float(request.query.get("seconds", self.sample_seconds))
+        except ValueError:
+            raise web.HTTPBadRequest(text="seconds must be a number.")
+        # also rejects nan, which fails every comparison
+        if not 0 < seconds <= MAX_SAMPLE_SECONDS:
+            raise web.HTTPBadRequest(
+                text=f"seconds must be more than 0 and at most {MAX_SAMPLE_SECONDS}."
+            )
+        try:
+            paths = await self.sample(seconds)
+        except RuntimeError as e:
+            raise web.HTTPConflict(text=str(e))
+        text = paths["cpu_summary"].read_text() + "\n" + paths["memory"].read_text()
+        return web.Response(text=text, content_type="text/plain", charset="utf-8")
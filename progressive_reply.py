@@ -0,0 +1,108 @@
+"""
+A Discord reply that is posted right away and then edited as the response streams in.
+Edits are coalesced so each channel stays within Discord's message edit rate limits,
+and text beyond Discord's message length limit continues in follow-up messages.
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DISCORD_MAX_MESSAGE_LENGTH = 2000  # characters per message
+# seconds between edits in a channel... Discord allows about 5 per 5 seconds
+DEFAULT_EDIT_INTERVAL = 1.2
+
+
+class ProgressiveReply:
+    """
+    A placeholder message that is progressively edited with streamed text.
+    """
+
+    # channel id -> time of the last edit, shared by all replies in that channel
+    last_edits = {}
+
+    def __init__(
+        self,
+        channel,
+        placeholder="…",
+        edit_interval=DEFAULT_EDIT_INTERVAL,
+        max_length=DISCORD_MAX_MESSAGE_LENGTH,
+        clean=None,
+    ):
+        """
+        Set up the reply. Nothing is posted until start() is called.
+
+        Args:
+            channel (discord.abc.Messageable): The channel to reply in.
+            placeholder (str): The text to show until the first text arrives.
+            edit_interval (float): The minimum number of seconds between edits in the channel.
+            max_length (int): The maximum length of each message.
+            clean (callable): A function to clean up the text before it is shown, if any.
+        """
+        self.channel = channel
+        self.placeholder = placeholder
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self.clean = clean or (lambda text: text)
+        self.text = ""  # all text received so far
+        self.messages = []  # the Discord messages showing the text
+        self.shown = []  # the text currently shown in each message
+
+    async def start(self):
+        """
+        Post the placeholder message.
+        """
+        message = await self.channel.send(self.placeholder)
+        self.messages.append(message)
+        self.shown.append(self.placeholder)
+
+    async def append(self, text):
+        """
+        Add streamed text, and show it if the channel is due for an edit.
+
+        Args:
+            text (str): The text to add.
+        """
+        self.text += text
+        last_edit = self.last_edits.get(self.channel.id, 0)
+        if time.monotonic() - last_edit >= self.edit_interval:
+            try:
+                await self._show(self.clean(self.text))
+            except Exception as e:
+                # a missed intermediate edit is harmless... the final text is shown by finish()
+                logger.warning(
+                    "Failed to edit reply in channel %s: %s", self.channel.id, e
+                )
+
+    async def finish(self, text=None):
+        """
+        Show the final text, regardless of edit timing.
+
+        Args:
+            text (str): The final text to show. Defaults to all text received so far.
+        """
+        text = self.clean(self.text) if text is None else text
+        await self._show(text or self.placeholder)
+
+    async def _show(self, text):
+        """
+        Edit the placeholder (and send or delete follow-up messages, if needed) to show the given text.
+        """
+        chunks = [
+            text[i : i + self.max_length] for i in range(0, len(text), self.max_length)
+        ] or [self.placeholder]
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages):
+                if self.shown[i] == chunk:
+                    continue  # nothing new to show in this message
+                await self.messages[i].edit(content=chunk)
+                self.shown[i] = chunk
+            else:
+                self.messages.append(await self.channel.send(chunk))
+                self.shown.append(chunk)
+        # the text got shorter, e.g. a retry replaced it... remove follow-ups it no longer needs
+        while len(self.messages) > len(chunks):
+            await self.messages.pop().delete()
+            self.shown.pop()
+        self.last_edits[self.channel.id] = time.monotonic()
@@ -0,0 +1,363 @@
+"""
+Discord rate limits shared by every process using one bot token.
+discord.py learns rate limits from response headers, but only within its own process, so
+provisioning scripts run while the bot is live keep hitting 429s the bot already knew about,
+and enough of them earn the whole token a global penalty that slows student replies.
+The governor keeps each route's bucket state, and any global rate limit, in memory, and
+waits before requests that it or another process has already found to be out of budget.
+Requests never touch the database: now and then, in a background thread, buckets that were
+nearly used up are shared through SQLite, and the buckets other processes shared are read back.
+Interactive traffic, i.e. the bot's replies, only waits out limits that are in force, and keeps
+a heartbeat in the store while it is active. Bulk traffic, e.g. creating channels, also leaves
+the last request in each bucket to interactive traffic, and runs at a concurrency that grows by
+one while requests succeed and halves on any 429 (additive increase, multiplicative decrease),
+and while the bot is busy.
+"""
+
+import re
+import time
+import asyncio
+import datetime
+import logging
+import aiohttp
+from peewee import EXCLUDED, OperationalError
+from models.rate_limit import RateLimit, rate_limit_db
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ["interactive", "bulk"]
+GLOBAL_KEY = "global"  # the key of the global rate limit's state
+INTERACTIVE_KEY = "interactive"  # the key of the interactive traffic heartbeat
+FIELDS = ["bucket", "limit", "remaining", "reset_at", "rate_limited_at", "updated_at"]
+
+# path segments whose ids are part of a route's bucket... other ids share one
+MAJOR_PARAMETERS = {"channels", "guilds", "webhooks"}
+
+
+def route_key(method, path):
+    """
+    Get the key of a request's route, e.g. 'PUT /channels/123/messages/{id}/reactions/{id}/@me'.
+
+    Args:
+        method (str): The HTTP method.
+        path (str): The request path, e.g. '/api/v10/channels/123/messages/456'.
+    Returns:
+        str: The method and path, with the API version and ids other than major parameters removed.
+    """
+    segments = re.sub(r"^/api/v\d+", "", path).split("/")
+    for i, segment in enumerate(segments):
+        if i and segment.isdigit() and segments[i - 1] not in MAJOR_PARAMETERS:
+            segments[i] = "{id}"
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+class RateLimitGovernor:
+    """
+    Pace one process's Discord requests by rate limit state shared with the others, through aiohttp trace hooks.
+    """
+
+    def __init__(
+        self,
+        priority="bulk",
+        concurrency=4,
+        min_concurrency=1,
+        max_concurrency=16,
+        interactive_window_seconds=10,
+        max_wait_seconds=60,
+        sync_interval_seconds=1,
+        ttl_seconds=24 * 3600,
+    ):
+        """
+        Set up the governor, deleting stale rate limit state.
+
+        Args:
+            priority (str): 'interactive' for traffic people are waiting on, or 'bulk' for batch jobs.
+            concurrency (int): How many bulk requests may be in flight at first.
+            min_concurrency (int): The fewest bulk requests allowed in flight, however often they are rate limited.
+            max_concurrency (int): The most bulk requests allowed in flight, however well they go.
+            interactive_window_seconds (float): How long after interactive traffic is seen that bulk traffic makes way for it.
+            max_wait_seconds (float): The longest to hold a request back, in case of bad state.
+            sync_interval_seconds (float): How often to share rate limit state with other processes, and read theirs.
+            ttl_seconds (int): How long to keep the state of routes no longer used.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unsupported rate limit priority '{priority}'.")
+        self.priority = priority
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.interactive_window = interactive_window_seconds
+        self.max_wait = max_wait_seconds
+        self.sync_interval = sync_interval_seconds
+        self.in_flight = 0
+        self.successes = 0  # successful bulk requests since concurrency last changed
+        # 429s before this were already acted on
+        self.last_rate_limited_at = time.time()
+        self.waited = 0.0  # total seconds requests were held back
+        self.changed = None  # asyncio.Condition, created on the client's event loop
+        self.buckets = (
+            {}
+        )  # route key or 'global' -> latest state known, from any process
+        self.unshared = {}  # route key or 'global' -> state to share at the next sync
+        self.requested_at = 0.0  # unix time of this process's latest request
+        self.heartbeat_at = (
+            0.0  # unix time this process last shared its interactive heartbeat
+        )
+        self.interactive_seen_at = (
+            0.0  # unix time of the latest interactive heartbeat shared
+        )
+        self.syncing = None  # the task syncing state with other processes, once started
+        RateLimit.create_table(safe=True)
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=ttl_seconds)
+        RateLimit.delete().where(RateLimit.updated_at < cutoff).execute()
+
+    @property
+    def limit(self):
+        """
+        How many bulk requests may be in flight now... fewer while interactive traffic is active.
+        """
+        if self.interactive_active():
+            return max(self.concurrency // 2, self.min_concurrency)
+        return self.concurrency
+
+    def trace_config(self, trace_config=None):
+        """
+        Hook the governor into aiohttp requests, e.g. for discord.py's http_trace option.
+
+        Args:
+            trace_config (aiohttp.TraceConfig): Existing hooks to add to. If None, a new trace config is created.
+        Returns:
+            aiohttp.TraceConfig: The trace config.
+        """
+        trace_config = trace_config or aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_request_exception.append(self._on_request_exception)
+        return trace_config
+
+    def interactive_active(self):
+        """
+        Check whether any process has made interactive requests recently, by the heartbeats last read.
+        """
+        return time.time() - self.interactive_seen_at < self.interactive_window
+
+    def delay(self, key):
+        """
+        Get how long to wait before a request on a route, by the known state of its bucket and any global rate limit.
+        Bulk requests act on any new 429 in that state by halving their concurrency.
+
+        Args:
+            key (str): The route key, from route_key().
+        Returns:
+            float: Seconds to wait, 0 if the request can go now.
+        """
+        now = time.time()
+        wait = 0.0
+        for bucket_key in (key, GLOBAL_KEY):
+            state = self.buckets.get(bucket_key)
+            if not state:
+                continue
+            rate_limited_at = state.get("rate_limited_at")
+            if (
+                self.priority == "bulk"
+                and rate_limited_at
+                and rate_limited_at > self.last_rate_limited_at
+            ):
+                self.last_rate_limited_at = rate_limited_at
+                self.decrease()
+            if not state.get("reset_at") or state["reset_at"] <= now:
+                continue
+            if bucket_key == GLOBAL_KEY:
+                wait = max(wait, state["reset_at"] - now)
+                continue
+            # leave the last request in a bucket for interactive traffic, while there is any
+            reserve = 1 if self.priority == "bulk" and self.interactive_active() else 0
+            if state.get("remaining") is not None and state["remaining"] <= reserve:
+                wait = max(wait, state["reset_at"] - now)
+        return min(wait, self.max_wait)
+
+    def record(self, key, status, headers):
+        """
+        Keep the rate limit state in a response's headers, to share with other processes if the bucket is nearly used up.
+
+        Args:
+            key (str): The route key, from route_key().
+            status (int): The HTTP status of the response.
+            headers (Mapping): The response headers.
+        """
+        now = time.time()
+        updated_at = datetime.datetime.now()
+        if "X-RateLimit-Bucket" in headers:
+            state = {
+                "bucket": headers["X-RateLimit-Bucket"],
+                "limit": int(headers.get("X-RateLimit-Limit", 1)),
+                "remaining": int(headers.get("X-RateLimit-Remaining", 0)),
+                # relative to our own clock, which may differ from Discord's
+                "reset_at": now + float(headers.get("X-RateLimit-Reset-After", 0)),
+                "rate_limited_at": now if status == 429 else None,
+                "updated_at": updated_at,
+            }
+            self.buckets[key] = state
+            # other processes only need to know about buckets they could run out of
+            if status == 429 or state["remaining"] <= 1:
+                self.unshared[key] = state
+        is_global = (
+            headers.get("X-RateLimit-Global", "").lower() == "true"
+            or headers.get("X-RateLimit-Scope") == "global"
+        )
+        if status == 429 and is_global:
+            retry_after = float(headers.get("Retry-After", 1))
+            state = {
+                "reset_at": now + retry_after,
+                "rate_limited_at": now,
+                "updated_at": updated_at,
+            }
+            self.buckets[GLOBAL_KEY] = self.unshared[GLOBAL_KEY] = state
+            logger.warning(
+                "Discord global rate limit hit by %s traffic, pausing all processes for %.1fs",
+                self.priority,
+                retry_after,
+            )
+
+    async def sync(self):
+        """
+        Share the state of nearly used up buckets, and this process's interactive heartbeat, with other processes,
+        and read back theirs, in a background thread, so the event loop never waits on the database.
+        """
+        unshared, self.unshared = self.unshared, {}
+        now = time.time()
+        heartbeat = (
+            self.priority == "interactive"
+            and self.requested_at > self.heartbeat_at
+            and now - self.heartbeat_at >= self.interactive_window / 2
+        )
+        try:
+            rows = await asyncio.to_thread(self._sync, unshared, heartbeat)
+        except OperationalError as e:
+            logger.warning("Could not sync shared rate limits: %s", e)
+            # try again at the next sync, unless newer state replaces it by then
+            for key, state in unshared.items():
+                self.unshared.setdefault(key, state)
+            return
+        if heartbeat:
+            self.heartbeat_at = now
+        for row in rows:
+            key = row.pop("key")
+            if key == INTERACTIVE_KEY:
+                self.interactive_seen_at = row["updated_at"].timestamp()
+            elif (
+                key not in self.buckets
+                or row["updated_at"] > self.buckets[key]["updated_at"]
+            ):
+                self.buckets[key] = row
+        # forget buckets whose windows have reset... they are known again from the next response
+        self.buckets = {
+            key: state
+            for key, state in self.buckets.items()
+            if (state.get("reset_at") or 0) > now
+        }
+
+    @staticmethod
+    def _sync(unshared, heartbeat):
+        """
+        Write rate limit state to the shared store, and read the state in force, in one go.
+        Runs in a background thread.
+        """
+        now = datetime.datetime.now()
+        with rate_limit_db.atomic():
+            for key, state in unshared.items():
+                # another process may have shared a newer state meanwhile
+                RateLimit.insert(key=key, **state).on_conflict(
+                    conflict_target=[RateLimit.key],
+                    preserve=[getattr(RateLimit, field) for field in state],
+                    where=(EXCLUDED.updated_at > RateLimit.updated_at),
+                ).execute()
+            if heartbeat:
+                RateLimit.insert(key=INTERACTIVE_KEY, updated_at=now).on_conflict(
+                    conflict_target=[RateLimit.key], preserve=[RateLimit.updated_at]
+                ).execute()
+        return list(
+            RateLimit.select(
+                RateLimit.key, *(getattr(RateLimit, field) for field in FIELDS)
+            )
+            .where(
+                (RateLimit.reset_at > time.time()) | (RateLimit.key == INTERACTIVE_KEY)
+            )
+            .dicts()
+        )
+
+    async def _sync_periodically(self):
+        """
+        Sync with other processes now and then, for as long as the event loop runs.
+        """
+        while True:
+            await self.sync()
+            await asyncio.sleep(self.sync_interval)
+
+    def increase(self):
+        """
+        Allow one more bulk request in flight, once a full round of requests has succeeded.
+        Waiting requests are woken when the finished request frees its slot.
+        """
+        self.successes += 1
+        if (
+            self.successes >= self.concurrency
+            and self.concurrency < self.max_concurrency
+        ):
+            self.concurrency += 1
+            self.successes = 0
+
+    def decrease(self):
+        """
+        Halve the bulk requests allowed in flight, after a 429.
+        """
+        self.concurrency = max(self.concurrency // 2, self.min_concurrency)
+        self.successes = 0
+        logger.info("Bulk Discord request concurrency reduced to %s", self.concurrency)
+
+    async def _on_request_start(self, session, context, params):
+        """
+        Hold a request back until its route, and its priority, allow it.
+        """
+        if self.syncing is None:
+            self.syncing = asyncio.create_task(self._sync_periodically())
+        self.requested_at = time.time()
+        context.key = route_key(params.method, params.url.path)
+        context.slot = False
+        if self.priority == "bulk":
+            self.changed = self.changed or asyncio.Condition()
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.in_flight < self.limit)
+                self.in_flight += 1
+                context.slot = True
+        wait = self.delay(context.key)
+        if wait > 0:
+            logger.debug("Waiting %.2fs for Discord route %s", wait, context.key)
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    async def _on_request_end(self, session, context, params):
+        """
+        Record the response's rate limit state, and adjust bulk concurrency to it.
+        """
+        self.record(context.key, params.response.status, params.response.headers)
+        if self.priority == "bulk":
+            if params.response.status == 429:
+                self.last_rate_limited_at = time.time()
+                self.decrease()
+            else:
+                self.increase()
+        await self._release(context)
+
+    async def _on_request_exception(self, session, context, params):
+        await self._release(context)
+
+    async def _release(self, context):
+        """
+        Free a request's bulk slot, if it has one.
+        """
+        if getattr(context, "slot", False):
+            context.slot = False
+            async with self.changed:
+                self.in_flight -= 1
+                self.changed.notify_all()
@@ -0,0 +1,162 @@
+"""
+Fair scheduling of bot replies between message intake and OpenAI calls.
+Each course gets its own share of model capacity (weighted fair queuing), each user
+can only have so many requests in flight, admins jump the queue, and the queue is
+bounded so bursts are turned away politely instead of piling up unbounded work.
+"""
+
+import asyncio
+import itertools
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted to a scheduler whose queue is already full.
+    """
+
+
+class ScheduledJob:
+    """
+    A job waiting in the scheduler's queue.
+    """
+
+    def __init__(self, job, course, user_id, priority, tag, seq):
+        self.job = job  # zero-argument coroutine function that does the work
+        self.course = course
+        self.user_id = user_id
+        self.priority = priority
+        self.tag = tag  # virtual finish time, for weighted fair queuing
+        self.seq = seq  # submission order, to break ties
+
+    @property
+    def key(self):
+        """
+        The sort key of the job: admins first, then by virtual finish time, then first come first served.
+        """
+        return (0 if self.priority else 1, self.tag, self.seq)
+
+
+class ReplyScheduler:
+    """
+    Weighted fair scheduler with per-course queues, per-user in-flight caps, and a bounded queue.
+    A course with weight 2 gets twice the share of a course with weight 1 while both have work waiting.
+    """
+
+    def __init__(
+        self,
+        max_concurrent=4,
+        max_queue_size=100,
+        max_in_flight_per_user=1,
+        weights=None,
+    ):
+        """
+        Set up the scheduler. Workers are started on the first submission.
+
+        Args:
+            max_concurrent (int): The maximum number of jobs running at once, i.e. the model capacity.
+            max_queue_size (int): The maximum number of jobs waiting to run.
+            max_in_flight_per_user (int): The maximum number of jobs running at once for any one user.
+            weights (dict): Course -> relative share of capacity. Courses not listed get a weight of 1.
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue_size = max_queue_size
+        self.max_in_flight_per_user = max_in_flight_per_user
+        self.weights = weights or {}
+        self.queue = []  # jobs waiting to run
+        self.in_flight = defaultdict(int)  # user id -> number of running jobs
+        self.running = 0  # total number of running jobs
+        self.virtual_time = 0.0  # finish tag of the last job dispatched
+        # course -> finish tag of its last queued job
+        self.last_tags = defaultdict(float)
+        self._seq = itertools.count()
+        self._condition = None
+        self._workers = []
+
+    def _start(self):
+        """
+        Start the worker tasks on the running event loop, once.
+        """
+        if self._workers:
+            return
+        self._condition = asyncio.Condition()
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"reply-worker-{i}")
+            for i in range(self.max_concurrent)
+        ]
+
+    def _eligible(self):
+        """
+        Get the next job to run: the one with the lowest key whose user is not at their in-flight cap.
+        """
+        eligible = [
+            job
+            for job in self.queue
+            if self.in_flight[job.user_id] < self.max_in_flight_per_user
+        ]
+        return min(eligible, key=lambda job: job.key) if eligible else None
+
+    async def submit(self, job, course, user_id, priority=False):
+        """
+        Queue a job to run when its turn comes.
+
+        Args:
+            job (callable): A zero-argument coroutine function that does the work.
+            course (str): The course the job is for, which determines its fair share.
+            user_id (int): The user the job is for, which determines their in-flight cap.
+            priority (bool): Whether the job comes from an admin and should go ahead of all other jobs.
+        Returns:
+            int: The job's position in the queue, or 0 if it will start right away.
+        Raises:
+            QueueFull: If the queue is already full.
+        """
+        self._start()
+        async with self._condition:
+            if len(self.queue) >= self.max_queue_size:
+                raise QueueFull(f"Reply queue is full ({self.max_queue_size} jobs).")
+
+            # the job finishes, in virtual time, one share after the course's previous job
+            weight = max(float(self.weights.get(course, 1)), 0.001)
+            start = max(self.virtual_time, self.last_tags[course])
+            self.last_tags[course] = start + 1 / weight
+            scheduled = ScheduledJob(
+                job, course, user_id, priority, self.last_tags[course], next(self._seq)
+            )
+            self.queue.append(scheduled)
+
+            position = 1 + sum(1 for other in self.queue if other.key < scheduled.key)
+            starts_now = (
+                self.running + position <= self.max_concurrent
+                and self.in_flight[user_id] < self.max_in_flight_per_user
+            )
+            self._condition.notify_all()
+        return 0 if starts_now else position
+
+    async def _work(self):
+        """
+        Worker loop: run the next eligible job, forever.
+        """
+        while True:
+            async with self._condition:
+                scheduled = self._eligible()
+                while scheduled is None:
+                    await self._condition.wait()
+                    scheduled = self._eligible()
+                self.queue.remove(scheduled)
+                self.in_flight[scheduled.user_id] += 1
+                self.running += 1
+                self.virtual_time = max(self.virtual_time, scheduled.tag)
+            try:
+                await scheduled.job()
+            except Exception as e:
+                logger.error("Scheduled reply for '%s' failed: %s", scheduled.course, e)
+            finally:
+                async with self._condition:
+                    self.in_flight[scheduled.user_id] -= 1
+                    if not self.in_flight[scheduled.user_id]:
+                        del self.in_flight[scheduled.user_id]
+                    self.running -= 1
+                    self._condition.notify_all()
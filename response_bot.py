@@ -6,21 +6,41 @@ Discord bot that responds to incoming messages.
 
 import os
 import re
+import time
 import asyncio
+import argparse
 from datetime import datetime
-from pathlib import Path
-import yaml
 from dotenv import load_dotenv
 import logging
 
 import discord
 
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from discord_manager import DiscordManager
+from discord_manager import (
+    DiscordManager,
+    AutoShardedDiscordManager,
+    parse_shard_ids,
+    shard_ids_for_process,
+)
+from bot_config import load_config, get_servers
+from reply_scheduler import ReplyScheduler, QueueFull
+from progressive_reply import ProgressiveReply
+from answer_cache import AnswerCache, course_fingerprint
+from course_index import get_course_indexes
+from conversation_store import ConversationStore
+from openai_resilience import ResilientCaller, CircuitOpen
+from message_coalescer import MessageCoalescer
+from message_ledger import MessageLedger
+from bot_metrics import Registry, http_status_trace, start_server
+from log_setup import setup_logging, log_context
+from profiling import LiveProfiler, profile_run
+from models.base import db
 from models.message import Message
 from models.user import User
+from models.message_trace import MessageTrace
+from models.usage_rollup import UsageRollup
 
 load_dotenv()  # load environment variables from .env file
 
@@ -29,64 +49,399 @@ program_file = os.path.basename(__file__)  # the name of this python script
 program_file_base = os.path.splitext(program_file)[0]  # remove extension
 logs_dir = os.getenv("LOGS_DIR", "./logs")
 logs_level = os.getenv("LOG_LEVEL", "INFO").upper()
-# Ensure logs directory exists
-logs_path = Path(logs_dir).expanduser()
-logs_path.mkdir(parents=True, exist_ok=True)
-logs_dir = str(logs_path)
-# logging.basicConfig(level=logging.INFO)  # set up logging
-logging.basicConfig(
-    filename=f"{logs_dir}/{program_file_base}.log",
-    encoding="utf-8",
+# log through a background thread to a rotating file, so logging never blocks the event loop
+setup_logging(
+    program_file_base,
+    logs_dir=logs_dir,
     level=logs_level,
-    format="%(asctime)s %(levelname)s:%(message)s",
+    log_format=os.getenv("LOG_FORMAT", "json"),  # 'json' or 'text'
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "10")),
+    rotate_when=os.getenv("LOG_ROTATE_WHEN"),  # e.g. 'midnight', instead of by size
 )
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # from .env file
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # from .env file
-CONFIG_FILE = Path("bot_config.yml").resolve()  # path to the configuration file
 OPENAI_DEFAULT_MODEL = "gpt-4o"  # can be overriden in config file
 OPENAI_DEFAULT_MAX_REQUEST_PER_DAY = 10  # can be overriden in config file
+OPENAI_DEFAULT_MAX_CONCURRENT_REQUESTS = 4  # can be overriden in config file
+OPENAI_DEFAULT_MAX_QUEUE_SIZE = 50  # can be overriden in config file
+OPENAI_DEFAULT_MAX_IN_FLIGHT_PER_USER = 1  # can be overriden in config file
+ANSWER_CACHE_DEFAULT_TTL_HOURS = 24 * 7  # can be overriden in config file
+ANSWER_CACHE_DEFAULT_MAX_ENTRIES = 500  # can be overriden in config file
+LOCAL_MATERIALS_DEFAULT_TOP_K = 4  # can be overriden in config file
+LOCAL_MATERIALS_DEFAULT_MIN_SCORE = 2.0  # can be overriden in config file
+CONVERSATION_DEFAULT_MAX_TURNS = 20  # can be overriden in config file
+CONVERSATION_DEFAULT_MAX_TOKENS = 16000  # can be overriden in config file
+OPENAI_DEFAULT_TIMEOUT_SECONDS = 45  # can be overriden in config file
+OPENAI_DEFAULT_FAILURE_THRESHOLD = 5  # can be overriden in config file
+OPENAI_DEFAULT_RESET_SECONDS = 60  # can be overriden in config file
+COALESCING_DEFAULT_WINDOW_SECONDS = 2  # can be overriden in config file
+COALESCING_DEFAULT_MAX_WAIT_SECONDS = 6  # can be overriden in config file
+GATEWAY_DEFAULT_LEAN = True  # can be overriden in config file
+PROCESSED_MESSAGES_DEFAULT_TTL_HOURS = 72  # can be overriden in config file
+PROCESSED_MESSAGES_DEFAULT_MAX_ENTRIES = 10000  # can be overriden in config file
+PROCESSED_MESSAGES_DEFAULT_CLAIM_TIMEOUT = 600  # can be overriden in config file
+PROCESSED_MESSAGES_DEFAULT_MAX_ATTEMPTS = 3  # can be overriden in config file
+PROCESSED_MESSAGES_RECOVERY_SECONDS = 60  # how often to look for unfinished messages
+METRICS_DEFAULT_HOST = "127.0.0.1"  # can be overriden in config file
+METRICS_DEFAULT_PORT = 9108  # can be overriden in config file
+PROFILING_DEFAULT_DIR = "./profiles"  # can be overriden in config file
+PROFILING_DEFAULT_SAMPLE_SECONDS = 30  # can be overriden in config file
+SHARD_COUNT = os.getenv(
+    "SHARD_COUNT"
+)  # total shards across all bot processes, or 'auto'
+SHARD_IDS = os.getenv("SHARD_IDS")  # shards for this process, e.g. '0-3'
+SHARD_PROCESS_INDEX = int(os.getenv("SHARD_PROCESS_INDEX", "0"))  # this process, from 0
+SHARD_PROCESS_COUNT = int(
+    os.getenv("SHARD_PROCESS_COUNT", "1")
+)  # processes sharing shards
 
-# create OpenAI client
-openai_client = OpenAI()
-openai_conversations = {}  # will hold separate threads keyed by username
+# create OpenAI client... async, so replies in flight don't block the event loop
+openai_client = AsyncOpenAI()
+# each user's conversation in each course, kept in the database and compacted as it grows
+conversation_store = ConversationStore(openai_client)
 openai_num_requests = {}  # will track # requests from each user per day
+# the timings of each handled message and the daily usage totals, in tables the database may not have yet
+MessageTrace.create_table(safe=True)
+UsageRollup.create_table(safe=True)
+
+# load the config data from file... it may describe one server or several
+config = load_config()
+servers = get_servers(config)
+courses_by_guild = {}  # each server's courses, keyed by guild id once connected
+# each server's course category names and course role ids, keyed by guild id once connected
+raw_routes = {}
+
+# share model capacity fairly between courses and users
+scheduling_config = config.get("scheduling", {})
+scheduler = ReplyScheduler(
+    max_concurrent=scheduling_config.get(
+        "max_concurrent_requests", OPENAI_DEFAULT_MAX_CONCURRENT_REQUESTS
+    ),
+    max_queue_size=scheduling_config.get(
+        "max_queue_size", OPENAI_DEFAULT_MAX_QUEUE_SIZE
+    ),
+    max_in_flight_per_user=scheduling_config.get(
+        "max_in_flight_per_user", OPENAI_DEFAULT_MAX_IN_FLIGHT_PER_USER
+    ),
+    weights={
+        course["title"]: course.get("scheduling", {}).get("weight", 1)
+        for server in servers
+        for course in server["courses"]
+    },
+)
+
+# merge messages a user sends in quick succession into a single request
+coalescing_config = config.get("coalescing", {})
+coalescer = MessageCoalescer(
+    window_seconds=coalescing_config.get(
+        "window_seconds", COALESCING_DEFAULT_WINDOW_SECONDS
+    ),
+    max_wait_seconds=coalescing_config.get(
+        "max_wait_seconds", COALESCING_DEFAULT_MAX_WAIT_SECONDS
+    ),
+)
+
+# remember which messages were handled, so each is answered once across resumes and restarts
+processed_messages_config = config.get("processed_messages", {})
+ledger = MessageLedger(
+    ttl_seconds=processed_messages_config.get(
+        "ttl_hours", PROCESSED_MESSAGES_DEFAULT_TTL_HOURS
+    )
+    * 3600,
+    max_entries=processed_messages_config.get(
+        "max_entries", PROCESSED_MESSAGES_DEFAULT_MAX_ENTRIES
+    ),
+    claim_timeout_seconds=processed_messages_config.get(
+        "claim_timeout_seconds", PROCESSED_MESSAGES_DEFAULT_CLAIM_TIMEOUT
+    ),
+    max_attempts=processed_messages_config.get(
+        "max_attempts", PROCESSED_MESSAGES_DEFAULT_MAX_ATTEMPTS
+    ),
+)
+# handles messages again whose handling never finished, once started
+recovery_task = None
+
+# get an OpenAI Responses Prompt for each course
+# for course in courses:
+#     # get existing OpenAI responses prompt... this must have been set up in OpenAI dev portal
+#     oa_config = course.get("openai_assistant", {})
+#     # retrieve or create the response object
+#     oa_config["instance"] = openai_client.responses.create(
+#         model=oa_config.get("model", OPENAI_DEFAULT_MODEL),
+#         prompt={
+#             "id": oa_config.get("prompt_id", None),  # get prompt ID from config
+#         },
+#         input=[],
+#         tools=[
+#             {
+#                 "type": "file_search",
+#                 "vector_store_ids": [oa_config.get("vector_store_id", None)],
+#             }
+#         ],
+#         max_output_tokens=2048,
+#         store=True,
+#     )
+#     logger.info(
+#         f"Loaded OpenAI Prompt ID {oa_config['instance'].id} for course '{course['title']}'"
+#     )
+#     logger.debug(oa_config)
+
+
+# index each course's local materials, if any, re-indexing only files that changed
+course_indexes = get_course_indexes(servers)
+for title, (index, settings) in course_indexes.items():
+    num_indexed, num_removed = index.update()
+    logger.info(
+        "Local materials for '%s': %s files indexed, %s removed.",
+        title,
+        num_indexed,
+        num_removed,
+    )
+
+
+# reuse answers to repeated questions in each course that enables it... its answers are shared by its students
+answer_caches = {}
+for server in servers:
+    for course in server["courses"]:
+        oa_config = course.get("openai_assistant", {})
+        cache_config = oa_config.get("answer_cache", {})
+        if cache_config.get("enabled", False):
+            answer_caches[course["title"]] = AnswerCache(
+                course["title"],
+                # answers from local materials go stale when the materials change
+                course_fingerprint(
+                    oa_config,
+                    (
+                        course_indexes[course["title"]][0].fingerprint()
+                        if course["title"] in course_indexes
+                        else None
+                    ),
+                ),
+                ttl_seconds=cache_config.get(
+                    "ttl_hours", ANSWER_CACHE_DEFAULT_TTL_HOURS
+                )
+                * 3600,
+                max_entries=cache_config.get(
+                    "max_entries", ANSWER_CACHE_DEFAULT_MAX_ENTRIES
+                ),
+            )
+
+# bound each course's OpenAI calls with a deadline, circuit breakers, and optional hedging
+openai_breakers = {}  # model -> circuit breaker, shared by all courses using the model
+resilient_callers = {}
+for server in servers:
+    for course in server["courses"]:
+        resilience_config = course.get("openai_assistant", {}).get("resilience", {})
+        resilient_callers[course["title"]] = ResilientCaller(
+            timeout=resilience_config.get(
+                "timeout_seconds", OPENAI_DEFAULT_TIMEOUT_SECONDS
+            ),
+            hedge_after=resilience_config.get("hedge_after_seconds"),
+            fallback_model=resilience_config.get("fallback_model"),
+            breakers=openai_breakers,
+            failure_threshold=resilience_config.get(
+                "failure_threshold", OPENAI_DEFAULT_FAILURE_THRESHOLD
+            ),
+            reset_seconds=resilience_config.get(
+                "reset_seconds", OPENAI_DEFAULT_RESET_SECONDS
+            ),
+        )
+
+
+def accept_raw_message(data):
+    """
+    Decide from a message's raw gateway data whether it could be for the bot.
+    Messages that can't be are dropped before discord.py does any work on them.
+
+    Args:
+        data (dict): The raw data of a MESSAGE_CREATE gateway event.
+    Returns:
+        bool: Whether to process the message.
+    """
+    routes = raw_routes.get(int(data.get("guild_id") or 0))
+    if not routes or client.user is None:
+        return False  # not from one of our servers
+    author_id, channel_id = int(data["author"]["id"]), int(data["channel_id"])
+    if (author_id, channel_id) in coalescer.pending:
+        return True  # a follow-up to a message in its coalescing window
+    if author_id == client.user.id:
+        return False  # the bot's own message
+    if not any(int(user["id"]) == client.user.id for user in data.get("mentions", [])):
+        return False  # not directed at the bot
+    # in a course category, or from a member with a course role
+    category_names, role_ids = routes
+    channel = client.get_channel(channel_id)
+    category = getattr(channel, "category", None)
+    if channel is None or (category and category.name in category_names):
+        return True
+    member_roles = data.get("member", {}).get("roles", [])
+    return any(int(role_id) in role_ids for role_id in member_roles)
+
+
+# courses whose students get their conversation ahead of their first question
+# courses with an answer cache answer without conversations, so have none to pre-warm
+prewarm_courses = {
+    course["title"]
+    for server in servers
+    for course in server["courses"]
+    if course.get("openai_assistant", {}).get("conversation", {}).get("prewarm")
+    and course["title"] not in answer_caches
+}
+# each server's course student role ids -> course title, once connected
+prewarm_roles = {}
+prewarmed = set()  # (user id, course) whose conversations are known to exist
+background_tasks = set()  # keep references to background tasks until they're done
+
+
+def prewarm_on_member_update(data):
+    """
+    Create the conversations of a member with a course's student role in the background, from raw member update data.
+    Works in lean mode too, where members aren't cached and on_member_update is never called.
+
+    Args:
+        data (dict): The raw data of a GUILD_MEMBER_UPDATE gateway event.
+    """
+    roles = prewarm_roles.get(int(data["guild_id"]), {})
+    for role_id in data.get("roles", []):
+        course_name = roles.get(int(role_id))
+        if course_name and (int(data["user"]["id"]), course_name) not in prewarmed:
+            author = discord.User(state=client._connection, data=data["user"])
+            task = asyncio.create_task(prewarm_conversation(author, course_name))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+
+async def prewarm_conversation(author, course_name):
+    """
+    Make sure a user has a conversation in a course, so their first question skips creating it.
+
+    Args:
+        author (discord.User): The Discord user.
+        course_name (str): The title of the course.
+    """
+    if (author.id, course_name) in prewarmed:
+        return
+    log_context(user_id=author.id, course=course_name)
+    prewarmed.add((author.id, course_name))
+    try:
+        conversation = await conversation_store.get(author, course_name)
+        logger.info(
+            "Pre-warmed OpenAI Conversation ID %s for @%s (%s) in '%s'",
+            conversation.openai_conversation_id,
+            author.name,
+            author.id,
+            course_name,
+        )
+    except Exception as e:
+        prewarmed.discard((author.id, course_name))  # try again on the next update
+        logger.error("Failed to pre-warm OpenAI Conversation: %s", e)
+
+
+# measure where reply latency goes... served in Prometheus format at /metrics, if enabled
+metrics_config = config.get("metrics", {})
+metrics = Registry()
+metrics_runner = None  # the metrics server, once started
+messages_total = metrics.counter(
+    "bot_messages_total",
+    "Messages mentioning the bot, by what became of them.",
+    ("course", "outcome"),
+)
+stage_seconds = metrics.histogram(
+    "bot_stage_duration_seconds",
+    "Time spent in each stage of handling a message.",
+    ("stage", "course"),
+)
+answer_cache_requests = metrics.counter(
+    "bot_answer_cache_requests_total",
+    "Answer cache lookups, by whether they were hits or misses.",
+    ("course", "result"),
+)
+openai_errors = metrics.counter(
+    "bot_openai_errors_total",
+    "Failed OpenAI calls, by error class.",
+    ("course", "error"),
+)
+discord_rate_limits = metrics.counter(
+    "bot_discord_rate_limited_total",
+    "Discord HTTP responses with status 429, by rate limit scope.",
+    ("scope",),
+)
+metrics.gauge(
+    "bot_queue_depth",
+    "Replies waiting in the scheduler's queue.",
+    function=lambda: len(scheduler.queue),
+)
+metrics.gauge(
+    "bot_in_flight_requests",
+    "Replies being worked on.",
+    function=lambda: scheduler.running,
+)
+metrics.counter(
+    "bot_gateway_messages_accepted_total",
+    "Messages let through by the raw message filter.",
+    function=lambda: client.messages_accepted,
+)
+metrics.counter(
+    "bot_gateway_messages_dropped_total",
+    "Messages dropped by the raw message filter.",
+    function=lambda: client.messages_dropped,
+)
 
-# load the config data from file
-with open(CONFIG_FILE, encoding="utf-8", mode="r") as f:
-    config = yaml.safe_load(f)
-    # get server name
-    SERVER_NAME = config["server"]["name"]
-    courses = config["server"]["courses"]
-
-    # get an OpenAI Responses Prompt for each course
-    # for course in courses:
-    #     # get existing OpenAI responses prompt... this must have been set up in OpenAI dev portal
-    #     oa_config = course.get("openai_assistant", {})
-    #     # retrieve or create the response object
-    #     oa_config["instance"] = openai_client.responses.create(
-    #         model=oa_config.get("model", OPENAI_DEFAULT_MODEL),
-    #         prompt={
-    #             "id": oa_config.get("prompt_id", None),  # get prompt ID from config
-    #         },
-    #         input=[],
-    #         tools=[
-    #             {
-    #                 "type": "file_search",
-    #                 "vector_store_ids": [oa_config.get("vector_store_id", None)],
-    #             }
-    #         ],
-    #         max_output_tokens=2048,
-    #         store=True,
-    #     )
-    #     logger.info(
-    #         f"Loaded OpenAI Prompt ID {oa_config['instance'].id} for course '{course['title']}'"
-    #     )
-    #     logger.debug(oa_config)
-
-
-# start up bot set to create a category, if not yet exists
-client = DiscordManager(guild_id=config["server"]["name"], event_loop=True)
+# sample where CPU time and memory go on demand, without restarting... by signal, or at /profile next to /metrics
+profiling_config = config.get("profiling", {})
+profiler = LiveProfiler(
+    profiles_dir=profiling_config.get("dir", PROFILING_DEFAULT_DIR),
+    sample_seconds=profiling_config.get(
+        "sample_seconds", PROFILING_DEFAULT_SAMPLE_SECONDS
+    ),
+)
+
+# start up one bot for all servers, rather than one gateway connection per server
+# lean mode skips the intents and caches a bot that only answers messages doesn't need
+gateway_config = config.get("gateway", {})
+lean = gateway_config.get("lean", GATEWAY_DEFAULT_LEAN)
+if (SHARD_IDS or SHARD_PROCESS_COUNT > 1) and not (SHARD_COUNT or "").isdigit():
+    # otherwise every process would connect to every shard, and answer every message
+    raise RuntimeError(
+        f"SHARD_COUNT must be the total number of shards when SHARD_IDS or SHARD_PROCESS_COUNT is set, not '{SHARD_COUNT}'."
+    )
+if SHARD_COUNT:
+    # split the gateway connection into shards, and pick this process's share of them
+    shard_count = None if SHARD_COUNT == "auto" else int(SHARD_COUNT)
+    shard_ids = None
+    if SHARD_IDS:
+        shard_ids = parse_shard_ids(SHARD_IDS)
+    elif shard_count and SHARD_PROCESS_COUNT > 1:
+        shard_ids = shard_ids_for_process(
+            SHARD_PROCESS_INDEX, SHARD_PROCESS_COUNT, shard_count
+        )
+    client = AutoShardedDiscordManager(
+        guild_ids=[server["name"] for server in servers],
+        event_loop=True,
+        shard_count=shard_count,
+        shard_ids=shard_ids,
+        lean=lean,
+        member_events=bool(prewarm_courses),
+        message_filter=accept_raw_message,
+        http_trace=http_status_trace(discord_rate_limits),
+        rate_limit_priority="interactive",  # provisioning scripts make way for replies
+    )
+    logger.info("Connecting to shards %s of %s", shard_ids or "all", SHARD_COUNT)
+else:
+    client = DiscordManager(
+        guild_ids=[server["name"] for server in servers],
+        event_loop=True,
+        lean=lean,
+        member_events=bool(prewarm_courses),
+        message_filter=accept_raw_message,
+        http_trace=http_status_trace(discord_rate_limits),
+        rate_limit_priority="interactive",  # provisioning scripts make way for replies
+    )
+
+if prewarm_courses:
+    client.add_raw_hook("GUILD_MEMBER_UPDATE", prewarm_on_member_update)
 
 
 # set up bot actions... this will override its default on_ready() routine.
@@ -95,7 +450,73 @@ async def on_ready():
     """
     Bot is connected to Discord and ready to use.
     """
-    logger.info(f"Logged into Discord as: @{client.user.name} (ID: {client.user.id})")
+    logger.info(
+        "Logged into Discord as: @%s (ID: %s)", client.user.name, client.user.id
+    )
+
+    # serve metrics, once... on_ready is called again after reconnects
+    global metrics_runner
+    if metrics_config.get("enabled", False) and metrics_runner is None:
+        metrics_runner = await start_server(
+            metrics,
+            host=metrics_config.get("host", METRICS_DEFAULT_HOST),
+            port=metrics_config.get("port", METRICS_DEFAULT_PORT),
+            handlers=(
+                {"/profile": profiler.handle_request}
+                if profiling_config.get("endpoint", False)
+                else None
+            ),
+        )
+    if profiling_config.get("signal", True) and profiler.install_signal_handler():
+        logger.info("Send SIGUSR1 to process %s to sample a profile", os.getpid())
+
+    # route messages to the courses of the server they were posted in
+    for server in servers:
+        guild_id = client.get_server_id(server["name"])
+        if guild_id:
+            courses_by_guild[guild_id] = server["courses"]
+            # what the raw message filter needs to recognize messages for these courses
+            role_names = {
+                role_name
+                for course in server["courses"]
+                for role_name in course.get("roles", {}).values()
+            }
+            raw_routes[guild_id] = (
+                {
+                    category_name
+                    for course in server["courses"]
+                    for category_name in course.get("categories", [])
+                },
+                {
+                    role.id
+                    for role in client.get_guild(guild_id).roles
+                    if role.name in role_names
+                },
+            )
+            # students of these courses whose conversations are created ahead of time
+            student_roles = {
+                course.get("roles", {}).get("students"): course["title"]
+                for course in server["courses"]
+                if course["title"] in prewarm_courses
+            }
+            prewarm_roles[guild_id] = {
+                role.id: student_roles[role.name]
+                for role in client.get_guild(guild_id).roles
+                if role.name in student_roles
+            }
+            logger.info(
+                "Serving %s courses in '%s'", len(server["courses"]), server["name"]
+            )
+        elif SHARD_COUNT:
+            # the server may simply be served by another process's shards
+            logger.info("Server '%s' is not on this process's shards.", server["name"])
+        else:
+            logger.warning("Server '%s' not found.", server["name"])
+
+    # handle messages again whose handling never finished, e.g. because the bot restarted with them queued
+    global recovery_task
+    if recovery_task is None:
+        recovery_task = asyncio.create_task(recover_unfinished_messages())
 
 
 @client.event
@@ -103,6 +524,12 @@ async def on_message(message):
     """
     Incoming message handler.
     """
+    # a follow-up to a message still in its coalescing window joins it, even without a mention
+    if coalescer.is_pending(message):
+        if ledger.claim(message.id, channel_id=message.channel.id):
+            await coalescer.add(message)
+        return
+
     # ensure the message is something we need to respond to
     if not message.mentions or client.user not in message.mentions:
         # Ignore messages that did not directly mention or reply to this bot
@@ -110,6 +537,11 @@ async def on_message(message):
     elif message.author == client.user:
         # Ignore messages from the bot itself
         return
+    # tag everything logged while handling this message with its ids
+    log_context(message_id=message.id, user_id=message.author.id, course=None)
+
+    # record when each stage of handling the message happens
+    trace = MessageTrace(discord_message_id=message.id, received_at=datetime.now())
 
     # Attempt to determine the category name of the channel where the message was posted, if any
     category_name = None
@@ -118,6 +550,9 @@ async def on_message(message):
         message.channel.category.name if hasattr(message.channel, "category") else None
     )
 
+    # only consider the courses of the server this message was posted in
+    courses = courses_by_guild.get(message.guild.id if message.guild else None, [])
+
     # determine which course this message is related to, based on the category_name
     course_name = None
     admins_role = None
@@ -149,10 +584,23 @@ async def on_message(message):
                 admins_role = course.get("roles", {}).get("admins")
                 break
 
+    trace.course, trace.routed_at = course_name, datetime.now()
+    log_context(course=course_name)
+    stage_seconds.observe(
+        seconds_between(trace.received_at, trace.routed_at),
+        stage="routing",
+        course=course_name or "",
+    )
+
     # ignore messages that do not fall into any course
     if not course_name:
+        messages_total.inc(course="", outcome="unrouted")
         logger.info(
-            f"Message from @{message.author.name} ({message.author.id}) in '{category_name}'#{channel_name} does not match any course."
+            "Message from @%s (%s) in '%s'#%s does not match any course.",
+            message.author.name,
+            message.author.id,
+            category_name,
+            channel_name,
         )
         return
 
@@ -163,172 +611,623 @@ async def on_message(message):
             oa_config = course.get("openai_assistant", {})
             oa_prompt_id = oa_config.get("prompt_id", None)
             logger.info(
-                f"Using OpenAI Prompt ID: {oa_prompt_id} for course '{course_name}'"
+                "Using OpenAI Prompt ID: %s for course '%s'", oa_prompt_id, course_name
             )
     if not oa_prompt_id:
         logger.warning(
-            f"No OpenAI Prompt configured for '{course_name}' course in '{category_name}'#{channel_name}."
+            "No OpenAI Prompt configured for '%s' course in '%s'#%s.",
+            course_name,
+            category_name,
+            channel_name,
+        )
+        return
+
+    # handle each message only once, even if Discord delivers it again after a resume or restart
+    if not ledger.claim(message.id, course_name, message.channel.id):
+        messages_total.inc(course=course_name, outcome="duplicate")
+        logger.info(
+            "Ignoring message %s from @%s (%s), which was already handled.",
+            message.id,
+            message.author.name,
+            message.author.id,
         )
         return
 
+    # wait briefly for follow-up messages, and answer them all together
+    batch = await coalescer.add(message)
+    if batch is None:
+        messages_total.inc(course=course_name, outcome="coalesced")
+        return  # merged into an earlier message's request
+    content = batch.content
+    message_ids = [batch_message.id for batch_message in batch.messages]
+    if len(batch.messages) > 1:
+        logger.info(
+            "Coalesced %s messages from @%s (%s) into one request.",
+            len(batch.messages),
+            message.author.name,
+            message.author.id,
+        )
+
     # check the user's stats to ensure they have not exceeded the limit of requests
-    user_stats = openai_num_requests.get(
+    rate_limit_started_at = time.perf_counter()
+    today = datetime.now().strftime("%Y-%m-%d")
+    user_stats = openai_num_requests.setdefault(
         message.author,
         {
             "num_requests": 0,
             "last_response_date": None,
         },
     )
+    if user_stats["last_response_date"] != today:
+        # a new day... the user's requests are counted afresh
+        user_stats["num_requests"] = 0
+        user_stats["last_response_date"] = today
     # if the user has made more than 10 requests today, ignore the message
     # get the request limit for this course from config
     request_limit = oa_config.get("limits", {}).get(
         "max_requests_per_day", OPENAI_DEFAULT_MAX_REQUEST_PER_DAY
     )
     logger.info(
-        f"User @{message.author.name} ({message.author.id}) has made {user_stats['num_requests']} requests today (limit: {request_limit})."
+        "User @%s (%s) has made %s requests today (limit: %s).",
+        message.author.name,
+        message.author.id,
+        user_stats["num_requests"],
+        request_limit,
     )
     rate_limit_message = ""
     if user_stats["num_requests"] == request_limit:
         rate_limit_message = f"You have reached the maximum number of responses for today. See {course_name} admins for help."
+    stage_seconds.observe(
+        time.perf_counter() - rate_limit_started_at,
+        stage="rate_limit",
+        course=course_name,
+    )
     if user_stats["num_requests"] > request_limit:
+        ledger.finish(message_ids)  # not to be answered, then or later
+        messages_total.inc(course=course_name, outcome="over_limit")
         logger.info(
-            f"User @{message.author.name} ({message.author.id}) has exceeded the daily request limit ({request_limit})."
+            "User @%s (%s) has exceeded the daily request limit (%s).",
+            message.author.name,
+            message.author.id,
+            request_limit,
         )
         return
+    # count the request now, not once it's answered, so messages queued or in flight at once can't all get past the limit
+    user_stats["num_requests"] += 1
+    logger.info(
+        "%s (%s) has made %s requests.",
+        message.author.name,
+        message.author.id,
+        user_stats["num_requests"],
+    )
+
+    # answer questions the course was already asked from its cache, at no model cost... but one request of the user's limit
+    answer_cache = answer_caches.get(course_name)
+    cached_answer = (
+        answer_cache.get(content, message.author.id) if answer_cache else None
+    )
+    if answer_cache:
+        answer_cache_requests.inc(
+            course=course_name, result="hit" if cached_answer else "miss"
+        )
+    if cached_answer:
+        messages_total.inc(course=course_name, outcome="cached")
+        logger.info(
+            "Answering @%s (%s) from the '%s' answer cache.",
+            message.author.name,
+            message.author.id,
+            course_name,
+        )
+        trace.message = log_message(
+            message.author, content, category_name, channel_name, "from", course_name
+        )
+        if rate_limit_message:
+            cached_answer = f"{rate_limit_message} {cached_answer}"
+        with stage_seconds.time(stage="discord_send", course=course_name):
+            await message.channel.send(cached_answer)
+        ledger.finish(message_ids)
+        trace.sent_at = datetime.now()
+        trace.reply = log_message(
+            message.author,
+            cached_answer,
+            category_name,
+            channel_name,
+            "to",
+            course_name,
+        )
+        save_trace(trace, "cached")
+        return
 
     # the message is directed to the bot
     logger.info(
-        f"Message about '{course_name}' course in '{category_name}'#{channel_name} from @{message.author.name} ({message.author.id})"
+        "Message about '%s' course in '%s'#%s from @%s (%s)",
+        course_name,
+        category_name,
+        channel_name,
+        message.author.name,
+        message.author.id,
     )
 
-    # log incoming message into database
+    # the course's admins go ahead of everyone else in the queue
+    user_roles = [role.name for role in getattr(message.author, "roles", [])]
+    is_admin = bool(admins_role and admins_role in user_roles)
+
+    # queue the reply... the scheduler decides when it gets its share of model capacity
+    trace.queued_at = datetime.now()
     try:
-        # get the user with this message.author.id from the User model
-        user, created = User.get_or_create(
-            discord_id=message.author.id,
-            discord_username=message.author.name,
+        position = await scheduler.submit(
+            lambda: respond(
+                message,
+                content,
+                message_ids,
+                course_name,
+                category_name,
+                channel_name,
+                oa_config,
+                user_stats,
+                today,
+                rate_limit_message,
+                trace,
+            ),
+            course=course_name,
+            user_id=message.author.id,
+            priority=is_admin,
         )
-        # store this message in database
-        message_record = Message.create(
-            content=message.content,
-            category=category_name,
-            channel=channel_name,
-            direction="from",
-            user=user,
+    except QueueFull as e:
+        refund_request(user_stats, today)
+        messages_total.inc(course=course_name, outcome="turned_away")
+        logger.warning(
+            "Turning away message from @%s (%s): %s",
+            message.author.name,
+            message.author.id,
+            e,
         )
-    except Exception as e:
-        logger.error(f"Failed to log message: {e}")
-
-    # Create a new Conversation for the user if it doesn't exist
-    if openai_conversations.get(message.author) is None:
-        # create new conversation
-        openai_conversations[message.author] = openai_client.conversations.create(
-            items=[
-                {
-                    "role": "user",
-                    "content": f"My name is {message.author.name} (user id <@{message.author.id}>) and I am a student in the {course_name} course.",
-                }
-            ],
-            metadata={"user_id": f"<@{message.author.id}>"},
+        await message.channel.send(
+            "Sorry, I'm too busy to answer right now. Please try again in a few minutes."
         )
-        logger.debug(
-            f"Creating new OpenAI Conversation ID {openai_conversations.get(message.author).id} for user @{message.author.name} ({message.author.id})"
+        ledger.finish(message_ids)
+        return
+    messages_total.inc(course=course_name, outcome="queued")
+    if position:
+        logger.info(
+            "Queued message from @%s (%s) at position %s.",
+            message.author.name,
+            message.author.id,
+            position,
         )
-    else:
-        # found existing conversation
-        logger.debug(
-            f"Reusing existing OpenAI Conversation ID {openai_conversations.get(message.author).id} for user @{message.author.name} ({message.author.id})"
+        await message.channel.send(
+            f"I'm busy right now... your question is queued at position {position}."
         )
-    # stablish the id of the conversation
-    openai_conversation_id = openai_conversations.get(message.author).id
-    logger.info(
-        f"Using OpenAI Conversation ID: {openai_conversation_id} for user @{message.author.name} ({message.author.id})"
+
+
+async def recover_unfinished_messages():
+    """
+    Now and then, handle again the messages whose handling never finished within the ledger's claim timeout,
+    e.g. because the bot was restarted while they were queued or being answered.
+    """
+    while True:
+        try:
+            for claim in ledger.unfinished():
+                channel = client.get_channel(claim.channel_id)
+                if channel is None:
+                    continue  # e.g. in a server on another process's shards
+                try:
+                    message = await channel.fetch_message(claim.discord_message_id)
+                except (discord.NotFound, discord.Forbidden):
+                    # deleted, or out of the bot's reach... nothing to answer
+                    ledger.finish([claim.discord_message_id])
+                    continue
+                log_context(
+                    message_id=claim.discord_message_id, user_id=None, course=None
+                )
+                logger.info(
+                    "Handling message %s again, since handling it never finished.",
+                    claim.discord_message_id,
+                )
+                await on_message(message)
+                if not ledger.is_claimed(message.id):
+                    # not claimed again, e.g. a follow-up without a mention... nothing more to do with it
+                    ledger.finish([message.id])
+        except Exception as e:
+            logger.error("Failed to recover unfinished messages: %s", e)
+        await asyncio.sleep(PROCESSED_MESSAGES_RECOVERY_SECONDS)
+
+
+def log_message(
+    author, content, category_name, channel_name, direction, course_name=None
+):
+    """
+    Log a message to or from a Discord user into the database.
+
+    Args:
+        author (discord.User): The Discord user the message was to or from.
+        content (str): The content of the message.
+        category_name (str): The name of the category the message was posted in.
+        channel_name (str): The name of the channel the message was posted in.
+        direction (str): 'from' if the user sent the message, 'to' if the bot sent it to them.
+        course_name (str): The title of the course the message is about, if known.
+    Returns:
+        Message or None: The logged message, or None if it could not be logged.
+    """
+    try:
+        with stage_seconds.time(stage="db_log", course=course_name or ""):
+            # get the user with this author.id from the User model
+            user, created = User.get_or_create(
+                discord_id=author.id,
+                discord_username=author.name,
+            )
+            # store this message in database, and add it to the day's usage totals
+            with db.atomic():
+                logged_message = Message.create(
+                    content=content,
+                    category=category_name,
+                    channel=channel_name,
+                    direction=direction,
+                    user=user,
+                )
+                UsageRollup.record(logged_message, course_name)
+            return logged_message
+    except Exception as e:
+        logger.error("Failed to log message: %s", e)
+        return None
+
+
+def seconds_between(start, end):
+    """
+    Get the number of seconds between two datetimes.
+    """
+    return (end - start).total_seconds()
+
+
+def save_trace(trace, outcome):
+    """
+    Save the trace of a handled message into the database.
+
+    Args:
+        trace (MessageTrace): The trace.
+        outcome (str): What became of the message: 'answered', 'cached', or 'error'.
+    """
+    trace.outcome = outcome
+    try:
+        trace.save()
+    except Exception as e:
+        logger.error("Failed to save message trace: %s", e)
+
+
+def refund_request(user_stats, day):
+    """
+    Give back a request counted against a user's daily limit, e.g. because it wasn't answered.
+
+    Args:
+        user_stats (dict): The user's stats, from openai_num_requests.
+        day (str): The day the request was counted on, e.g. '2025-03-01'.
+    """
+    if user_stats["last_response_date"] == day and user_stats["num_requests"] > 0:
+        user_stats["num_requests"] -= 1
+
+
+def find_local_passages(course_name, question):
+    """
+    Find the passages of a course's local materials that are good enough to answer a question from.
+
+    Args:
+        course_name (str): The title of the course.
+        question (str): The question.
+    Returns:
+        list: (score, path, passage text) tuples, best match first. Empty if the course has no local materials.
+    """
+    if course_name not in course_indexes:
+        return []
+    index, settings = course_indexes[course_name]
+    try:
+        passages = index.search(
+            question, settings.get("top_k", LOCAL_MATERIALS_DEFAULT_TOP_K)
+        )
+    except Exception as e:
+        logger.error("Failed to search local materials for '%s': %s", course_name, e)
+        return []
+    min_score = settings.get("min_score", LOCAL_MATERIALS_DEFAULT_MIN_SCORE)
+    return [passage for passage in passages if passage[0] >= min_score]
+
+
+def clean_response(text):
+    """
+    Clean up response text by removing any 【source】 references, including one still being streamed.
+    """
+    text = re.sub(r"【.*?】", "", text)
+    return re.sub(r"【[^】]*$", "", text)
+
+
+async def stream_response(client, request, show, trace=None):
+    """
+    Stream a response from the OpenAI API, showing the text as it arrives.
+
+    Args:
+        client (openai.AsyncOpenAI): The OpenAI client to make the request with.
+        request (dict): The arguments for the OpenAI responses API.
+        show (callable): A coroutine function to show each piece of text with, e.g. ProgressiveReply.append.
+        trace (MessageTrace): The trace to record the arrival of the first text in, if any.
+    Returns:
+        openai.types.responses.Response: The completed response.
+    """
+    stream = await client.responses.create(**request, stream=True)
+    async for event in stream:
+        if event.type == "response.output_text.delta":
+            if trace and not trace.first_byte_at:
+                trace.first_byte_at = datetime.now()
+            await show(event.delta)
+        elif event.type == "response.completed":
+            return event.response
+        elif event.type in ("response.failed", "response.incomplete", "error"):
+            raise RuntimeError(f"OpenAI response stream ended with '{event.type}'.")
+    raise RuntimeError("OpenAI response stream ended without completing.")
+
+
+async def respond(
+    message,
+    content,
+    message_ids,
+    course_name,
+    category_name,
+    channel_name,
+    oa_config,
+    user_stats,
+    request_day,
+    rate_limit_message,
+    trace,
+):
+    """
+    Log an incoming message, get a response from OpenAI, and send it back to the channel.
+    Called by the reply scheduler when the message's turn comes.
+    The content may combine several messages coalesced into one request, whose ids are marked replied once it is answered.
+    In a course with an answer cache, the response is a course answer, made without the user's conversation,
+    so it can be cached for all the course's students.
+    The request was already counted against the user's daily limit on request_day, and is given back if it fails.
+    """
+    # scheduler workers run many replies... tag this one's logs with its own ids
+    log_context(message_id=message.id, user_id=message.author.id, course=course_name)
+    trace.started_at = datetime.now()
+    stage_seconds.observe(
+        seconds_between(trace.queued_at, trace.started_at),
+        stage="queue_wait",
+        course=course_name,
+    )
+
+    # log incoming message into database
+    trace.message = log_message(
+        message.author, content, category_name, channel_name, "from", course_name
     )
 
+    # answers shared by the course's students can't come from one student's conversation
+    answer_cache = answer_caches.get(course_name)
+    conversation = None
+    if not answer_cache:
+        # get the user's conversation in this course, creating it if it doesn't exist
+        try:
+            conversation = await conversation_store.get(message.author, course_name)
+        except Exception as e:
+            logger.error("Failed to get OpenAI Conversation: %s", e)
+            refund_request(user_stats, request_day)
+            await message.channel.send(
+                f"Sorry, I can't respond intelligently right now. Please see {course_name} admins for help."
+            )
+            ledger.finish(message_ids)
+            trace.sent_at, trace.error_class = datetime.now(), type(e).__name__
+            save_trace(trace, "error")
+            return
+        logger.info(
+            "Using OpenAI Conversation ID: %s (%s turns, %s tokens) for user @%s (%s)",
+            conversation.openai_conversation_id,
+            conversation.turns,
+            conversation.tokens,
+            message.author.name,
+            message.author.id,
+        )
+
     # add message to the thread
-    logger.info(
-        f"Prompt from @{message.author.name} ({message.author.id}): {message.content}"
+    # the full text is in the messages table... only log it when debugging
+    logger.debug(
+        "Prompt from @%s (%s): %s", message.author.name, message.author.id, content
     )
 
     # replace the bot's id with username in the message to help the model understand
-    message_content = re.sub(f"<@!?{client.user.id}>", "@Bloombot", message.content)
+    message_content = re.sub(f"<@!?{client.user.id}>", "@Bloombot", content)
+
+    # in streaming mode, post a placeholder right away and edit it as the response arrives
+    reply = None
+    if oa_config.get("streaming", False):
+        reply = ProgressiveReply(message.channel, clean=clean_response)
+        await reply.start()
+
+    # by default, the model searches the course's remote vector store...
+    input_items = [{"role": "user", "content": message_content}]
+    tools = [
+        {
+            "type": "file_search",
+            "vector_store_ids": [oa_config.get("vector_store_id", None)],
+        }
+    ]
+    # ...unless good enough passages are found in the local course materials
+    # they go in the instructions, which apply to this response only, rather than being stored in the conversation
+    instructions = None
+    passages = find_local_passages(course_name, message_content)
+    if passages:
+        excerpts = "\n\n".join(
+            f"[{path}] {content}" for score, path, content in passages
+        )
+        instructions = f"Relevant excerpts from the course materials:\n\n{excerpts}"
+        tools = []
+        logger.info(
+            "Attached %s local passages for '%s', skipping file_search.",
+            len(passages),
+            course_name,
+        )
+
+    # every request made in a stored conversation adds its turn to it, even one that is abandoned...
+    # so when the course may hedge or fall back, attempts are made outside the conversation, with its history,
+    # and only the answer that wins is added to it
+    resilient_caller = resilient_callers[course_name]
+    detached = bool(conversation and resilient_caller.may_retry)
 
     is_response = False  # assume the worst
     try:
         # try to get response from OpenAI API
-        openai_response = openai_client.responses.create(
+        request = dict(
             model=oa_config.get("model", OPENAI_DEFAULT_MODEL),
             prompt={
                 "id": oa_config.get("prompt_id", None),  # get prompt ID from config
             },
-            input=[{"role": "user", "content": message_content}],
-            conversation=openai_conversation_id,
-            tools=[
-                {
-                    "type": "file_search",
-                    "vector_store_ids": [oa_config.get("vector_store_id", None)],
-                }
-            ],
+            input=input_items,
+            instructions=instructions,
+            tools=tools,
             max_output_tokens=2048,
-            store=True,
         )
+        if detached:
+            history = await conversation_store.history(conversation)
+            request.update(input=history + input_items, store=False)
+        elif conversation:
+            request.update(conversation=conversation.openai_conversation_id, store=True)
+        else:
+            # a course answer... nothing about the user goes into it, and nothing is stored
+            request.update(store=False)
 
-        # extract the text from the response
+        # the caller's deadline bounds the request... the SDK's own retries and timeout would run on past it
+        reply_client = openai_client.with_options(
+            max_retries=0, timeout=resilient_caller.timeout
+        )
+        # the model whose text is shown as it streams in... the first to send any
+        streaming = []
+
+        async def attempt(model):
+            # make one attempt with the model the caller picked
+            if not reply:
+                return await reply_client.responses.create(
+                    **{**request, "model": model}
+                )
+
+            async def show(text):
+                # while attempts race, only one streams into the reply... the winner's text is shown at the end
+                if not streaming:
+                    streaming.append(model)
+                if streaming[0] == model:
+                    await reply.append(text)
+
+            return await stream_response(
+                reply_client, {**request, "model": model}, show, trace
+            )
+
+        trace.requested_at = datetime.now()
+        with stage_seconds.time(stage="openai", course=course_name):
+            openai_response = await resilient_caller.call(attempt, request["model"])
+        trace.completed_at = datetime.now()
+        trace.first_byte_at = trace.first_byte_at or trace.completed_at
+        trace.model = openai_response.model
+        if openai_response.usage:
+            trace.input_tokens = openai_response.usage.input_tokens
+            trace.output_tokens = openai_response.usage.output_tokens
+
+        # track the conversation's growth, then extract the text from the response
+        if conversation:
+            conversation_store.record_turn(conversation, openai_response.usage)
         openai_response = openai_response.output_text.strip()
         is_response = True  # flag it for later
 
+    except asyncio.TimeoutError:
+        trace.error_class = "TimeoutError"
+        openai_errors.inc(course=course_name, error="TimeoutError")
+        logger.error("OpenAI API did not respond in time for '%s'.", course_name)
+        openai_response = "Sorry, I'm taking too long to answer right now. Please try again in a few minutes."
+    except CircuitOpen as e:
+        trace.error_class = "CircuitOpen"
+        openai_errors.inc(course=course_name, error="CircuitOpen")
+        logger.error("OpenAI API unavailable for '%s': %s", course_name, e)
+        openai_response = "Sorry, I'm having trouble reaching my brain right now. Please try again in a few minutes."
     except Exception as e:
-        logger.error(f"Error from OpenAI API: {e}")
+        trace.error_class = type(e).__name__
+        openai_errors.inc(course=course_name, error=type(e).__name__)
+        logger.error("Error from OpenAI API: %s", e)
         openai_response = f"Sorry, I can't respond intelligently right now. Please see {course_name} admins for help."
 
     # get first output response
-    logger.info(
-        f"OpenAI response to @{message.author.name} (ID: {message.author.id}): {openai_response}"
+    logger.debug(
+        "OpenAI response to @%s (ID: %s): %s",
+        message.author.name,
+        message.author.id,
+        openai_response,
     )
 
     # clean up the response by removing any 【source】 references
-    openai_response = re.sub(r"【.*?】", "", openai_response)
+    openai_response = clean_response(openai_response)
+
+    # remember good course answers in case any student asks the same question again
+    if is_response and answer_cache:
+        answer_cache.put(content, openai_response, message.author.id)
+    answer = openai_response  # without any notice added for the user
 
     # if we have a rate limit message, prepend it to the response
     if rate_limit_message:
         openai_response = f"{rate_limit_message} {openai_response}"
-    logger.info(f"Response to @{message.author.id}: {openai_response}")
+    logger.debug("Response to @%s: %s", message.author.id, openai_response)
     # Send the last response back to the Discord channel
-    await message.channel.send(openai_response)
-
-    # log outgoing message into database
-    try:
-        # get the user with this message.author.id from the User model
-        user, created = User.get_or_create(
-            discord_id=message.author.id,
-            discord_username=message.author.name,
-        )
-        # store this message in database
-        message_record = Message.create(
-            content=openai_response,
-            category=category_name,
-            channel=channel_name,
-            direction="to",
-            user=user,
-        )
-    except Exception as e:
-        logger.error(f"Failed to log message: {e}")
+    with stage_seconds.time(stage="discord_send", course=course_name):
+        if reply:
+            await reply.finish(openai_response)
+        else:
+            await message.channel.send(openai_response)
+    ledger.finish(message_ids)
 
-    # update the user's stats to reflect this new request
-    today = datetime.now().strftime("%Y-%m-%d")
-    if user_stats["last_response_date"] != today:
-        user_stats["num_requests"] = 1
-    else:
-        user_stats["num_requests"] += 1
-    user_stats["last_response_date"] = today
-    openai_num_requests[message.author] = user_stats
+    trace.sent_at = datetime.now()
 
-    # log
-    logger.info(
-        f"{message.author.name} ({message.author.id}) has made {user_stats['num_requests']} requests."
+    # log outgoing message into database, and how long each stage took
+    trace.reply = log_message(
+        message.author, openai_response, category_name, channel_name, "to", course_name
     )
+    save_trace(trace, "answered" if is_response else "error")
+
+    # a failed request doesn't count against the user's daily limit
+    if not is_response:
+        refund_request(user_stats, request_day)
+
+    # an answer made outside the user's conversation joins it now that it's sent, before any compaction
+    if is_response and detached:
+        try:
+            await conversation_store.add_turn(conversation, message_content, answer)
+        except Exception as e:
+            logger.error("Failed to add turn to OpenAI Conversation: %s", e)
+
+    # roll a long conversation over to a new one seeded with a summary, now that the reply is sent
+    conversation_config = oa_config.get("conversation", {})
+    if conversation and conversation_store.needs_compaction(
+        conversation,
+        conversation_config.get("max_turns", CONVERSATION_DEFAULT_MAX_TURNS),
+        conversation_config.get("max_tokens", CONVERSATION_DEFAULT_MAX_TOKENS),
+    ):
+        try:
+            await conversation_store.compact(
+                conversation,
+                message.author,
+                conversation_config.get(
+                    "summary_model", oa_config.get("model", OPENAI_DEFAULT_MODEL)
+                ),
+            )
+        except Exception as e:
+            # the old conversation stays active, and compaction is retried after the next reply
+            logger.error("Failed to compact OpenAI Conversation: %s", e)
 
 
 # Run the main function if running this file directly.
 if __name__ == "__main__":
-    asyncio.run(client.start(BOT_TOKEN))
+    parser = argparse.ArgumentParser(description="Discord bot that answers messages.")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=os.path.join(PROFILING_DEFAULT_DIR, f"{program_file_base}.pstats"),
+        metavar="FILE",
+        help="Profile the whole run with cProfile, writing pstats data to the file, and a summary next to it.",
+    )
+    args = parser.parse_args()
+    if args.profile:
+        with profile_run(args.profile):
+            asyncio.run(client.start(BOT_TOKEN))
+    else:
+        asyncio.run(client.start(BOT_TOKEN))
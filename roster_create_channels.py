@@ -9,17 +9,18 @@ import os
 import csv
 import asyncio
 from pathlib import Path
-import yaml
 from dotenv import load_dotenv
 import discord
+from openai import AsyncOpenAI
 from discord_manager import DiscordManager
+from bot_config import load_config, get_servers, find_course
+from conversation_store import ConversationStore
 
 load_dotenv()  # load environment variables from .env file
 
 # SETTINGS
 COURSE_TITLE = "Introduction to Programming"
 STUDENT_CATEGORY_NAME = "PYTHON - STUDENTS 01"
-CONFIG_FILE = Path("bot_config.yml").resolve()  # path to the configuration file
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # from .env file
 
 # Discord can only do up to 50 channels per category, adjust the STUDENT_CATEGORY_NAME above
@@ -27,30 +28,21 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")  # from .env file
 ROSTER_START_ROW = 1  # row number to start reading from in the CSV file (1-indexed)
 ROSTER_END_ROW = 50  # row number to stop reading from in the CSV file (1-indexed)...
 
-# load the data in bot_config.yml into a Dictionary
-with open(CONFIG_FILE, encoding="utf-8", mode="r") as f:
-    config = yaml.safe_load(f)
-    # get server name
-    SERVER_NAME = config["server"]["name"]
-    # select the desired course based on its title
-    matching_courses = [
-        course
-        for course in config["server"]["courses"]
-        if course["title"] == COURSE_TITLE
-    ]
-    if not matching_courses:
-        raise RuntimeError(f"Course with title '{COURSE_TITLE}' not found in config.")
-    else:
-        # assuming we have a matching course, get it from the list
-        course = matching_courses[0]
-
-    # determine the roster file name based on the course file prefix in the config
-    roster_files = [f"{course['file_prefix']}-result.csv"]
-    admins_roles = [course["roles"]["admins"]]
-    students_roles = [course["roles"]["students"]]
-
-    if not roster_files or not admins_roles or not students_roles:
-        raise RuntimeError("Error loading data from config file.")
+# load the data in bot_config.yml... the course may be in any of the configured servers
+config = load_config()
+server, course = find_course(get_servers(config), COURSE_TITLE)
+if not course:
+    raise RuntimeError(f"Course with title '{COURSE_TITLE}' not found in config.")
+# get the name of the server this course lives in
+SERVER_NAME = server["name"]
+
+# determine the roster file name based on the course file prefix in the config
+roster_files = [f"{course['file_prefix']}-result.csv"]
+admins_roles = [course["roles"]["admins"]]
+students_roles = [course["roles"]["students"]]
+
+if not roster_files or not admins_roles or not students_roles:
+    raise RuntimeError("Error loading data from config file.")
 
 ROSTER_FILE = Path(roster_files[0]).resolve()  # path to the roster CSV file
 ADMINS_ROLE = admins_roles[0]
@@ -65,9 +57,20 @@ Config:
 )
 
 
+# create each student's OpenAI conversation ahead of their first question, if the course wants it
+# courses with an answer cache answer without conversations, so have none to pre-warm
+oa_config = course.get("openai_assistant", {})
+PREWARM_CONVERSATIONS = oa_config.get("conversation", {}).get(
+    "prewarm", False
+) and not oa_config.get("answer_cache", {}).get("enabled", False)
+conversation_store = ConversationStore(AsyncOpenAI()) if PREWARM_CONVERSATIONS else None
+
 # start up bot set to create a category, if not yet exists
 client = DiscordManager(
-    guild_id=SERVER_NAME, event_loop=True, create_category=STUDENT_CATEGORY_NAME
+    guild_id=SERVER_NAME,
+    event_loop=True,
+    create_category=STUDENT_CATEGORY_NAME,
+    rate_limit_priority="bulk",  # make way for the response bot, if it is running
 )
 
 
@@ -113,6 +116,7 @@ async def create_channels():
         await client.stop()
         return
     guild = client.get_guild(guild_id)
+    prewarms = []  # conversations being created in the background
 
     # open the roster file
     with open(ROSTER_FILE, newline="", encoding="utf-8") as csvfile:
@@ -136,6 +140,17 @@ async def create_channels():
                         match_display_names=True,
                     )
                     member = discord.utils.get(guild.members, id=member_id)
+                    suggestions = (
+                        []
+                        if member_id
+                        else client.suggest_users(
+                            guild_id=guild_id, user_name=member_name
+                        )
+                    )
+                    for suggested_id, suggested_name, score in suggestions:
+                        print(
+                            f"User @{member_name} not found... did they mean @{suggested_name} (ID: {suggested_id}, score: {score})?"
+                        )
                     admins_role_id = client.get_role_id(
                         guild_id=guild_id, role_name=ADMINS_ROLE
                     )
@@ -151,6 +166,12 @@ async def create_channels():
                         overwrites[member] = discord.PermissionOverwrite(
                             read_messages=True, send_messages=True
                         )
+                        if conversation_store:
+                            prewarms.append(
+                                asyncio.create_task(
+                                    conversation_store.get(member, COURSE_TITLE)
+                                )
+                            )
                     else:
                         print(f"User @{member_name} not found, no permissions set.")
                     if admins_role_id:
@@ -191,6 +212,13 @@ async def create_channels():
                         welcome_message = f"<@&{member.name}>, this channel is for conversation between you and <@&{admins_role_id}>."
                     else:
                         welcome_message = f"This channel is for conversation between {first_name} {last_name} and <@&{admins_role_id}>. However, the Discord username {first_name} entered into the intake questionnaire is incorrect... we need to manually correct it."
+                        if suggestions:
+                            # help whoever fixes it by hand... by name, as mentions would ping the wrong people
+                            possible_matches = ", ".join(
+                                f"@{suggested_name} ({score:.0%})"
+                                for suggested_id, suggested_name, score in suggestions
+                            )
+                            welcome_message += f" Possible matches: {possible_matches}."
                     message = f"""
 {welcome_message}
 Student details:
@@ -208,6 +236,16 @@ Student details:
                 except Exception as e:
                     print(f"Failed to create channel {channel_name}: {e}")
 
+    # wait for the students' conversations to be ready
+    results = await asyncio.gather(*prewarms, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Failed to pre-warm conversation: {result}")
+    if prewarms:
+        print(
+            f"Pre-warmed {len(prewarms) - sum(isinstance(result, Exception) for result in results)} student conversations."
+        )
+
 
 # Run the main function if running this file directly.
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Report latency percentiles of the messages the bot handled, from their traces.
+Group by course to compare courses, or by hour to spot when replies got slower.
+Examples:
+    python trace_report.py
+    python trace_report.py --by hour --days 2 --course "Software Engineering"
+    python trace_report.py --stage openai --by model
+"""
+
+import math
+import argparse
+import datetime
+from models.message_trace import MessageTrace
+
+# stage -> (trace field the stage starts at, trace field it ends at)
+STAGES = {
+    "total": ("received_at", "sent_at"),
+    "routing": ("received_at", "routed_at"),
+    "queue_wait": ("queued_at", "started_at"),
+    "first_byte": ("requested_at", "first_byte_at"),
+    "openai": ("requested_at", "completed_at"),
+    "send": ("completed_at", "sent_at"),
+}
+GROUPINGS = ["course", "hour", "day", "model", "outcome"]
+
+
+def percentile(sorted_values, p):
+    """
+    Get a percentile of sorted values, by the nearest-rank method.
+
+    Args:
+        sorted_values (list): The values, in ascending order.
+        p (float): The percentile, from 0 to 100.
+    Returns:
+        float: The percentile.
+    """
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def group_key(trace, by):
+    """
+    Get the group a trace belongs to.
+    """
+    if by == "hour":
+        return trace.received_at.strftime("%Y-%m-%d %H:00")
+    if by == "day":
+        return trace.received_at.strftime("%Y-%m-%d")
+    return getattr(trace, by) or "-"
+
+
+def collect(stage="total", by="course", days=7, course=None):
+    """
+    Collect the duration of a stage for each traced message, by group.
+
+    Args:
+        stage (str): The stage to measure, one of STAGES.
+        by (str): How to group messages, one of GROUPINGS.
+        days (float): How many days back to look.
+        course (str): The title of the course to limit the report to, if any.
+    Returns:
+        dict: Group -> (list of durations in seconds, number of errors).
+    """
+    start_field, end_field = (getattr(MessageTrace, name) for name in STAGES[stage])
+    since = datetime.datetime.now() - datetime.timedelta(days=days)
+    query = MessageTrace.select().where(
+        (MessageTrace.received_at >= since)
+        & start_field.is_null(False)
+        & end_field.is_null(False)
+    )
+    if course:
+        query = query.where(MessageTrace.course == course)
+
+    durations, errors = {}, {}
+    for trace in query.order_by(MessageTrace.received_at):
+        key = group_key(trace, by)
+        start, end = getattr(trace, start_field.name), getattr(trace, end_field.name)
+        durations.setdefault(key, []).append((end - start).total_seconds())
+        errors[key] = errors.get(key, 0) + (1 if trace.error_class else 0)
+    return {key: (durations[key], errors[key]) for key in durations}
+
+
+def report(groups):
+    """
+    Summarize each group's durations.
+
+    Args:
+        groups (dict): Group -> (list of durations in seconds, number of errors), from collect().
+    Returns:
+        list: A row per group, with the number of messages, errors, and the p50, p95, p99, and maximum durations.
+    """
+    rows = []
+    for key, (durations, errors) in groups.items():
+        durations = sorted(durations)
+        rows.append(
+            {
+                "group": key,
+                "count": len(durations),
+                "errors": errors,
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "p99": percentile(durations, 99),
+                "max": durations[-1],
+            }
+        )
+    return rows
+
+
+# Run from the command line to print a report
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Latency percentiles of handled messages."
+    )
+    parser.add_argument(
+        "--stage",
+        choices=list(STAGES),
+        default="total",
+        help="Stage of handling to measure. Defaults to the whole time from receipt to reply.",
+    )
+    parser.add_argument(
+        "--by", choices=GROUPINGS, default="course", help="How to group messages."
+    )
+    parser.add_argument(
+        "--days", type=float, default=7, help="How many days back to look."
+    )
+    parser.add_argument("--course", help="Title of the course to report on.")
+    args = parser.parse_args()
+
+    rows = report(collect(args.stage, args.by, args.days, args.course))
+    print(f"'{args.stage}' latency in seconds over the last {args.days:g} days:")
+    print(
+        f"{args.by:<36} {'count':>7} {'errors':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    )
+    for row in rows:
+        print(
+            f"{str(row['group'])[:36]:<36} {row['count']:>7} {row['errors']:>7} {row['p50']:>8.2f} {row['p95']:>8.2f} {row['p99']:>8.2f} {row['max']:>8.2f}"
+        )
+    if not rows:
+        print("No traced messages found.")
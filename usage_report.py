@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+Report how much the bot is used, e.g. questions per course per day, or the top users this week.
+Reports read the daily usage totals kept up to date as messages are logged, so they stay
+instant however many messages there are.
+Examples:
+    python usage_report.py                              # questions per course per day, last 30 days
+    python usage_report.py --by user --days 7 --top 20  # top 20 users this week
+    python usage_report.py --by category --course "Software Engineering"
+    python usage_report.py --rebuild                    # recompute totals from the logged messages
+"""
+
+import argparse
+import datetime
+from peewee import fn
+from models.usage_rollup import UsageRollup
+from models.user import User
+
+GROUPINGS = ["course", "category", "user", "day"]
+
+
+def collect(by=("course", "day"), days=30, course=None, top=None):
+    """
+    Total the usage in each group.
+
+    Args:
+        by (tuple): How to group usage, any of GROUPINGS.
+        days (float): How many days back to look, including today.
+        course (str): The title of the course to limit the report to, if any.
+        top (int): Only the groups with the most questions, if given. Otherwise groups are in order.
+    Returns:
+        list: A dict per group, with its grouping values, questions, replies, and average question and reply lengths.
+    """
+    # grouping -> (what to show, what to group by)
+    groups = {
+        "course": (UsageRollup.course, UsageRollup.course),
+        "category": (UsageRollup.category, UsageRollup.category),
+        "user": (fn.coalesce(User.discord_username, User.id), UsageRollup.user),
+        "day": (UsageRollup.day, UsageRollup.day),
+    }
+    columns = [groups[name][0].alias(name) for name in by]
+    group_by = [groups[name][1] for name in by]
+    questions = fn.sum(UsageRollup.questions)
+    replies = fn.sum(UsageRollup.replies)
+    since = datetime.date.today() - datetime.timedelta(days=max(days - 1, 0))
+    query = (
+        UsageRollup.select(
+            *columns,
+            questions.alias("questions"),
+            replies.alias("replies"),
+            fn.sum(UsageRollup.question_chars).alias("question_chars"),
+            fn.sum(UsageRollup.reply_chars).alias("reply_chars"),
+        )
+        .join(User)
+        .where(UsageRollup.day >= since)
+        .group_by(*group_by)
+    )
+    if course:
+        query = query.where(UsageRollup.course == course)
+    if top:
+        query = query.order_by(questions.desc()).limit(top)
+    else:
+        query = query.order_by(*group_by)
+
+    rows = []
+    for row in query.dicts():
+        row["avg_question_chars"] = row.pop("question_chars") / max(row["questions"], 1)
+        row["avg_reply_chars"] = row.pop("reply_chars") / max(row["replies"], 1)
+        rows.append(row)
+    return rows
+
+
+def courses_by_category():
+    """
+    Get the course each configured Discord category belongs to, from bot_config.yml.
+
+    Returns:
+        dict: Category name -> course title.
+    """
+    from bot_config import load_config, get_servers
+
+    return {
+        category_name: course["title"]
+        for server in get_servers(load_config())
+        for course in server["courses"]
+        for category_name in course.get("categories", [])
+    }
+
+
+# Run from the command line to print a report
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Usage of the bot.")
+    parser.add_argument(
+        "--by",
+        choices=GROUPINGS,
+        action="append",
+        help="How to group usage. Can be given several times. Defaults to course and day.",
+    )
+    parser.add_argument(
+        "--days", type=float, default=30, help="How many days back to look."
+    )
+    parser.add_argument("--course", help="Title of the course to report on.")
+    parser.add_argument(
+        "--top", type=int, help="Only show this many groups, with the most questions."
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recompute the daily totals from the logged messages first, e.g. after upgrading. Totals from before the earliest message still logged in each category, e.g. of archived months, are kept as they are.",
+    )
+    args = parser.parse_args()
+
+    UsageRollup.create_table(safe=True)
+    if args.rebuild:
+        count = UsageRollup.rebuild(courses_by_category())
+        print(f"Rebuilt {count} daily usage totals.")
+
+    by = args.by or ["course", "day"]
+    rows = collect(by, args.days, args.course, args.top)
+    print(f"Usage over the last {args.days:g} days:")
+    print(
+        " ".join(f"{name:<24}" for name in by)
+        + f" {'questions':>9} {'replies':>9} {'avg q len':>9} {'avg r len':>9}"
+    )
+    for row in rows:
+        print(
+            " ".join(f"{str(row[name] or '-')[:24]:<24}" for name in by)
+            + f" {row['questions']:>9} {row['replies']:>9} {row['avg_question_chars']:>9.0f} {row['avg_reply_chars']:>9.0f}"
+        )
+    if not rows:
+        print("No usage found.")